@@ -0,0 +1,300 @@
+"""
+Benchmarks of the network model: construction of the weight matrices, simulations with run on a grid of network
+sizes, durations, time steps and monitors, and the compute parts of the figure experiments (the run_fig* function of
+each exp_fig* function, which simulates without plotting) for full and mean-population networks. For each benchmark,
+the wall time, the number of integration steps per second (time steps times batch size, as counted by the
+simulations; the shared beginning of branched simulations counts once per branch) and the peak memory allocated
+during the benchmark are written to a JSON file, together with the revision of the code, so that revisions can be
+compared.
+
+Usage (from the code directory):
+    python benchmarks.py                                  all suites, results in ../results/benchmarks/
+    python benchmarks.py --quick --suites run figures     smaller grids and only mean-population figures
+    python benchmarks.py --quick --no-memory              timing only (the peak memory is measured in an extra call
+                                                          with tracemalloc, which slows it down severalfold)
+    python benchmarks.py --compare old.json new.json      ratios of the wall times and peak memory
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import functools
+import contextlib
+import itertools
+import subprocess
+import tracemalloc
+import numpy as np
+import scipy
+
+import model_base as mb
+import exp_fig3_competition as fig3
+import exp_fig4_switching as fig4
+import exp_fig5_timescale as fig5
+import exp_fig6_predictive_coding as fig6
+from inputs import Pulse
+
+
+# sizes of the networks: 'mean_pop' (one neuron per population) or factor of the default numbers of neurons
+SIZES = ['mean_pop', 1, 4, 16]
+
+# monitor flags of run
+MONITOR_FLAGS = dict(none=dict(), dend_inh=dict(monitor_dend_inh=True),
+                     all=dict(monitor_boutons=True, monitor_dend_inh=True, monitor_currents=True))
+
+# parameter grids of the simulation benchmarks
+RUN_GRID = dict(size=SIZES, dur=[1000, 4000], dt=[1, 0.5], monitors=list(MONITOR_FLAGS))
+QUICK_RUN_GRID = dict(size=['mean_pop', 1, 4], dur=[1000], dt=[1], monitors=['none', 'all'])
+
+# benchmark suites
+SUITES = ['construction', 'run', 'figures']
+
+
+def get_params(size):
+    """Default parameters (see model_base.get_default_params) of a network size (see SIZES)."""
+    N_cells, w_mean, conn_prob, bg_inputs, taus = mb.get_default_params(flag_mean_pop=size == 'mean_pop')
+    if size != 'mean_pop':
+        N_cells = {cell: n * size for cell, n in N_cells.items()}
+    return N_cells, w_mean, conn_prob, bg_inputs, taus
+
+
+def measure(func, setup=None, repeat=1, memory=True):
+    """
+    Measure the wall time and peak memory of a function.
+
+    Parameters:
+    ----------
+    - func:   function that returns the number of integration steps it performed (or None)
+    - setup:  function that returns a tuple of arguments of func, called before each measurement and not timed
+    - repeat: number of timed calls, the fastest is reported
+    - memory: whether to measure the peak memory in an additional call (with tracemalloc, which slows down the call)
+
+    Returns:
+    -------
+    - dictionary with the wall time (in s), the number of steps, the steps per second and the peak memory (in bytes)
+      allocated during the call
+    """
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+        t0 = time.perf_counter()
+        steps = func(*args)
+        times.append(time.perf_counter() - t0)
+    peak = None
+    if memory:
+        args = setup() if setup is not None else ()
+        tracemalloc.start()
+        func(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    wall_time = min(times)
+    return dict(wall_time=wall_time, steps=steps, steps_per_s=steps / wall_time if steps else None, peak_bytes=peak)
+
+
+# Construction and simulation benchmarks
+# --------------------------------------
+
+def construction_suite(sizes=SIZES, repeat=3, memory=True):
+    """
+    Construction of networks (weight matrices, see NetworkModel.make_weight_mat) of different sizes, with dense and
+    sparse weights.
+    """
+    records = []
+    for size, flag_sparse in itertools.product(sizes, [False, True]):
+        N_cells, w_mean, conn_prob, bg_inputs, taus = get_params(size)
+
+        def func():
+            mb.NetworkModel(N_cells, dict(w_mean), conn_prob, taus, dict(bg_inputs), flag_w_hetero=True,
+                            flag_sparse=flag_sparse, seed=0)
+
+        params = dict(size=size, flag_sparse=flag_sparse)
+        records.append(dict(suite='construction', name=_name('init', params), params=params,
+                            **measure(func, repeat=repeat, memory=memory)))
+    return records
+
+
+def run_suite(grid=RUN_GRID, repeat=3, memory=True):
+    """
+    Simulations with run for all combinations of a grid of network sizes, durations, time steps and monitors (see
+    RUN_GRID), with noise and a pulse of input to NDNFs.
+    """
+    records = []
+    for values in itertools.product(*grid.values()):
+        params = dict(zip(grid, values))
+        N_cells, w_mean, conn_prob, bg_inputs, taus = get_params(params['size'])
+        dur = params['dur']
+        setup = lambda: (mb.NetworkModel(N_cells, dict(w_mean), conn_prob, taus, dict(bg_inputs), flag_w_hetero=True,
+                                         seed=0),)
+        func = lambda model: model.run(dur, dict(N=Pulse(1, dur/4, dur/2)), dt=params['dt'], noise=0.1,
+                                       **MONITOR_FLAGS[params['monitors']]).total_steps
+        records.append(dict(suite='run', name=_name('run', params), params=params,
+                            **measure(func, setup, repeat=repeat, memory=memory)))
+    return records
+
+
+# Compute parts of the figure experiments
+# ---------------------------------------
+
+# simulations of the exp_fig* functions (with the arguments of the figures), which return the number of integration
+# steps with their results ('n_steps', None for the continuation, which does not integrate in time)
+FIGURES = dict(fig3AB_top_vary_NDNF_input=fig3.run_fig3AB_top_vary_NDNF_input,
+               fig3AB_bottom_total_dendritic_inhibition=fig3.run_fig3AB_bottom_total_dendritic_inhibition,
+               fig3CD_amplifcation_ndnf_inhibition=fig3.run_fig3CD_amplifcation_ndnf_inhibition,
+               fig4BC_bistability=functools.partial(fig4.run_fig4BC_bistability, n_workers=1, seed=0),
+               fig4_bistability_continuation=fig4.run_fig4_bistability_continuation,
+               fig4DEFG_mutual_inhibition=functools.partial(fig4.run_fig4DEFG_mutual_inhibition, wNS=1.2),
+               fig5B_IPSC_timescale=fig5.run_fig5B_IPSC_timescale,
+               fig5CD_transient_signals=fig5.run_fig5CD_transient_signals,
+               fig5E_inh_change=fig5.run_fig5E_inh_change,
+               fig6_predictive_coding=fig6.run_fig6_predictive_coding)
+
+# figure experiments of quick runs (without the sweep of Figure 4B/C, which takes about a minute)
+QUICK_FIGURES = [name for name in FIGURES if name != 'fig4BC_bistability']
+
+
+def figure_suite(names=None, mean_pop=(False, True), repeat=1, memory=True):
+    """
+    Compute parts of the figure experiments (see FIGURES), for full and mean-population networks. The progress
+    messages of the experiments are not printed.
+    """
+    records = []
+    for name, flag_mean_pop in itertools.product(list(FIGURES) if names is None else names, mean_pop):
+        params = dict(mean_pop=flag_mean_pop)
+
+        def func():
+            with contextlib.redirect_stdout(io.StringIO()):
+                return FIGURES[name](mean_pop=flag_mean_pop).get('n_steps')
+
+        records.append(dict(suite='figures', name=_name(name, params), params=params,
+                            **measure(func, repeat=repeat, memory=memory)))
+    return records
+
+
+# Running and comparing benchmarks
+# --------------------------------
+
+def _name(name, params):
+    return f"{name}[{','.join(f'{key}={value}' for key, value in params.items())}]"
+
+
+def revision():
+    """Git revision of the code (with a mark if there are uncommitted changes), or None outside a repository."""
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True)
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                               text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return rev.stdout.strip() + ('-dirty' if dirty.stdout.strip() else '')
+
+
+def run_benchmarks(suites=SUITES, quick=False, repeat=None, memory=True, verbose=True):
+    """
+    Run benchmark suites.
+
+    Parameters:
+    ----------
+    - suites:  names of the suites (see SUITES)
+    - quick:   if True, use smaller grids (see QUICK_RUN_GRID) and only mean-population figure experiments
+               (see QUICK_FIGURES)
+    - repeat:  number of timed calls per benchmark (default: 3, 1 for the figures)
+    - memory:  whether to measure the peak memory of each benchmark
+    - verbose: whether to print the results while running
+
+    Returns:
+    -------
+    - dictionary with the environment ('meta') and the list of results ('results')
+    """
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        raise ValueError(f"Unknown benchmark suites {sorted(unknown)}, use any of {SUITES}.")
+
+    meta = dict(revision=revision(), time=time.strftime('%Y-%m-%dT%H:%M:%S'), python=platform.python_version(),
+                numpy=np.__version__, scipy=scipy.__version__, platform=platform.platform(),
+                cpus=os.cpu_count(), quick=quick)
+    results = []
+    for suite in suites:
+        if suite == 'construction':
+            records = construction_suite(SIZES[:3] if quick else SIZES, repeat or 3, memory)
+        elif suite == 'run':
+            records = run_suite(QUICK_RUN_GRID if quick else RUN_GRID, repeat or 3, memory)
+        else:
+            records = figure_suite(QUICK_FIGURES if quick else None, mean_pop=(True,) if quick else (False, True),
+                                   repeat=repeat or 1, memory=memory)
+        if verbose:
+            for record in records:
+                print(_format(record))
+        results += records
+
+    return dict(meta=meta, results=results)
+
+
+def _format(record):
+    steps = f"{record['steps_per_s']:12.4g} steps/s" if record['steps_per_s'] else ' ' * 20
+    memory = f"{record['peak_bytes'] / 2**20:9.1f} MiB" if record['peak_bytes'] is not None else ''
+    return f"{record['name']:<64} {record['wall_time']:9.3f} s {steps} {memory}"
+
+
+def save(report, file=None):
+    """Write benchmark results to a JSON file (default: ../results/benchmarks/benchmarks_<revision>.json)."""
+    if file is None:
+        file = f"../results/benchmarks/benchmarks_{report['meta']['revision'] or 'unknown'}.json"
+    os.makedirs(os.path.dirname(os.path.abspath(file)), exist_ok=True)
+    with open(file, 'w') as f:
+        json.dump(report, f, indent=1)
+    return file
+
+
+def compare(old, new, verbose=True):
+    """
+    Compare two sets of benchmark results (e.g. of two revisions).
+
+    Parameters:
+    ----------
+    - old, new: benchmark results (see run_benchmarks) or paths of their JSON files
+    - verbose:  whether to print a table of the ratios
+
+    Returns:
+    -------
+    - dictionary of the ratios new/old of the wall times ('time') and peak memory ('memory') of each benchmark that
+      is part of both
+    """
+    reports = []
+    for report in [old, new]:
+        if isinstance(report, (str, os.PathLike)):
+            with open(report) as f:
+                report = json.load(f)
+        reports.append({record['name']: record for record in report['results']})
+    old, new = reports
+
+    ratios = dict()
+    for name in [name for name in new if name in old]:
+        memory = None
+        if old[name]['peak_bytes'] and new[name]['peak_bytes'] is not None:
+            memory = new[name]['peak_bytes'] / old[name]['peak_bytes']
+        ratios[name] = dict(time=new[name]['wall_time'] / old[name]['wall_time'], memory=memory)
+        if verbose:
+            memory = f"{memory:8.2f}" if memory is not None else ''
+            print(f"{name:<64} time {ratios[name]['time']:6.2f}   memory {memory}")
+    return ratios
+
+
+if __name__ in "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmarks of the network model.")
+    parser.add_argument('--suites', nargs='+', default=SUITES, choices=SUITES, help="benchmark suites to run")
+    parser.add_argument('--quick', action='store_true', help="smaller grids and only mean-population figures")
+    parser.add_argument('--repeat', type=int, default=None, help="number of timed calls per benchmark")
+    parser.add_argument('--no-memory', action='store_true', help="do not measure the peak memory")
+    parser.add_argument('--out', default=None, help="JSON file of the results")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="compare two JSON files of results")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit()
+    report = run_benchmarks(args.suites, args.quick, args.repeat, not args.no_memory)
+    print(f"Results written to {save(report, args.out)}")
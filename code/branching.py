@@ -0,0 +1,138 @@
+"""
+Shared-prefix simulations: conditions that only differ after some time (e.g. in the stimulus that follows a baseline
+period) are simulated together until then, and the final state of this common prefix is forked into one branch per
+condition (see NetworkModel.run with a NetworkState).
+"""
+
+import numpy as np
+
+import caching
+import inputs
+import profiling
+import recording
+from results import Monitors, NetworkState, SimulationResult
+
+
+# noise of the branches: continue the noise of the prefix in every branch, or draw independent noise per branch
+NOISE_MODES = ['common', 'independent']
+
+
+def fork(model, state, n, noise='independent'):
+    """
+    Fork a network state into branches.
+
+    Parameters:
+    ----------
+    - model: NetworkModel that the state belongs to
+    - state: NetworkState (e.g. the final state of a simulation)
+    - n:     number of branches
+    - noise: 'common': every branch continues the random streams of the state, so all branches receive the same
+                       noise (as if each condition had been simulated from the start with the same noise);
+             'independent': each branch draws its noise from its own stream, derived from the state and the
+                       position of the branch (reproducible for a given state)
+
+    Returns:
+    -------
+    - list of (state, rng) of each branch, to be passed to NetworkModel.run (state=state, rng=rng)
+    """
+
+    if noise not in NOISE_MODES:
+        raise ValueError(f"Unknown noise mode '{noise}', use one of {NOISE_MODES}.")
+    if noise == 'common' or state.rng is None:
+        return [(state, None) for _ in range(n)]
+
+    detached = NetworkState(state.v, state.p, state.slices, state.t)  # the streams of the model are not restored
+    return [(detached, np.random.default_rng(caching.content_seed(model.seed_seq, ('branch', state.rng, i))))
+            for i in range(n)]
+
+
+def run_branches(model, dur, t_branch, branches, prefix_xFF=None, branch_noise='independent', dt=1,
+                 stitch=True, early_stop=None, **kwargs):
+    """
+    Simulate several conditions that share their first t_branch ms: the prefix is simulated once and each condition
+    (branch) continues from its final state. Stitched together, each branch is the same as a simulation of the full
+    duration (with the noise of the prefix before t_branch).
+
+    Parameters:
+    ----------
+    - model:        NetworkModel
+    - dur:          duration of each condition (in ms)
+    - t_branch:     time at which the conditions start to differ (in ms)
+    - branches:     list of dictionaries of inputs of each condition (see NetworkModel.run), on the time axis of the
+                    full simulation (their values before t_branch are only used for the prefix if prefix_xFF is None)
+    - prefix_xFF:   dictionary of inputs during the prefix (default: inputs of the first branch)
+    - branch_noise: noise of the branches, 'independent' or 'common' (see fork)
+    - dt:           time step (in ms)
+    - stitch:       whether to return the full trajectories (prefix followed by the branch) or only those of the
+                    branches (starting with the state at t_branch, times relative to t_branch)
+    - early_stop:   early stopping criterion of the branches (see NetworkModel.run), the prefix is always simulated
+                    until t_branch
+    - kwargs:       further arguments of NetworkModel.run (e.g. noise, monitor_dend_inh, record, rE0), used for the
+                    prefix and all branches
+
+    Returns:
+    -------
+    - list of SimulationResult of each branch
+    """
+
+    t = np.arange(0, dur, dt)
+    n_prefix = int(round(t_branch / dt))
+    if not 0 < n_prefix < len(t):
+        raise ValueError(f"The branching time {t_branch} ms must lie within the simulation (0, {dur}) ms.")
+    kwargs['record'] = recording.as_recorder(kwargs.get('record'))
+    stride = kwargs['record'].stride
+    if stitch and n_prefix % stride:
+        raise ValueError(f"The recording stride {stride} has to divide the number of time steps before branching "
+                         f"({n_prefix}).")
+
+    # simulate the common prefix until (and including) the branching time
+    prefix_xFF = branches[0] if prefix_xFF is None else prefix_xFF
+    prefix = model.run((n_prefix+1) * dt, prefix_xFF, dt=dt, **kwargs)
+
+    # continue each branch from the final state of the prefix
+    results = []
+    for xFF, (state, rng) in zip(branches, fork(model, prefix.state, len(branches), branch_noise)):
+        xFF = {cell: inputs.shift_input(spec, n_prefix, dt) for cell, spec in xFF.items()}
+        branch_kwargs = dict(kwargs, rng=rng) if rng is not None else kwargs
+        res = model.run((len(t) - n_prefix) * dt, xFF, dt=dt, state=state, early_stop=early_stop, **branch_kwargs)
+        results.append(_stitch(prefix, res, t, n_prefix, stride) if stitch else res)
+
+    return results
+
+
+def _stitch(prefix, branch, t, n_prefix, stride):
+    """
+    Join the trajectories of the prefix before the branching time and those of a branch (which starts with the state
+    at the branching time).
+
+    Parameters:
+    ----------
+    - prefix:   SimulationResult of the prefix (until and including the branching time)
+    - branch:   SimulationResult of the branch
+    - t:        time array of the full simulation
+    - n_prefix: time step of the branching time
+    - stride:   recording stride
+
+    Returns:
+    -------
+    - SimulationResult
+    """
+
+    k = len(range(0, n_prefix, stride))  # stored time points before the branching time
+
+    def join(before, after):
+        # the prefix also holds the values at the branching time (except for the currents), and the monitored
+        # inhibition of the prefix there is the input of the last step instead of an initial value
+        return None if after is None else np.concatenate([before, after[len(before) - k:]])
+
+    fields = [join(getattr(prefix, field), getattr(branch, field)) for field in SimulationResult.fields[1:-1]]
+    other = Monitors(dict(), list(branch.other), lambda name: {name: join(prefix.other[name], branch.other[name])})
+
+    integration = dict(branch.integration, n_steps=prefix.integration['n_steps'] + branch.integration['n_steps'])
+    if branch.integration['local_error'] is not None:
+        integration['local_error'] = max(prefix.integration['local_error'], branch.integration['local_error'])
+    stop_time = None if branch.stop_time is None else t[n_prefix] + branch.stop_time
+
+    return SimulationResult(t[::stride][:k + len(branch.t)], *fields, other, stop_reason=branch.stop_reason,
+                            stop_time=stop_time, integration=integration, state=branch.state, Xbg=prefix.Xbg,
+                            profile=profiling.merge([prefix.profile, branch.profile]))
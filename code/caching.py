@@ -0,0 +1,241 @@
+"""
+Content-addressed disk cache of simulation results (see NetworkModel.run), keyed by an immutable, hashable
+representation of the parameters (see freeze).
+"""
+
+import os
+import types
+import pickle
+import hashlib
+import importlib
+import warnings
+from functools import lru_cache
+from collections.abc import Mapping
+import numpy as np
+from scipy import sparse
+
+
+# modules whose source code determines simulation results (part of every cache key)
+CODE_MODULES = ['model_base', 'kernels', 'inputs', 'recording', 'stopping']
+
+
+def freeze(obj):
+    """
+    Convert an object into an immutable, hashable representation of its content (nested tuples). Arrays are
+    represented by a digest of their values, random generators by their state and other objects by their class and
+    attributes.
+
+    Parameters:
+    ----------
+    - obj: scalar, string, array, sparse matrix, dictionary, list, tuple, set, numpy dtype, random Generator or
+           SeedSequence, or object with attributes (e.g. input protocols)
+
+    Returns:
+    -------
+    - frozen representation, equal for objects with equal content
+    """
+
+    if obj is None or isinstance(obj, (bool, int, float, complex, str, bytes)):
+        return obj
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.dtype):
+        return ('dtype', obj.str)
+    if isinstance(obj, Mapping):
+        return ('dict',) + tuple(sorted(((freeze(key), freeze(value)) for key, value in obj.items()), key=repr))
+    if isinstance(obj, (list, tuple)):
+        return (type(obj).__name__,) + tuple(freeze(value) for value in obj)
+    if isinstance(obj, slice):
+        return ('slice', obj.start, obj.stop, obj.step)
+    if isinstance(obj, (set, frozenset)):
+        return ('set',) + tuple(sorted((freeze(value) for value in obj), key=repr))
+    if isinstance(obj, np.ndarray):
+        if obj.dtype == object:
+            return ('ndarray', obj.shape) + tuple(freeze(value) for value in obj.ravel())
+        digest = hashlib.sha256(np.ascontiguousarray(obj).tobytes()).hexdigest()
+        return ('ndarray', str(obj.dtype), obj.shape, digest)
+    if sparse.issparse(obj):
+        obj = obj.tocsr()
+        return ('sparse', obj.shape, freeze(obj.data), freeze(obj.indices), freeze(obj.indptr))
+    if isinstance(obj, np.random.Generator):
+        return ('Generator', freeze(obj.bit_generator.state))
+    if isinstance(obj, np.random.SeedSequence):
+        return ('SeedSequence', freeze(obj.entropy), freeze(obj.spawn_key), obj.pool_size)
+    if isinstance(obj, (types.FunctionType, types.MethodType, types.BuiltinFunctionType)):
+        raise TypeError(f"Cannot freeze function {obj!r}, its result is not determined by its content.")
+    if hasattr(obj, '__dict__'):
+        return (f"{type(obj).__module__}.{type(obj).__qualname__}", freeze(vars(obj)))
+    raise TypeError(f"Cannot freeze object of type {type(obj).__name__}.")
+
+
+def digest(obj):
+    """Hexadecimal SHA-256 digest of the content of an object (see freeze)."""
+    return hashlib.sha256(repr(freeze(obj)).encode()).hexdigest()
+
+
+@lru_cache()
+def code_version():
+    """Digest of the source code of the modules that determine simulation results (see CODE_MODULES)."""
+    sources = []
+    for name in CODE_MODULES:
+        with open(importlib.import_module(name).__file__, 'rb') as f:
+            sources.append(f.read())
+    return hashlib.sha256(b''.join(sources)).hexdigest()
+
+
+def content_seed(root, obj):
+    """
+    Seed that is determined by a root seed and the content of an object, e.g. by the parameters of a point of a
+    sweep, so that the same parameters get the same seed in any sweep.
+
+    Parameters:
+    ----------
+    - root: numpy SeedSequence
+    - obj:  object (see freeze)
+
+    Returns:
+    -------
+    - numpy SeedSequence
+    """
+    words = bytes.fromhex(digest(obj))
+    key = tuple(int.from_bytes(words[i:i+4], 'little') for i in range(0, 16, 4))
+    return np.random.SeedSequence(root.entropy, spawn_key=tuple(root.spawn_key) + key, pool_size=root.pool_size)
+
+
+class ResultCache:
+    """
+    Disk cache of results keyed by the content of everything that determines them and by the code version (see
+    code_version). Entries are pickled files in a directory that can be shared between processes. If the cache grows
+    beyond max_bytes, the least recently used entries are removed.
+    """
+
+    def __init__(self, path='../results/cache/', max_bytes=2**30):
+        """
+        Parameters:
+        ----------
+        - path:      directory of the cache
+        - max_bytes: maximal size of all entries (in bytes)
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, obj):
+        """Cache key of an object (see freeze), including the code version."""
+        return digest((code_version(), obj))
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], f"{key}.pkl")
+
+    def get(self, key):
+        """Stored value for a key, or None if there is none. Marks the entry as recently used."""
+        file = self._file(key)
+        try:
+            with open(file, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(file)
+        except FileNotFoundError:
+            return None
+        except (EOFError, pickle.UnpicklingError):
+            warnings.warn(f"Removing unreadable cache entry {file}.")
+            self._remove(file)
+            return None
+        return value
+
+    def put(self, key, value):
+        """Store a value for a key, then evict the least recently used entries if the cache is too large."""
+        file = self._file(key)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        tmp = f"{file}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, file)  # atomic, so that other processes never read partial entries
+        self.evict()
+
+    def evaluate(self, func, obj, generators=()):
+        """
+        Stored result for an object, or evaluate and store it.
+
+        Parameters:
+        ----------
+        - func:       function without arguments that computes the result
+        - obj:        everything that determines the result (see freeze), including the states of the generators
+        - generators: numpy random Generators that func draws from, their states after the evaluation are stored with
+                      the result and restored if it is loaded from the cache
+
+        Returns:
+        -------
+        - result of func
+        """
+        key = self.key(obj)
+        entry = self.get(key)
+        if entry is not None:
+            self.hits += 1
+            result, states = entry
+            for generator, state in zip(generators, states):
+                generator.bit_generator.state = state
+            return result
+        self.misses += 1
+        result = func()
+        self.put(key, (result, [generator.bit_generator.state for generator in generators]))
+        return result
+
+    def entries(self):
+        """List of (last use, size, file) of all entries."""
+        entries = []
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                if name.endswith('.pkl'):
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except FileNotFoundError:  # removed by another process
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+        return entries
+
+    def size(self):
+        """Size of all entries (in bytes)."""
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is not larger than max_bytes."""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, file in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(file)
+            total -= size
+
+    def clear(self):
+        """Remove all entries."""
+        for _, _, file in self.entries():
+            self._remove(file)
+
+    @staticmethod
+    def _remove(file):
+        try:
+            os.remove(file)
+        except FileNotFoundError:
+            pass
+
+    def __repr__(self):
+        return f"ResultCache('{self.path}', max_bytes={self.max_bytes}, hits={self.hits}, misses={self.misses})"
+
+
+def as_cache(cache):
+    """
+    Create a result cache from a specification.
+
+    Parameters:
+    ----------
+    - cache: None (no caching), path of a cache directory, or ResultCache
+
+    Returns:
+    -------
+    - ResultCache or None
+    """
+    if isinstance(cache, (str, os.PathLike)):
+        return ResultCache(cache)
+    return cache
@@ -0,0 +1,362 @@
+"""
+Numerical continuation of fixed points of NetworkModel along a parameter, either the mean weight of a connection
+(e.g. 'wNS' for w_mean['NS']) or a constant input to a cell type (e.g. 'xN' for the input to NDNFs). Branches of
+fixed points are traced with pseudo-arclength continuation, so that they can be followed around saddle-node folds,
+and the stability of each point is classified with the eigenvalues of the Jacobian (see NetworkModel.jacobian).
+"""
+
+import warnings
+import numpy as np
+from scipy import sparse, special
+from scipy.sparse import linalg as sparse_linalg
+from recording import STATE_VARIABLES
+
+
+class FixedPointSystem:
+    """
+    Fixed-point equations F(z, lam) = 0 of a network for a parameter lam, with z the activations (pre rectification)
+    of all cell types and the GABA spillover, followed by the release probability if presynaptic inhibition is
+    included (see NetworkModel.steady_state):
+        -v + A(p) [v]_+ + c = 0,    g_func(mean cGABA) - p = 0
+    The rectification and the clipping of g_func are smoothed on the scale eps, so that branches that fold at a kink
+    (e.g. where the release probability reaches p_low) can be followed around the fold.
+    """
+
+    def __init__(self, model, param, xFF=None, w_scale=None, rE0=1, rS0=1, rN0=1, rP0=1, rD0=1, rV0=1, p0=0.5,
+                 calc_bg_input=True, Xbg=None, scale_w_by_p=True, p_scale=None, eps=1e-7):
+        """
+        Parameters:
+        ----------
+        - model:            NetworkModel
+        - param:            continuation parameter, 'w' followed by a connection (mean weight, e.g. 'wNS') or 'x'
+                            followed by a cell type (constant input, e.g. 'xN')
+        - xFF:              dictionary of further constant inputs to the cells
+        - w_scale:          dictionary of further scaling factors for the weight matrices (scalars)
+        - rE0, ..., p0, calc_bg_input, Xbg, scale_w_by_p, p_scale: see NetworkModel.steady_state, the background
+                            inputs are recalculated for each value of a weight parameter (as for a model that is
+                            created with this mean weight)
+        - eps:              smoothing scale of the rectification and of g_func
+        """
+
+        if param[0] == 'w' and param[1:] in model.w_mean:
+            self.kind, self.key = 'w', param[1:]
+        elif param[0] == 'x' and param[1:] in model.cell_types:
+            self.kind, self.key = 'x', param[1:]
+        else:
+            raise ValueError(f"Unknown parameter '{param}', use 'w' followed by a connection (e.g. 'wNS') or 'x' "
+                             f"followed by a cell type (e.g. 'xN').")
+
+        self.model = model
+        self.param = param
+        self.xFF = dict() if xFF is None else dict(xFF)
+        self.w_scale = dict() if w_scale is None else dict(w_scale)
+        self.r0 = dict(E=rE0, D=rD0, S=rS0, N=rN0, P=rP0, V=rV0)
+        self.options = dict(p0=p0, calc_bg_input=calc_bg_input, Xbg=Xbg, scale_w_by_p=scale_w_by_p, p_scale=p_scale)
+        self.n_v = model.N_state
+        self.n_z = model.N_state + 1 if model.flag_pre_inh else model.N_state
+        self.eps = eps
+        self._cache = dict()
+
+    def conditions(self, lam):
+        """Inputs and weight scaling factors for parameter value lam (as arguments of NetworkModel.steady_state)."""
+        xFF, w_scale = dict(self.xFF), dict(self.w_scale)
+        if self.kind == 'w':
+            w_scale[self.key] = lam / self.model.w_mean[self.key]
+        else:
+            xFF[self.key] = lam
+        return xFF, w_scale
+
+    def setup(self, lam):
+        """Block operators, constant inputs and effective weight scaling factors for parameter value lam."""
+        if lam not in self._cache:
+            xFF, w_scale = self.conditions(lam)
+            n_batch, w_scale, Xbg, r0, p_start = self.model._prepare_batch(xFF, w_scale, self.r0, self.options['p0'],
+                                                                         self.options['calc_bg_input'],
+                                                                         self.options['Xbg'],
+                                                                         self.options['scale_w_by_p'],
+                                                                         self.options['p_scale'])
+            if n_batch > 1:
+                raise ValueError("Continuation requires a single condition, the inputs and weights vary across "
+                                 "a batch.")
+            w_scale = {conn: np.reshape(scale, (1, 1)) for conn, scale in w_scale.items()}
+            terms = [(W if scale is None else scale[0, 0] * W, mod)
+                     for W, mod, scale in self.model.get_block_operators(w_scale)]
+            self._cache = {lam: (terms, self.model._constant_inputs(xFF, Xbg, 1)[0], w_scale)}
+        return self._cache[lam]
+
+    def split(self, z):
+        """Activations and release probability of z."""
+        return z[:self.n_v], z[self.n_v] if self.model.flag_pre_inh else 1.
+
+    def rectify(self, v):
+        """Smoothed rectification and its derivative."""
+        return self.eps * np.logaddexp(0, v / self.eps), special.expit(v / self.eps)
+
+    def release(self, v):
+        """Smoothed g_func of the mean GABA spillover and its derivative with respect to the mean."""
+        model, eps = self.model, self.eps
+        x = 1 - model.b * (np.mean(self.rectify(v[model.state_slices['G']])[0]) - model.r0)
+        g = model.p_low + eps * (np.logaddexp(0, (x - model.p_low) / eps) - np.logaddexp(0, (x - 1) / eps))
+        return g, -model.b * (special.expit((x - model.p_low) / eps) - special.expit((x - 1) / eps))
+
+    def residual(self, z, lam):
+        """Residual F(z, lam) of the fixed-point equations."""
+        terms, c, _ = self.setup(lam)
+        v, p = self.split(z)
+        F = -v + self.model._weighted_operator(terms, p) @ self.rectify(v)[0] + c
+        if self.model.flag_pre_inh:
+            F = np.concatenate([F, [self.release(v)[0] - p]])
+        return F
+
+    def jacobian(self, z, lam):
+        """
+        Derivatives of the residual with respect to z (dense array or sparse matrix) and lam (array). The derivative
+        with respect to lam is taken with central differences (inputs and weights are linear in lam).
+        """
+
+        terms, c, _ = self.setup(lam)
+        v, p = self.split(z)
+        model = self.model
+        r, slope = self.rectify(v)
+        A = model._weighted_operator(terms, p)
+        if model.flag_sparse:
+            J_z = A @ sparse.diags(slope) - sparse.identity(self.n_v, format='csr')
+        else:
+            J_z = A * slope - np.eye(self.n_v)
+        if model.flag_pre_inh:
+            sl_G = model.state_slices['G']
+            J_vp = np.reshape(model._weighted_operator(terms, p, derivative=True) @ r, (-1, 1))
+            J_pv = np.zeros((1, self.n_v))
+            J_pv[0, sl_G] = self.release(v)[1] * slope[sl_G] / (sl_G.stop - sl_G.start)
+            if model.flag_sparse:
+                J_z = sparse.bmat([[J_z, J_vp], [J_pv, -np.ones((1, 1))]], format='csr')
+            else:
+                J_z = np.block([[J_z, J_vp], [J_pv, -np.ones((1, 1))]])
+
+        h = 1e-6 * max(1, abs(lam))
+        J_lam = (self.residual(z, lam + h) - self.residual(z, lam - h)) / (2 * h)
+
+        return J_z, J_lam
+
+    def state(self, z, lam):
+        """Rates of each cell type and GABA spillover, release probability and weight scaling factors (see
+        NetworkModel.jacobian)."""
+        v, p = self.split(z)
+        R = np.maximum(v, 0)
+        state = {cell: R[sl] for cell, sl in self.model.state_slices.items()}
+        state.update(p=p, w_scale={conn: scale[:, 0] for conn, scale in self.setup(lam)[2].items()})
+        return state
+
+    def initial_point(self, lam, start=None, relax=500, tol=1e-10):
+        """Fixed point for parameter value lam, found with NetworkModel.steady_state from a starting point."""
+        xFF, w_scale = self.conditions(lam)
+        ss = self.model.steady_state(xFF, w_scale, **self.r0_args(), **self.options, tol=tol, start=start,
+                                     relax=relax)
+        terms, c, _ = self.setup(lam)
+        R = np.concatenate([ss[cell][0] for cell in self.model.state_slices.keys()])
+        v = self.model._weighted_operator(terms, ss['p'][0]) @ R + c  # activations including inactive units
+        return np.concatenate([v, ss['p'][:1]]) if self.model.flag_pre_inh else v
+
+    def r0_args(self):
+        """Baseline rates as arguments of NetworkModel.steady_state."""
+        return {f"r{cell}0": rate for cell, rate in self.r0.items()}
+
+
+def continuation(model, param, lam_start, lam_end, xFF=None, w_scale=None, start=None, relax=500, ds=0.02,
+                 ds_min=1e-10, ds_max=0.1, max_steps=2000, tol=1e-10, max_newton=20, **kwargs):
+    """
+    Trace a branch of fixed points with pseudo-arclength continuation, starting at the fixed point for lam_start and
+    continuing in the direction of lam_end. The branch is followed around folds until the parameter leaves the
+    interval between lam_start and lam_end. Saddle-node folds are located where the parameter turns around along
+    the branch (by bisection of the step length).
+
+    Parameters:
+    ----------
+    - model:        NetworkModel
+    - param:        continuation parameter, e.g. 'wNS' (mean SOM->NDNF weight) or 'xN' (input to NDNFs), see
+                    FixedPointSystem
+    - lam_start:    initial parameter value
+    - lam_end:      parameter value at which to end
+    - xFF:          dictionary of further constant inputs to the cells
+    - w_scale:      dictionary of further scaling factors for the weight matrices (scalars)
+    - start:        starting point of the first fixed point (see NetworkModel.steady_state), e.g. dict(N=3) for
+                    the upper branch in the bistable regime
+    - relax:        duration (in ms) of the relaxation before solving for the first fixed point
+    - ds:           initial step length (arclength of the parameter and the root mean square of the state)
+    - ds_min:       smallest step length, the continuation ends if a step fails below it
+    - ds_max:       largest step length
+    - max_steps:    maximum number of continuation steps
+    - tol:          tolerance for the residual of the fixed-point equations
+    - max_newton:   maximum number of Newton iterations of the corrector
+    - kwargs:       baselines, background inputs etc. (see FixedPointSystem)
+
+    Returns:
+    -------
+    - branch:       dictionary with the parameter values ('param', shape (K,)), the rates of each cell type and the
+                    GABA spillover ('E', ..., 'V', 'G', shape (K, N)), the release probability ('p', shape (K,)),
+                    the largest real part of the eigenvalues of the Jacobian ('max_real', shape (K,)), the stability
+                    of each point ('stable', shape (K,)) and the folds ('folds', list of dictionaries with the
+                    parameter value ('param'), the index of the last branch point before the fold ('index') and the
+                    state at the fold ('state'))
+    """
+
+    system = FixedPointSystem(model, param, xFF, w_scale, **kwargs)
+    n_z = system.n_z
+    lam_min, lam_max = min(lam_start, lam_end), max(lam_start, lam_end)
+
+    # weights of the arclength: root mean square of the state and the parameter
+    wt = np.concatenate([np.full(n_z, 1 / n_z), [1.]])
+    norm = lambda y: np.sqrt(np.sum(wt * y**2))
+    solve = sparse_linalg.spsolve if model.flag_sparse else np.linalg.solve
+
+    def bordered(z, lam, t):
+        """Jacobian of the residual, bordered with the (weighted) tangent."""
+        J_z, J_lam = system.jacobian(z, lam)
+        if model.flag_sparse:
+            row = (wt * t)[np.newaxis]
+            return sparse.bmat([[J_z, J_lam[:, np.newaxis]], [row[:, :-1], row[:, -1:]]], format='csc')
+        return np.block([[J_z, J_lam[:, np.newaxis]], [(wt * t)[np.newaxis]]])
+
+    def tangent(y, t):
+        """Unit tangent of the branch at y, oriented along t."""
+        rhs = np.zeros(n_z + 1)
+        rhs[-1] = 1
+        t_new = solve(bordered(y[:-1], y[-1], t), rhs)
+        return t_new / norm(t_new)
+
+    def correct(y_pred, t):
+        """Newton corrector on the branch, in the hyperplane through y_pred orthogonal to t."""
+        y = y_pred.copy()
+        for i in range(max_newton):
+            F = np.concatenate([system.residual(y[:-1], y[-1]), [np.sum(wt * t * (y - y_pred))]])
+            if np.max(np.abs(F)) < tol:
+                return y, i
+            try:
+                y = y - solve(bordered(y[:-1], y[-1], t), F)
+            except np.linalg.LinAlgError:
+                break
+            if not np.all(np.isfinite(y)):
+                break
+        return None, max_newton
+
+    # first point and tangent in the direction of lam_end
+    y = np.concatenate([system.initial_point(lam_start, start, relax, tol), [lam_start]])
+    e_lam = np.zeros(n_z + 1)
+    e_lam[-1] = 1 / wt[-1]
+    t = tangent(y, e_lam * np.sign(lam_end - lam_start))
+    t = t * np.sign(t[-1]) * np.sign(lam_end - lam_start)
+
+    points, folds = [y], []
+    for step in range(max_steps):
+
+        # predictor and corrector, with step size control
+        y_new, n_iter = correct(y + ds * t, t)
+        if y_new is None:
+            ds /= 2
+            if ds < ds_min:
+                warnings.warn(f"Continuation stopped at {param}={y[-1]:.6g}, no convergence for the smallest step.")
+                break
+            continue
+        t_new = tangent(y_new, t)
+        if np.sum(wt * t * t_new) < 0.9 and ds > ds_min:
+            # the tangent turns too much within the step (e.g. at a kink), repeat with a smaller step so as not to
+            # jump to another branch
+            ds /= 2
+            continue
+
+        # fold: the parameter turns around along the branch, locate it by bisection of the step length
+        if np.sign(t_new[-1]) != np.sign(t[-1]):
+            h_low, h_high = 0, ds
+            y_fold = y_new
+            for i in range(50):
+                h = (h_low + h_high) / 2
+                y_h = correct(y + h * t, t)[0]
+                if y_h is None:
+                    break
+                y_fold = y_h
+                if np.sign(tangent(y_h, t)[-1]) == np.sign(t[-1]):
+                    h_low = h
+                else:
+                    h_high = h
+                if h_high - h_low < 1e-12 * max(1, ds):
+                    break
+            folds.append(dict(param=y_fold[-1], index=len(points)-1, state=system.state(y_fold[:-1], y_fold[-1])))
+
+        points.append(y_new)
+        y, t = y_new, t_new
+        if n_iter <= 3:
+            ds = min(1.5 * ds, ds_max)
+        if not lam_min <= y[-1] <= lam_max:
+            break
+
+    # rates and stability along the branch
+    states = [system.state(y[:-1], y[-1]) for y in points]
+    max_real = np.array([model._max_real_eigenvalue(model.jacobian(state)[0]) for state in states])
+    branch = {cell: np.array([state[cell] for state in states]) for cell in model.state_slices}
+    branch.update(param=np.array([y[-1] for y in points]), p=np.array([state['p'] for state in states]),
+                  max_real=max_real, stable=max_real < 0, folds=folds)
+
+    return branch
+
+
+def bistable_interval(*branches, atol=1e-2):
+    """
+    First parameter interval in which the traced branches contain at least two distinct stable fixed points, e.g.
+    the lower and the upper branch of a switch. Stable parts of a branch end at folds or where the branch changes
+    stability without a fold (e.g. where units switch off in a heterogeneous network, located by linear interpolation
+    of the largest real part of the eigenvalues), or at the end of the traced branch.
+
+    Parameters:
+    ----------
+    - branches: branches of fixed points (see continuation)
+    - atol:     tolerance (relative to the rates) below which fixed points of different branches count as the same
+
+    Returns:
+    -------
+    - tuple of the lower and upper end of the interval, or None if there is none
+    """
+
+    # stable parts of the branches: parameter range, parameter values and mean rates
+    parts = []
+    for branch in branches:
+        param, max_real = branch['param'], branch['max_real']
+        rates = np.stack([np.mean(branch[cell], axis=1) for cell in STATE_VARIABLES if cell != 'p'], axis=1)
+        stable = np.flatnonzero(branch['stable'])
+        for run in np.split(stable, np.flatnonzero(np.diff(stable) > 1) + 1):
+            if len(run) == 0:
+                continue
+            first, last = run[0], run[-1]
+            values = list(param[first:last+1])
+            for i, j in [(first - 1, first), (last, last + 1)]:
+                if 0 <= i and j < len(param):
+                    folds = [fold['param'] for fold in branch['folds'] if fold['index'] == i]
+                    values += folds if folds else [param[i] + (param[j] - param[i]) * max_real[i] / (max_real[i] -
+                                                                                                  max_real[j])]
+            parts.append((min(values), max(values), param[first:last+1], rates[first:last+1]))
+
+    def stable_states(lam):
+        """Mean rates of the distinct stable fixed points at parameter value lam."""
+        states = []
+        for lam_min, lam_max, param, rates in parts:
+            if not lam_min <= lam <= lam_max:
+                continue
+            # interpolate along all steps across lam, or take the closest point at the ends of the part
+            steps = np.flatnonzero((param[:-1] - lam) * (param[1:] - lam) <= 0)
+            candidates = [rates[k] + (rates[k+1] - rates[k]) * (lam - param[k]) / (param[k+1] - param[k])
+                          if param[k+1] != param[k] else rates[k] for k in steps]
+            for state in candidates or [rates[np.argmin(np.abs(param - lam))]]:
+                if all(np.max(np.abs(state - other)) > atol * (1 + np.max(np.abs(other))) for other in states):
+                    states.append(state)
+        return states
+
+    # count stable fixed points between all parameter values at which this can change
+    bounds = np.unique(np.concatenate([[lam_min, lam_max] for lam_min, lam_max, _, _ in parts] +
+                                      [param for _, _, param, _ in parts]))
+    bistable = [len(stable_states((lo + hi) / 2)) >= 2 for lo, hi in zip(bounds[:-1], bounds[1:])]
+    if not any(bistable):
+        return None
+    first = bistable.index(True)
+    last = first
+    while last + 1 < len(bistable) and bistable[last + 1]:
+        last += 1
+    return bounds[first], bounds[last + 1]
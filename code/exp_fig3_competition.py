@@ -13,7 +13,8 @@ if 'pretty' in plt.style.available:
 lw = mpl.rcParams['lines.linewidth']
 
 import model_base as mb
-from helpers import get_null_ff_input_arrays, get_model_colours
+from helpers import get_model_colours, model_seed
+from recording import Recorder
 
 # get model colours
 cPC, cPV, cSOM, cNDNF, cVIP, cpi = get_model_colours()
@@ -21,11 +22,12 @@ cPC, cPV, cSOM, cNDNF, cVIP, cpi = get_model_colours()
 # figure path and settings
 FIG_PATH = '../results/figs/Naumann23_draft1/'
 SUPP_PATH = '../results/figs/Naumann23_draft1/supps/'
+CACHE_PATH = '../results/cache/'
 DPI = 150
 
 
 def exp_fig3AB_top_vary_NDNF_input(dur=1500, dt=1, w_hetero=True, mean_pop=False, noise=0.1, pre_inh=True,
-                                target_ND=False, target_VS=False, save=False):
+                                target_ND=False, target_VS=False, save=False, early_stop=None, seed=0, cache=None):
     """
     Vary input to NDNF interneurons, monitor NDNF- and SOM-mediated dendritic inhibition and their activity.
 
@@ -40,10 +42,58 @@ def exp_fig3AB_top_vary_NDNF_input(dur=1500, dt=1, w_hetero=True, mean_pop=False
     - save: if it's a string, name of the saved file, else if False nothing is saved
     - target_ND: whether to target NDNF->dendrite synapse with presynaptic inhibition
     - target_VS: whether to target SOM->VIP synapse with presynaptic inhibition
+    - early_stop: criterion to end simulations once the network has settled (see stopping.EarlyStop), None to
+                  simulate the full duration
+    - seed: root seed of the models (see helpers.model_seed), None to draw their seeds from the global random state
+    - cache: cache of simulation results (see caching.ResultCache) or path of its directory, None for no caching
     """
 
-    # extract number of timesteps
-    nt = int(dur / dt)
+    # simulate
+    res = run_fig3AB_top_vary_NDNF_input(dur=dur, dt=dt, w_hetero=w_hetero, mean_pop=mean_pop, noise=noise,
+                                         pre_inh=pre_inh, target_ND=target_ND, target_VS=target_VS,
+                                         early_stop=early_stop, seed=seed, cache=cache)
+    ndnf_input = res['ndnf_input']
+    rS_record, rN_record = res['rS'], res['rN']
+    rS_inh_record, rN_inh_record = res['dend_inh_SOM'], res['dend_inh_NDNF']
+
+    # Plotting
+    # --------
+    dpi = 300 if save else DPI
+    fig, ax = plt.subplots(2, 1, figsize=(1.6, 2.5), dpi=dpi, gridspec_kw={'left': 0.22, 'bottom': 0.15, 'top': 0.95,
+                                                                           'right': 0.95, 'hspace': 0.2,
+                                                                           'height_ratios': [1, 1]}, sharex=True)
+    # plot SOM and NDNF activity
+    ax[0].plot(ndnf_input, np.mean(rS_record, axis=1), color=cSOM, lw=lw)
+    ax[0].plot(ndnf_input, np.mean(rN_record, axis=1), color=cNDNF, lw=lw)
+    ax[0].legend(['SOM', 'NDNF'], frameon=False, handlelength=1, loc=(0.05, 0.6), fontsize=8)
+    # plot SOM and NDNF dendritic inhibition and sum (i.e. total dendritic inhibition)
+    ax[1].plot(ndnf_input, rS_inh_record, c=cSOM, ls='--', lw=lw)
+    ax[1].plot(ndnf_input, rN_inh_record, c=cNDNF, ls='--', lw=lw)
+    ax[1].plot(ndnf_input, rS_inh_record+rN_inh_record, c='#978991', ls='-', lw=lw, zorder=-1)
+    # labels etc
+    ax[0].set(ylabel='activity (au)', xlim=[-1, 1], ylim=[-0.1, 2.5], yticks=[0, 1, 2])
+    ax[1].set(ylabel='dend. inh. (au)', ylim=[-0.05, 1.1], yticks=[0, 1], xlabel=r'$\Delta$ NDNF input')
+
+    # Saving
+    # ------
+    if save:
+        pre_inh_str = '_with_pre_inh' if pre_inh else '_without_pre_inh'
+        savename = f"{FIG_PATH}exp_fig3top_competition{pre_inh_str}.pdf" if not isinstance(save, str) else save 
+        fig.savefig(savename, dpi=300)
+        plt.close(fig)
+
+
+def run_fig3AB_top_vary_NDNF_input(dur=1500, dt=1, w_hetero=True, mean_pop=False, noise=0.1, pre_inh=True,
+                                   target_ND=False, target_VS=False, early_stop=None, seed=0, cache=None):
+    """
+    Simulations of exp_fig3AB_top_vary_NDNF_input (see there for the parameters), without plotting.
+
+    Returns:
+    -------
+    - dictionary with the NDNF inputs ('ndnf_input'), for each input the final SOM and NDNF rates ('rS', 'rN'), mean
+      SOM- and NDNF-mediated dendritic inhibition ('dend_inh_SOM', 'dend_inh_NDNF'), mean GABA spillover ('cGABA')
+      and release probability ('p'), and the number of integration steps of all simulations ('n_steps')
+    """
 
     # get default parameters
     N_cells, w_mean, conn_prob, bg_inputs, taus = mb.get_default_params(flag_mean_pop=mean_pop)
@@ -59,56 +109,37 @@ def exp_fig3AB_top_vary_NDNF_input(dur=1500, dt=1, w_hetero=True, mean_pop=False
     rN_record = np.zeros((ninput, N_cells['N']))
     cGABA_record = np.zeros(ninput)
     p_record = np.zeros(ninput)
+    n_steps = 0
 
     print(f"Running model with varying NDNF and for pre. inh. = {pre_inh}...")
     for i, I_activate in enumerate(ndnf_input):
 
         # create input (stimulation of NDNF)
-        xFF = get_null_ff_input_arrays(nt, N_cells)
-        xFF['N'][:, :] = I_activate
+        xFF = dict(N=I_activate)
 
         # instantiate and run model
         model = mb.NetworkModel(N_cells, w_mean, conn_prob, taus, bg_inputs, wED=1, flag_w_hetero=w_hetero,
-                                flag_pre_inh=pre_inh, flag_p_on_DN=target_ND, flag_p_on_VS=target_VS)
-        t, rE, rD, rS, rN, rP, rV, p, cGABA, other = model.run(dur, xFF, dt=dt, init_noise=0, monitor_dend_inh=True,
-                                                               noise=noise)
+                                flag_pre_inh=pre_inh, flag_p_on_DN=target_ND, flag_p_on_VS=target_VS,
+                                seed=model_seed(seed, i))
+        res = model.run(dur, xFF, dt=dt, init_noise=0, monitor_dend_inh=True, noise=noise, early_stop=early_stop,
+                        cache=cache)
+        t, rE, rD, rS, rN, rP, rV, p, cGABA, other = res
+        n_steps += res.total_steps
 
         # save stuff
         rS_record[i] = rS[-1]
         rN_record[i] = rN[-1]
-        rS_inh_record[i] = np.mean(np.array(other['dend_inh_SOM'][-1]))
-        rN_inh_record[i] = np.mean(np.array(other['dend_inh_NDNF'][-1]))
+        rS_inh_record[i] = np.mean(other['dend_inh_SOM'][-1])
+        rN_inh_record[i] = np.mean(other['dend_inh_NDNF'][-1])
         cGABA_record[i] = np.mean(cGABA[-1])
-        p_record[i] = p[-1]     
+        p_record[i] = p[-1]
 
-    # Plotting
-    # --------
-    dpi = 300 if save else DPI
-    fig, ax = plt.subplots(2, 1, figsize=(1.6, 2.5), dpi=dpi, gridspec_kw={'left': 0.22, 'bottom': 0.15, 'top': 0.95,
-                                                                           'right': 0.95, 'hspace': 0.2,
-                                                                           'height_ratios': [1, 1]}, sharex=True)
-    # plot SOM and NDNF activity
-    ax[0].plot(ndnf_input, np.mean(rS_record, axis=1), color=cSOM, lw=lw)
-    ax[0].plot(ndnf_input, np.mean(rN_record, axis=1), color=cNDNF, lw=lw)
-    ax[0].legend(['SOM', 'NDNF'], frameon=False, handlelength=1, loc=(0.05, 0.6), fontsize=8)
-    # plot SOM and NDNF dendritic inhibition and sum (i.e. total dendritic inhibition)
-    ax[1].plot(ndnf_input, rS_inh_record, c=cSOM, ls='--', lw=lw)
-    ax[1].plot(ndnf_input, rN_inh_record, c=cNDNF, ls='--', lw=lw)
-    ax[1].plot(ndnf_input, rS_inh_record+rN_inh_record, c='#978991', ls='-', lw=lw, zorder=-1)
-    # labels etc
-    ax[0].set(ylabel='activity (au)', xlim=[-1, 1], ylim=[-0.1, 2.5], yticks=[0, 1, 2])
-    ax[1].set(ylabel='dend. inh. (au)', ylim=[-0.05, 1.1], yticks=[0, 1], xlabel=r'$\Delta$ NDNF input')
-
-    # Saving
-    # ------
-    if save:
-        pre_inh_str = '_with_pre_inh' if pre_inh else '_without_pre_inh'
-        savename = f"{FIG_PATH}exp_fig3top_competition{pre_inh_str}.pdf" if not isinstance(save, str) else save 
-        fig.savefig(savename, dpi=300)
-        plt.close(fig)
+    return dict(ndnf_input=ndnf_input, rS=rS_record, rN=rN_record, dend_inh_SOM=rS_inh_record,
+                dend_inh_NDNF=rN_inh_record, cGABA=cGABA_record, p=p_record, n_steps=n_steps)
 
 
-def exp_fig3AB_bottom_total_dendritic_inhibition(dur=1500, dt=1, w_hetero=True, mean_pop=False, noise=0.1, pre_inh=True, save=False):
+def exp_fig3AB_bottom_total_dendritic_inhibition(dur=1500, dt=1, w_hetero=True, mean_pop=False, noise=0.1, pre_inh=True, save=False,
+                                                early_stop=None, seed=0, cache=None):
     """
     Vary input to NDNF interneurons and NDNF->dendrite weight, check how this affects total dendritic inhibition.
 
@@ -121,10 +152,51 @@ def exp_fig3AB_bottom_total_dendritic_inhibition(dur=1500, dt=1, w_hetero=True,
     - noise: level of white noise added to neural activity
     - pre_inh: whether to include presynaptic inhibition
     - save: if it's a string, name of the saved file, else if False nothing is saved
+    - early_stop: criterion to end simulations once the network has settled (see stopping.EarlyStop), None to
+                  simulate the full duration
+    - seed: root seed of the models (see helpers.model_seed), None to draw their seeds from the global random state
+    - cache: cache of simulation results (see caching.ResultCache) or path of its directory, None for no caching
+    """
+
+    # simulate
+    res = run_fig3AB_bottom_total_dendritic_inhibition(dur=dur, dt=dt, w_hetero=w_hetero, mean_pop=mean_pop,
+                                                       noise=noise, pre_inh=pre_inh, early_stop=early_stop, seed=seed,
+                                                       cache=cache)
+    ndnf_input, weightsDN = res['ndnf_input'], res['wDN']
+    rS_inh_record, rN_inh_record = res['dend_inh_SOM'], res['dend_inh_NDNF']
+
+    # set up figure
+    dpi = 300 if save else DPI
+    fig, ax = plt.subplots(1, 1, figsize=(1.6, 1.5), dpi=dpi, gridspec_kw={'left': 0.22, 'bottom': 0.25, 'top': 0.95,
+                                                                           'right': 0.95}, sharex=True)
+    cols = sns.color_palette(f"blend:{cSOM},{cNDNF}", n_colors=len(weightsDN))
+
+    # plot total dendritic inhibition for each NDNF->dendrite weight
+    for j, wDN in enumerate(weightsDN):
+        ax.plot(ndnf_input, rS_inh_record[:, j]+rN_inh_record[:, j], c=cols[j], ls='-', label=f"{wDN/res['wDS']:1.1f}", lw=lw)
+
+    # labels
+    ax.set(xlabel=r'$\Delta$ NDNF input', xticks=[-1, 0, 1], xlim=[-1, 1], ylim=[-0.1, 2], yticks=[0, 1, 2], ylabel=r'$\Sigma$ dend. inh.')
+
+    # saving
+    if save:
+        pre_inh_str = '_with_pre_inh' if pre_inh else '_without_pre_inh'
+        savename = f"{FIG_PATH}exp_fig3bottom_dendritic_inh{pre_inh_str}.pdf" if not isinstance(save, str) else save 
+        fig.savefig(savename, dpi=300)
+        plt.close(fig) 
+
+
+def run_fig3AB_bottom_total_dendritic_inhibition(dur=1500, dt=1, w_hetero=True, mean_pop=False, noise=0.1,
+                                                 pre_inh=True, early_stop=None, seed=0, cache=None):
     """
+    Simulations of exp_fig3AB_bottom_total_dendritic_inhibition (see there for the parameters), without plotting.
 
-    # extract number of timesteps
-    nt = int(dur / dt)
+    Returns:
+    -------
+    - dictionary with the NDNF inputs ('ndnf_input'), the NDNF->dendrite weights ('wDN'), the SOM->dendrite weight
+      ('wDS'), the final mean SOM- and NDNF-mediated dendritic inhibition for each input and weight
+      ('dend_inh_SOM', 'dend_inh_NDNF') and the number of integration steps of all simulations ('n_steps')
+    """
 
     # get default parameters
     N_cells, w_mean, conn_prob, bg_inputs, taus = mb.get_default_params(flag_mean_pop=mean_pop)
@@ -136,14 +208,9 @@ def exp_fig3AB_bottom_total_dendritic_inhibition(dur=1500, dt=1, w_hetero=True,
     # empty arrays for recording stuff
     rS_inh_record = np.zeros((len(ndnf_input), len(weightsDN)))
     rN_inh_record = np.zeros((len(ndnf_input), len(weightsDN)))
+    n_steps = 0
 
-    # set up figure
-    dpi = 300 if save else DPI
-    fig, ax = plt.subplots(1, 1, figsize=(1.6, 1.5), dpi=dpi, gridspec_kw={'left': 0.22, 'bottom': 0.25, 'top': 0.95,
-                                                                           'right': 0.95}, sharex=True)
-    cols = sns.color_palette(f"blend:{cSOM},{cNDNF}", n_colors=len(weightsDN))
-
-    # loop over NDNF input and NDNF->dendrite weight, simulate, record and plot
+    # loop over NDNF input and NDNF->dendrite weight, simulate and record
     print(f"Running model with varying NDNF-dendrite weight and NDNF input for pre. inh. = {pre_inh}...")
     for j, wDN in enumerate(weightsDN):
 
@@ -152,37 +219,27 @@ def exp_fig3AB_bottom_total_dendritic_inhibition(dur=1500, dt=1, w_hetero=True,
 
         # instantiate and run model
         model = mb.NetworkModel(N_cells, w_mean, conn_prob, taus, bg_inputs, wED=1, flag_w_hetero=w_hetero,
-                                flag_pre_inh=pre_inh)
-
-        for i, I_activate in enumerate(ndnf_input):
-
-            # create input (stimulation of NDNF)
-            xFF = get_null_ff_input_arrays(nt, N_cells)
-            xFF['N'][:, :] = I_activate
+                                flag_pre_inh=pre_inh, seed=model_seed(seed, j))
 
-            # simulate
-            t, rE, rD, rS, rN, rP, rV, p, cGABA, other = model.run(dur, xFF, dt=dt, init_noise=0, monitor_dend_inh=True,
-                                                                   noise=noise, calc_bg_input=True)
+        # create input (stimulation of NDNF), one batch member per input level
+        xFF = dict(N=ndnf_input[:, np.newaxis, np.newaxis])
 
-            # save dendritic inhibition
-            rS_inh_record[i, j] = np.mean(np.array(other['dend_inh_SOM'][-1]))
-            rN_inh_record[i, j] = np.mean(np.array(other['dend_inh_NDNF'][-1]))
+        # simulate all input levels as one batch
+        record = Recorder(['dend_inh_SOM', 'dend_inh_NDNF'], mean=True)  # only store the population means
+        res = model.run_batch(dur, xFF, dt=dt, init_noise=0, noise=noise, calc_bg_input=True, record=record,
+                              early_stop=early_stop, cache=cache)
+        n_steps += res.total_steps
 
-        # plot
-        ax.plot(ndnf_input, rS_inh_record[:, j]+rN_inh_record[:, j], c=cols[j], ls='-', label=f"{wDN/w_mean['DS']:1.1f}", lw=lw)
+        # save dendritic inhibition
+        rS_inh_record[:, j] = res.other['dend_inh_SOM'][:, -1]
+        rN_inh_record[:, j] = res.other['dend_inh_NDNF'][:, -1]
 
-    # labels
-    ax.set(xlabel=r'$\Delta$ NDNF input', xticks=[-1, 0, 1], xlim=[-1, 1], ylim=[-0.1, 2], yticks=[0, 1, 2], ylabel=r'$\Sigma$ dend. inh.')
-
-    # saving
-    if save:
-        pre_inh_str = '_with_pre_inh' if pre_inh else '_without_pre_inh'
-        savename = f"{FIG_PATH}exp_fig3bottom_dendritic_inh{pre_inh_str}.pdf" if not isinstance(save, str) else save 
-        fig.savefig(savename, dpi=300)
-        plt.close(fig) 
+    return dict(ndnf_input=ndnf_input, wDN=weightsDN, wDS=w_mean['DS'], dend_inh_SOM=rS_inh_record,
+                dend_inh_NDNF=rN_inh_record, n_steps=n_steps)
 
 
-def exp_fig3CD_amplifcation_ndnf_inhibition(dur=1500, dt=1, w_hetero=True, mean_pop=False, noise=0.1, save=False):
+def exp_fig3CD_amplifcation_ndnf_inhibition(dur=1500, dt=1, w_hetero=True, mean_pop=False, noise=0.1, save=False,
+                                            early_stop=None, seed=0, cache=None):
     """
     Vary input to NDNF interneurons and pre inh strength, check how this affects NDNF inhibition to dendrite.
 
@@ -193,10 +250,63 @@ def exp_fig3CD_amplifcation_ndnf_inhibition(dur=1500, dt=1, w_hetero=True, mean_
     - noise: level of white noise added to neural activity
     - flag_w_hetero: whether to add heterogeneity to weight matrices
     - save: if it's a string, name of the saved file, else if False nothing is saved
+    - early_stop: criterion to end simulations once the network has settled (see stopping.EarlyStop), None to
+                  simulate the full duration
+    - seed: root seed of the models (see helpers.model_seed), None to draw their seeds from the global random state
+    - cache: cache of simulation results (see caching.ResultCache) or path of its directory, None for no caching
     """
 
-    # extract number of timesteps
-    nt = int(dur / dt)
+    # simulate
+    res = run_fig3CD_amplifcation_ndnf_inhibition(dur=dur, dt=dt, w_hetero=w_hetero, mean_pop=mean_pop, noise=noise,
+                                                  early_stop=early_stop, seed=seed, cache=cache)
+    ndnf_input, betas, wNS_values = res['ndnf_input'], res['b'], res['wNS']
+
+    # set up figure
+    dpi = 300 if save else DPI
+    fig, ax = plt.subplots(2, 1, figsize=(1.8, 2.5), dpi=dpi, gridspec_kw={'left': 0.22, 'bottom': 0.2, 'top': 0.95,
+                                                                           'right': 0.95}, sharex=True, sharey=True)
+
+    # plot NDNF inhibition to the dendrite for each pre inh strength
+    cols = sns.color_palette(f"dark:{cpi}", n_colors=len(betas))
+    for j, bb in enumerate(betas):
+        ax[0].plot(ndnf_input, res['dend_inh_NDNF'][:, j], c=cols[j], ls='-', label=f"{bb:1.1f}", lw=lw)
+    ax[0].set(xticks=[-1, 0, 1], xlim=[-1, 1], ylim=[-0.05, 1.1], yticks=[0, 1])
+
+    # plot the same with pre inh for each SOM-NDNF inhibition strength
+    cols = sns.color_palette(f"dark:{cSOM}", n_colors=len(wNS_values))
+    for j, wNS in enumerate(wNS_values):
+        ax[1].plot(ndnf_input, res['dend_inh_NDNF_wNS'][:, j], c=cols[j], ls='-', label=f"{wNS:1.1f}", lw=lw)
+    ax[1].set(xlabel=r'$\Delta$ NDNF input', xticks=[-1, 0, 1], xlim=[-1, 1], ylim=[-0.05, 1.1], yticks=[0, 1])
+
+    # set only one ylabel for both axes
+    fig.supylabel('NDNF-dend. inh. (au)', fontsize=8)
+
+    fig3, ax3 = plt.subplots(1, 1, figsize=(1.8, 1.2), dpi=dpi, gridspec_kw={'left': 0.22, 'bottom': 0.3, 'top': 0.95,
+                                                                            'right': 0.95}, sharex=True)
+    ax3.plot(wNS_values, res['amplification_index'], '.-', c=cpi)
+    ax3.set(xlabel='SOM-NDNF inh.', ylabel='amplification', ylim=[0, 2.3], yticks=[0, 1, 2], xticks=[0.5, 1, 1.5])    
+
+    # saving
+    if save:
+        fig.savefig(f'{FIG_PATH}exp_fig3C_amplification.pdf', dpi=300)
+        fig3.savefig(f'{FIG_PATH}exp_fig3D_amp_index.pdf', dpi=300)
+        plt.close(fig)
+        plt.close(fig3)
+
+
+def run_fig3CD_amplifcation_ndnf_inhibition(dur=1500, dt=1, w_hetero=True, mean_pop=False, noise=0.1, early_stop=None,
+                                            seed=0, cache=None):
+    """
+    Simulations of exp_fig3CD_amplifcation_ndnf_inhibition (see there for the parameters), without plotting.
+
+    Returns:
+    -------
+    - dictionary with the NDNF inputs ('ndnf_input'), the pre inh strengths ('b'), the SOM-NDNF weights ('wNS'), the
+      final mean NDNF-mediated dendritic inhibition for each input and pre inh strength ('dend_inh_NDNF'), for each
+      input and SOM-NDNF weight with and without pre inh ('dend_inh_NDNF_wNS', 'dend_inh_NDNF_wNS_null'), the
+      amplification index of each SOM-NDNF weight ('amplification_index') and the number of integration steps of all
+      simulations ('n_steps')
+    """
 
     # get default parameters
     N_cells, w_mean, conn_prob, bg_inputs, taus = mb.get_default_params(flag_mean_pop=mean_pop)
@@ -207,46 +317,35 @@ def exp_fig3CD_amplifcation_ndnf_inhibition(dur=1500, dt=1, w_hetero=True, mean_
 
     # empty arrays for recording stuff
     rN_inh_record = np.zeros((len(ndnf_input), len(betas)))
+    n_steps = 0
 
-    # set up figure
-    dpi = 300 if save else DPI
-    fig, ax = plt.subplots(2, 1, figsize=(1.8, 2.5), dpi=dpi, gridspec_kw={'left': 0.22, 'bottom': 0.2, 'top': 0.95,
-                                                                           'right': 0.95}, sharex=True, sharey=True)
-    import seaborn as sns
-    cols = sns.color_palette(f"dark:{cpi}", n_colors=len(betas))
+    # only the population mean of NDNF-mediated dendritic inhibition is stored
+    record = Recorder(['dend_inh_NDNF'], mean=True)
 
-    # loop over NDNF input and pre inh strength, simulate, record and plot
+    # loop over NDNF input and pre inh strength, simulate and record
     for j, bb in enumerate(betas):
 
         print(f"beta: {bb:1.1f}")
 
         # instantiate model
         model = mb.NetworkModel(N_cells, w_mean, conn_prob, taus, bg_inputs, wED=1, flag_w_hetero=w_hetero,
-                                flag_pre_inh=True, b=bb)
+                                flag_pre_inh=True, b=bb, seed=model_seed(seed, 'b', j))
 
-        for i, I_activate in enumerate(ndnf_input):
+        # create input (stimulation of NDNF), one batch member per input level
+        xFF = dict(N=ndnf_input[:, np.newaxis, np.newaxis])
 
-            # create input (stimulation of NDNF)
-            xFF = get_null_ff_input_arrays(nt, N_cells)
-            xFF['N'][:, :] = I_activate
-
-            t, rE, rD, rS, rN, rP, rV, p, cGABA, other = model.run(dur, xFF, dt=dt, init_noise=0, monitor_dend_inh=True,
-                                                                   noise=noise)
-
-            # save stuff
-            rN_inh_record[i, j] = np.mean(other['dend_inh_NDNF'][-1]) #np.mean(rN[-1])
-
-        ax[0].plot(ndnf_input, rN_inh_record[:, j], c=cols[j], ls='-', label=f"{bb:1.1f}", lw=lw)
-    
-    ax[0].set(xticks=[-1, 0, 1], xlim=[-1, 1], ylim=[-0.05, 1.1], yticks=[0, 1])
+        res = model.run_batch(dur, xFF, dt=dt, init_noise=0, noise=noise, record=record, early_stop=early_stop,
+                              cache=cache)
+        n_steps += res.total_steps
 
+        # save stuff
+        rN_inh_record[:, j] = res.other['dend_inh_NDNF'][:, -1]
 
     # repeat the same as above but varying the SOM-NDNF inhibition strength
     wNS_values = np.arange(0.5, 1.71, 0.2)
     rN_inh_record2 = np.zeros((len(ndnf_input), len(wNS_values)))
     rN_inh_record3 = np.zeros((len(ndnf_input), len(wNS_values)))
     amplification_index = np.zeros(len(wNS_values))
-    cols = sns.color_palette(f"dark:{cSOM}", n_colors=len(wNS_values))    
 
     for j, wNS in enumerate(wNS_values):
 
@@ -255,46 +354,30 @@ def exp_fig3CD_amplifcation_ndnf_inhibition(dur=1500, dt=1, w_hetero=True, mean_
         w_mean['NS'] = wNS
 
         model_psi = mb.NetworkModel(N_cells, w_mean, conn_prob, taus, bg_inputs, wED=1, flag_w_hetero=w_hetero,
-                                    flag_pre_inh=True, b=betas[1])
+                                    flag_pre_inh=True, b=betas[1], seed=model_seed(seed, 'wNS', j, 'psi'))
         model_null = mb.NetworkModel(N_cells, w_mean, conn_prob, taus, bg_inputs, wED=1, flag_w_hetero=w_hetero,
-                                    flag_pre_inh=True, b=betas[0])
-
-        for i, I_activate in enumerate(ndnf_input):
+                                    flag_pre_inh=True, b=betas[0], seed=model_seed(seed, 'wNS', j, 'null'))
 
-            # create input (stimulation of NDNF)
-            xFF = get_null_ff_input_arrays(nt, N_cells)
-            xFF['N'][:, :] = I_activate
+        # create input (stimulation of NDNF), one batch member per input level
+        xFF = dict(N=ndnf_input[:, np.newaxis, np.newaxis])
 
-            # run model with presynaptic inhibition
-            t, rE, rD, rS, rN, rP, rV, p, cGABA, other = model_psi.run(dur, xFF, dt=dt, init_noise=0, monitor_dend_inh=True,
-                                                                       noise=noise)
-            rN_inh_record2[i, j] = np.mean(other['dend_inh_NDNF'][-1])
+        # run model with presynaptic inhibition
+        res = model_psi.run_batch(dur, xFF, dt=dt, init_noise=0, noise=noise, record=record, early_stop=early_stop,
+                                  cache=cache)
+        rN_inh_record2[:, j] = res.other['dend_inh_NDNF'][:, -1]
+        n_steps += res.total_steps
 
-            # run model without presynaptic inhibition
-            t, rE, rD, rS, rN, rP, rV, p, cGABA, other = model_null.run(dur, xFF, dt=dt, init_noise=0, monitor_dend_inh=True,
-                                                                        noise=noise)
-            rN_inh_record3[i, j] = np.mean(other['dend_inh_NDNF'][-1])
+        # run model without presynaptic inhibition
+        res = model_null.run_batch(dur, xFF, dt=dt, init_noise=0, noise=noise, record=record, early_stop=early_stop,
+                                   cache=cache)
+        rN_inh_record3[:, j] = res.other['dend_inh_NDNF'][:, -1]
+        n_steps += res.total_steps
 
         amplification_index[j] = get_amplification_index(ndnf_input, rN_inh_record2[:, j], rN_inh_record3[:, j])
 
-        ax[1].plot(ndnf_input, rN_inh_record2[:, j], c=cols[j], ls='-', label=f"{wNS:1.1f}", lw=lw)
-    
-    ax[1].set(xlabel=r'$\Delta$ NDNF input', xticks=[-1, 0, 1], xlim=[-1, 1], ylim=[-0.05, 1.1], yticks=[0, 1])
-
-    # set only one ylabel for both axes
-    fig.supylabel('NDNF-dend. inh. (au)', fontsize=8)
-
-    fig3, ax3 = plt.subplots(1, 1, figsize=(1.8, 1.2), dpi=dpi, gridspec_kw={'left': 0.22, 'bottom': 0.3, 'top': 0.95,
-                                                                            'right': 0.95}, sharex=True)
-    ax3.plot(wNS_values, amplification_index, '.-', c=cpi)
-    ax3.set(xlabel='SOM-NDNF inh.', ylabel='amplification', ylim=[0, 2.3], yticks=[0, 1, 2], xticks=[0.5, 1, 1.5])    
-
-    # saving
-    if save:
-        fig.savefig(f'{FIG_PATH}exp_fig3C_amplification.pdf', dpi=300)
-        fig3.savefig(f'{FIG_PATH}exp_fig3D_amp_index.pdf', dpi=300)
-        plt.close(fig)
-        plt.close(fig3)
+    return dict(ndnf_input=ndnf_input, b=betas, wNS=wNS_values, dend_inh_NDNF=rN_inh_record,
+                dend_inh_NDNF_wNS=rN_inh_record2, dend_inh_NDNF_wNS_null=rN_inh_record3,
+                amplification_index=amplification_index, n_steps=n_steps)
 
     
 def get_amplification_index(x, y, y_null, xmin=-0.3, xmax=0.3, plot_fit=False):
@@ -324,20 +407,24 @@ def get_amplification_index(x, y, y_null, xmin=-0.3, xmax=0.3, plot_fit=False):
 if __name__ in "__main__":
 
     SAVE = False
+    CACHE = True  # reuse the simulations of earlier runs
     plot_supps = False
+    cache = CACHE_PATH if CACHE else None
 
     # Figure 3: Competition for dendritic inhibition
 
     # Fig 3 A&B (top): Layer-specificity of NDNF control (with & without pre inh)
-    exp_fig3AB_top_vary_NDNF_input(pre_inh=True, save=SAVE)
-    exp_fig3AB_top_vary_NDNF_input(pre_inh=False, save=SAVE)
+    exp_fig3AB_top_vary_NDNF_input(pre_inh=True, save=SAVE, cache=cache)
+    exp_fig3AB_top_vary_NDNF_input(pre_inh=False, save=SAVE, cache=cache)
 
     # Fig 3 A&B (bottom): total dendritic inhibiion
-    exp_fig3AB_bottom_total_dendritic_inhibition(pre_inh=True, mean_pop=False, w_hetero=True, noise=0.1, save=SAVE)
-    exp_fig3AB_bottom_total_dendritic_inhibition(pre_inh=False, mean_pop=False, w_hetero=True, noise=0.1, save=SAVE)
+    exp_fig3AB_bottom_total_dendritic_inhibition(pre_inh=True, mean_pop=False, w_hetero=True, noise=0.1, save=SAVE,
+                                                 cache=cache)
+    exp_fig3AB_bottom_total_dendritic_inhibition(pre_inh=False, mean_pop=False, w_hetero=True, noise=0.1, save=SAVE,
+                                                 cache=cache)
 
     # Fig 3 (new): amplification of NDNF inhibition
-    exp_fig3CD_amplifcation_ndnf_inhibition(save=SAVE)
+    exp_fig3CD_amplifcation_ndnf_inhibition(save=SAVE, cache=cache)
 
     if plot_supps:
 
@@ -345,10 +432,10 @@ if __name__ in "__main__":
         # ---------------------
 
         # Fig 3/4, Supp 1b: competition with pre inh on NDNF-dendrite synapses
-        exp_fig3AB_top_vary_NDNF_input(pre_inh=True, target_ND=True, save=f"{SUPP_PATH}fig34_supp1b.pdf")
+        exp_fig3AB_top_vary_NDNF_input(pre_inh=True, target_ND=True, save=f"{SUPP_PATH}fig34_supp1b.pdf", cache=cache)
 
         # Fig 3/4, Supp 2: competition with pre in on SOM-VIP synapses
-        exp_fig3AB_top_vary_NDNF_input(pre_inh=True, target_VS=True, save=f"{SUPP_PATH}fig34_supp2b.pdf")
+        exp_fig3AB_top_vary_NDNF_input(pre_inh=True, target_VS=True, save=f"{SUPP_PATH}fig34_supp2b.pdf", cache=cache)
 
     plt.show()
  
\ No newline at end of file
@@ -7,7 +7,10 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import matplotlib as mpl
 import model_base as mb
-from helpers import get_null_ff_input_arrays, get_model_colours
+from helpers import get_model_colours, model_seed
+from inputs import Pulse
+from continuation import continuation, bistable_interval
+import sweep
 
 # optional custom style sheet
 if 'pretty' in plt.style.available:
@@ -20,10 +23,12 @@ cPC, cPV, cSOM, cNDNF, cVIP, cpi = get_model_colours()
 # figure path and settings
 FIG_PATH = '../results/figs/Naumann23_draft1/'
 SUPP_PATH = '../results/figs/Naumann23_draft1/supps/'
+CACHE_PATH = '../results/cache/'
 DPI = 300
 
 
-def exp_fig3BC_bistability(noise=0.1, w_hetero=True, mean_pop=False, pre_inh=True, save=False, target_DN=False, target_VS=False):
+def exp_fig4BC_bistability(noise=0.1, w_hetero=True, mean_pop=False, pre_inh=True, save=False, target_DN=False, target_VS=False,
+                           early_stop=None, n_workers=None, seed=0, cache=None):
     """
     Check for bistability within the SOM-NDNF mutual inhibition motif. NDNF INs receive brief positive or
     negative input pulses and the NDNF rate is monitored. Vary the pulse strength and SOM-NDNF inhibition.
@@ -38,54 +43,20 @@ def exp_fig3BC_bistability(noise=0.1, w_hetero=True, mean_pop=False, pre_inh=Tru
     - save: if it's a string, name of the saved file, else if False nothing is saved
     - target_DN: whether to target NDNF-dendrite synapses with presynaptic inhibition
     - target_VS: whether to target VIP-SOM synapses with presynaptic inhibition
+    - early_stop: criterion to end simulations once the network has settled after the pulse (see
+                  stopping.EarlyStop), e.g. EarlyStop('mean', window=500, tol=1e-3, min_dur=3000), None to simulate
+                  the full duration
+    - n_workers: number of processes over which the simulations are distributed (default: all cores)
+    - seed: root seed of the simulations (see sweep.run_sweep), None to draw it from the global random state
+    - cache: cache of simulation results (see caching.ResultCache) or path of its directory, only reused with a fixed
+             seed, None for no caching
     """
 
-    # define parameter dictionaries
-    N_cells, w_mean, conn_prob, bg_inputs, taus = mb.get_default_params(flag_mean_pop=mean_pop)
-
-    # increase NDNF-dendrite inhibition s.t. mean PC rate doesn't change when dendritic inhibition changes
-    w_mean['DN'] = 0.6
-    if target_DN:
-        w_mean['DN'] = 0.8
-
-    # simulation paramters
-    dur = 8000
-    dt = 1
-    nt = int(dur/dt)
-
-    # generate inputs
-    t_act_s, t_act_e = 1000, 2000
-    xFF = get_null_ff_input_arrays(nt, N_cells)
-
-    # array of pulse strengths and SOM-NDNF inhibition to test
-    stim_NDNF = np.arange(-1.1, 1.2, 0.2)
-    vals_wNS = np.arange(0.5, 1.61, 0.1)
-
-    # empty array for storage
-    rNDNF = np.zeros((len(stim_NDNF), len(vals_wNS)))
-
-    # loop over pulse strengths and SOM-NDNF inhibition
-    print(f"Running model with varying SOM-NDNF inhibition and NDNF stimulation...")
-    for i, wNS in enumerate(vals_wNS):
-
-        print(f'\t - wNS={wNS:.2f}')
-
-        w_mean['NS'] = wNS
-        
-        for j, stim in enumerate(stim_NDNF):
-
-            xFF['N'][t_act_s:t_act_e] = stim
-
-            # instantiate model
-            model = mb.NetworkModel(N_cells, w_mean, conn_prob, taus, bg_inputs, wED=1, flag_w_hetero=w_hetero,
-                                   flag_pre_inh=pre_inh, flag_p_on_DN=target_DN, flag_p_on_VS=target_VS)
-
-            # run model
-            t, rE, rD, rS, rN, rP, rV, p, cGABA, other = model.run(dur, xFF, dt=dt, calc_bg_input=True,
-                                                                   monitor_dend_inh=True, noise=noise)
-            
-            # save mean NDNF rate a few seconds after the pulse
-            rNDNF[j, i] = np.mean(rN[7000:8000, :])
+    # simulate
+    res = run_fig4BC_bistability(noise=noise, w_hetero=w_hetero, mean_pop=mean_pop, pre_inh=pre_inh,
+                                 target_DN=target_DN, target_VS=target_VS, early_stop=early_stop, n_workers=n_workers,
+                                 seed=seed, cache=cache)
+    stim_NDNF, vals_wNS, rNDNF = res['stim_NDNF'], res['wNS'], res['rN']
 
     # Plotting
     # --------
@@ -111,12 +82,61 @@ def exp_fig3BC_bistability(noise=0.1, w_hetero=True, mean_pop=False, pre_inh=Tru
         plt.close(fig)
 
 
-def exp_fig4DEFG_mutual_inhibition(w_hetero=True, mean_pop=False, pre_inh=True, save=False, noise=0.1, wNS=1.4, 
-                                  flag_sine=False, stimup=0.5, stimdown=-0.5, target_DN=False, target_VS=False):
+# former name of exp_fig4BC_bistability
+exp_fig3BC_bistability = exp_fig4BC_bistability
+
+
+def run_fig4BC_bistability(noise=0.1, w_hetero=True, mean_pop=False, pre_inh=True, target_DN=False, target_VS=False,
+                           early_stop=None, n_workers=None, seed=0, cache=None):
     """
-    Check for bistability. NDNF INs receive a positive and a negative pulse. In a bistable regime, the NDNF rate
-    is switched to higher or lower activity after the pulse. Plot IN rates and mean NDNF- and SOM-mediated dendritic
-    inhibition. If flag_sine is True, add a time-varying input to the SOM INs and check the PC rate.
+    Simulations of exp_fig4BC_bistability (see there for the parameters), without plotting.
+
+    Returns:
+    -------
+    - dictionary with the pulse strengths ('stim_NDNF'), the SOM-NDNF weights ('wNS'), the mean NDNF rate after the
+      pulse for each pulse strength and weight ('rN') and the number of integration steps of all simulations
+      ('n_steps', the second before the pulse counts once per pulse)
+    """
+
+    # define parameter dictionaries, with simulation parameters (mean NDNF rate a few seconds after the pulse)
+    params = sweep.default_params(flag_mean_pop=mean_pop, dur=8000, dt=1, window=1000, variables=['N'], wED=1,
+                                  flag_w_hetero=w_hetero, flag_pre_inh=pre_inh, flag_p_on_DN=target_DN,
+                                  flag_p_on_VS=target_VS, calc_bg_input=True, noise=noise, early_stop=early_stop,
+                                  cache=cache, count_steps=True)
+
+    # increase NDNF-dendrite inhibition s.t. mean PC rate doesn't change when dendritic inhibition changes
+    params['w_mean']['DN'] = 0.6
+    if target_DN:
+        params['w_mean']['DN'] = 0.8
+
+    # array of pulse strengths and SOM-NDNF inhibition to test
+    stim_NDNF = np.arange(-1.1, 1.2, 0.2)
+    vals_wNS = np.arange(0.5, 1.61, 0.1)
+
+    # sweep over SOM-NDNF inhibition, the pulses of all strengths branch off the same second before the pulse
+    print(f"Running model with varying SOM-NDNF inhibition and NDNF stimulation...")
+    res = sweep.run_sweep(_pulses_to_NDNF, {'w_mean.NS': vals_wNS}, dict(params, stims=stim_NDNF),
+                          n_workers=n_workers, seed=seed)
+
+    return dict(stim_NDNF=stim_NDNF, wNS=vals_wNS, rN=res['N'].T, n_steps=int(np.sum(res['n_steps'])))
+
+
+def _pulses_to_NDNF(stims, t_act_s=1000, t_act_e=2000, **params):
+    """
+    Simulate a network with pulses of input of different strengths to NDNFs, branching off at the onset of the pulse
+    (one point of the sweep in run_fig4BC_bistability).
+    """
+    branches = [dict(N=Pulse(stim, t_act_s, t_act_e)) for stim in stims]
+    return sweep.simulate_branches(branches=branches, t_branch=t_act_s, **params)
+
+
+def exp_fig4_bistability_continuation(w_hetero=True, mean_pop=True, pre_inh=True, save=False, target_DN=False,
+                                      target_VS=False, wNS_range=(0.5, 1.6), seed=0):
+    """
+    Trace the fixed points of the network as a function of SOM-NDNF inhibition with numerical continuation (instead
+    of pulse simulations on a grid, see exp_fig4BC_bistability). The lower branch is traced from weak and the upper
+    branch from strong SOM-NDNF inhibition, the latter around its fold onto the unstable branch. Plot the mean NDNF
+    rate along the branches and the bistable interval.
 
     Parameters:
     ----------
@@ -124,53 +144,111 @@ def exp_fig4DEFG_mutual_inhibition(w_hetero=True, mean_pop=False, pre_inh=True,
     - mean_pop: whether to use mean population parameters
     - pre_inh: whether to include presynaptic inhibition
     - save: if it's a string, name of the saved file, else if False nothing is saved
-    - noise: level of white noise added to neural activity
-    - wNS: weight of NDNF to SOM inhibition
-    - flag_sine: whether to add a time-varying input to the SOM INs
-    - stimup: amplitude of positive pulse
-    - stimdown: amplitude of negative pulse
-    - target_ND: whether to target NDNF-dendrite synapses with presynaptic inhibition
+    - target_DN: whether to target NDNF-dendrite synapses with presynaptic inhibition
     - target_VS: whether to target VIP-SOM synapses with presynaptic inhibition
+    - wNS_range: range of SOM-NDNF inhibition
+    - seed: seed of the model (see helpers.model_seed), None to draw it from the global random state
+    """
+
+    # trace the branches
+    res = run_fig4_bistability_continuation(w_hetero=w_hetero, mean_pop=mean_pop, pre_inh=pre_inh,
+                                            target_DN=target_DN, target_VS=target_VS, wNS_range=wNS_range, seed=seed)
+    lower, upper, interval = res['lower'], res['upper'], res['interval']
+
+    # Plotting
+    # --------
+    dpi = 300 if save else DPI
+    fig, ax = plt.subplots(1, 1, figsize=(1.7, 1.4), dpi=dpi, gridspec_kw={'left': 0.26, 'bottom': 0.27, 'top': 0.95,
+                                                                           'right': 0.94})
+    # plot mean NDNF rate along the branches, stable parts solid and unstable parts dashed
+    for branch in [lower, upper]:
+        rN = np.mean(branch['N'], axis=1)
+        ax.plot(branch['param'], np.where(branch['stable'], rN, np.nan), c=cNDNF, lw=2)
+        ax.plot(branch['param'], np.where(branch['stable'], np.nan, rN), c=cNDNF, lw=1, ls='--')
+    # mark bistable interval
+    if interval is not None:
+        ax.axvspan(*interval, color='0.9', zorder=-1)
+    ax.set(xlabel='SOM-NDNF inh.', ylabel='NDNF act.', xlim=wNS_range, ylim=[-0.1, 2.5], xticks=[0.5, 1, 1.5],
+           yticks=[0, 1, 2])
+
+    # Saving
+    # ------
+    if save:
+        pre_inh_str = '_with_pre_inh' if pre_inh else '_without_pre_inh'
+        savename = f"{FIG_PATH}exp_fig4_continuation{pre_inh_str}.pdf" if not isinstance(save, str) else save
+        fig.savefig(savename, dpi=300)
+        plt.close(fig)
+
+
+def run_fig4_bistability_continuation(w_hetero=True, mean_pop=True, pre_inh=True, target_DN=False, target_VS=False,
+                                      wNS_range=(0.5, 1.6), seed=0):
+    """
+    Continuation of exp_fig4_bistability_continuation (see there for the parameters), without plotting.
+
+    Returns:
+    -------
+    - dictionary with the lower and upper branch ('lower', 'upper', see continuation.continuation) and the bistable
+      interval ('interval', see continuation.bistable_interval)
     """
 
     # define parameter dictionaries
     N_cells, w_mean, conn_prob, bg_inputs, taus = mb.get_default_params(flag_mean_pop=mean_pop)
 
-    # increase SOM to NDNF inhibition to get bistable regime
-    w_mean['NS'] = wNS
-
     # increase NDNF-dendrite inhibition s.t. mean PC rate doesn't change when dendritic inhibition changes
     w_mean['DN'] = 0.6
     if target_DN:
-        w_mean['DN'] = 0.8 # increase NDNF to dendrite inhibition further to compensate
+        w_mean['DN'] = 0.8
 
     # instantiate model
     model = mb.NetworkModel(N_cells, w_mean, conn_prob, taus, bg_inputs, wED=1, flag_w_hetero=w_hetero,
-                           flag_pre_inh=pre_inh, flag_p_on_DN=target_DN, flag_p_on_VS=target_VS)
+                            flag_pre_inh=pre_inh, flag_p_on_DN=target_DN, flag_p_on_VS=target_VS,
+                            seed=model_seed(seed))
 
-    # simulation paramters
-    dur = 10000
-    dt = 1
-    nt = int(dur/dt)
+    # trace lower and upper branch
+    print(f"Tracing fixed points with varying SOM-NDNF inhibition...")
+    wNS_min, wNS_max = wNS_range
+    lower = continuation(model, 'wNS', wNS_min, wNS_max)
+    upper = continuation(model, 'wNS', wNS_max, wNS_min, start=dict(N=3))
+    interval = bistable_interval(lower, upper)
+    if interval is not None:
+        print(f"\t - bistable for SOM-NDNF inhibition between {interval[0]:.3f} and {interval[1]:.3f}")
 
-    # generate inputs
-    t_act_s, t_act_e = 1000, 2000
-    t_inact_s, t_inact_e = 5000, 6000
-    xFF = get_null_ff_input_arrays(nt, N_cells)
-    xFF['N'][t_act_s:t_act_e] = stimup
-    xFF['N'][t_inact_s:t_inact_e] = stimdown
+    return dict(lower=lower, upper=upper, interval=interval)
 
-    if flag_sine:
-        # add time-varying inputs to SOM (and NDNF)
-        tt = np.arange(0, dur/1000+1, dt/1000)  # generate 1s longer to enable shifting when quantifying signal
-        sine = np.sin(2*np.pi*tt*2)
-        amp_sine = 0.5
-        xFF['S'][:,:] += amp_sine*np.tile(sine[1000:], [N_cells['S'], 1]).T
 
-    # run model
-    print(f"Running model with wNS={wNS} and sine={flag_sine}...")
-    t, rE, rD, rS, rN, rP, rV, p, cGABA, other = model.run(dur, xFF, dt=dt, calc_bg_input=True,
-                                                           monitor_dend_inh=True, noise=noise)
+def exp_fig4DEFG_mutual_inhibition(w_hetero=True, mean_pop=False, pre_inh=True, save=False, noise=0.1, wNS=1.4, 
+                                  flag_sine=False, stimup=0.5, stimdown=-0.5, target_DN=False, target_VS=False, seed=0,
+                                  cache=None):
+    """
+    Check for bistability. NDNF INs receive a positive and a negative pulse. In a bistable regime, the NDNF rate
+    is switched to higher or lower activity after the pulse. Plot IN rates and mean NDNF- and SOM-mediated dendritic
+    inhibition. If flag_sine is True, add a time-varying input to the SOM INs and check the PC rate.
+
+    Parameters:
+    ----------
+    - w_hetero: whether to add heterogeneity to weight matrices
+    - mean_pop: whether to use mean population parameters
+    - pre_inh: whether to include presynaptic inhibition
+    - save: if it's a string, name of the saved file, else if False nothing is saved
+    - noise: level of white noise added to neural activity
+    - wNS: weight of NDNF to SOM inhibition
+    - flag_sine: whether to add a time-varying input to the SOM INs
+    - stimup: amplitude of positive pulse
+    - stimdown: amplitude of negative pulse
+    - target_ND: whether to target NDNF-dendrite synapses with presynaptic inhibition
+    - target_VS: whether to target VIP-SOM synapses with presynaptic inhibition
+    - seed: seed of the model (see helpers.model_seed), None to draw it from the global random state
+    - cache: cache of simulation results (see caching.ResultCache) or path of its directory, None for no caching
+    """
+
+    # simulate
+    res = run_fig4DEFG_mutual_inhibition(w_hetero=w_hetero, mean_pop=mean_pop, pre_inh=pre_inh, noise=noise, wNS=wNS,
+                                         flag_sine=flag_sine, stimup=stimup, stimdown=stimdown, target_DN=target_DN,
+                                         target_VS=target_VS, seed=seed, cache=cache)
+    t, rE, rD, rS, rN, rP, rV, p, cGABA, other = res['result']
+    (t_act_s, t_act_e), (t_inact_s, t_inact_e) = res['pulses']
+    sine = res['sine']
+    nt = len(t)
 
     # Plotting
     # --------
@@ -187,8 +265,8 @@ def exp_fig4DEFG_mutual_inhibition(w_hetero=True, mean_pop=False, pre_inh=True,
         if target_VS:
             ax[0].plot(t/1000, rV, alpha=alpha, c=cVIP, lw=1)
         # plot mean NDNF- and SOM-mediated dendritic inhibition
-        mean_dend_NDNF = np.mean(np.array(other['dend_inh_NDNF']), axis=1)
-        mean_dend_SOM = np.mean(np.array(other['dend_inh_SOM']), axis=1)
+        mean_dend_NDNF = np.mean(other['dend_inh_NDNF'], axis=1)
+        mean_dend_SOM = np.mean(other['dend_inh_SOM'], axis=1)
         ax[1].plot(t/1000, mean_dend_NDNF, c=cNDNF, ls='--', lw=lw)
         ax[1].plot(t/1000, mean_dend_SOM, c=cSOM, ls='--', lw=lw)
 
@@ -270,25 +348,79 @@ def exp_fig4DEFG_mutual_inhibition(w_hetero=True, mean_pop=False, pre_inh=True,
         plt.close(fig)
 
 
+def run_fig4DEFG_mutual_inhibition(w_hetero=True, mean_pop=False, pre_inh=True, noise=0.1, wNS=1.4, flag_sine=False,
+                                   stimup=0.5, stimdown=-0.5, target_DN=False, target_VS=False, seed=0, cache=None):
+    """
+    Simulation of exp_fig4DEFG_mutual_inhibition (see there for the parameters), without plotting.
+
+    Returns:
+    -------
+    - dictionary with the SimulationResult ('result'), the sine wave of the time-varying input to SOMs ('sine', from
+      1 s before the start, None without it), the start and end time of the positive and negative pulse ('pulses')
+      and the number of integration steps ('n_steps')
+    """
+
+    # define parameter dictionaries
+    N_cells, w_mean, conn_prob, bg_inputs, taus = mb.get_default_params(flag_mean_pop=mean_pop)
+
+    # increase SOM to NDNF inhibition to get bistable regime
+    w_mean['NS'] = wNS
+
+    # increase NDNF-dendrite inhibition s.t. mean PC rate doesn't change when dendritic inhibition changes
+    w_mean['DN'] = 0.6
+    if target_DN:
+        w_mean['DN'] = 0.8 # increase NDNF to dendrite inhibition further to compensate
+
+    # instantiate model
+    model = mb.NetworkModel(N_cells, w_mean, conn_prob, taus, bg_inputs, wED=1, flag_w_hetero=w_hetero,
+                           flag_pre_inh=pre_inh, flag_p_on_DN=target_DN, flag_p_on_VS=target_VS,
+                           seed=model_seed(seed))
+
+    # simulation paramters
+    dur = 10000
+    dt = 1
+
+    # generate inputs
+    t_act_s, t_act_e = 1000, 2000
+    t_inact_s, t_inact_e = 5000, 6000
+    xFF = dict(N=Pulse(stimup, t_act_s*dt, t_act_e*dt) + Pulse(stimdown, t_inact_s*dt, t_inact_e*dt))
+
+    sine = None
+    if flag_sine:
+        # add time-varying inputs to SOM (and NDNF)
+        tt = np.arange(0, dur/1000+1, dt/1000)  # generate 1s longer to enable shifting when quantifying signal
+        sine = np.sin(2*np.pi*tt*2)
+        amp_sine = 0.5
+        xFF['S'] = amp_sine*sine[1000:]
+
+    # run model
+    print(f"Running model with wNS={wNS} and sine={flag_sine}...")
+    res = model.run(dur, xFF, dt=dt, calc_bg_input=True, monitor_dend_inh=True, noise=noise, cache=cache)
+
+    return dict(result=res, sine=sine, pulses=[(t_act_s, t_act_e), (t_inact_s, t_inact_e)], n_steps=res.total_steps)
+
+
 if __name__ in "__main__":
 
     SAVE = False
+    CACHE = True  # reuse the simulations of earlier runs
     plot_supps = False
+    cache = CACHE_PATH if CACHE else None
     
     # Fig 4: Mutual inhibition between NDNF and SOM
     # ---------------------------------------------
     
     #B&C: parameter sweep for quantification of switch regime
-    exp_fig3BC_bistability(save=SAVE)
+    exp_fig4BC_bistability(save=SAVE, cache=cache)
 
     # E: pulse input example (not bistable)
-    exp_fig4DEFG_mutual_inhibition(wNS=0.7, save=SAVE)
+    exp_fig4DEFG_mutual_inhibition(wNS=0.7, save=SAVE, cache=cache)
     
     # D: pulse input example (bistable)
-    exp_fig4DEFG_mutual_inhibition(wNS=1.2, save=SAVE)
+    exp_fig4DEFG_mutual_inhibition(wNS=1.2, save=SAVE, cache=cache)
 
     # F&G: switch with time-varying input to SOM
-    exp_fig4DEFG_mutual_inhibition(wNS=1.2, flag_sine=True, save=SAVE)
+    exp_fig4DEFG_mutual_inhibition(wNS=1.2, flag_sine=True, save=SAVE, cache=cache)
 
     if plot_supps:
 
@@ -296,11 +428,12 @@ if __name__ in "__main__":
     # ---------------------
 
         # Fig 3/4, Supp 1c/d: bistability with pre inh on NDNF-dendrite synapses
-        exp_fig4DEFG_mutual_inhibition(wNS=1.2, target_DN=True, save=f'{SUPP_PATH}fig34_supp1c.pdf')
-        exp_fig3BC_bistability(target_DN=True, save=f'{SUPP_PATH}fig34_supp1d.pdf')
+        exp_fig4DEFG_mutual_inhibition(wNS=1.2, target_DN=True, save=f'{SUPP_PATH}fig34_supp1c.pdf', cache=cache)
+        exp_fig4BC_bistability(target_DN=True, save=f'{SUPP_PATH}fig34_supp1d.pdf', cache=cache)
         
         # Fig 3/4, Supp 2: bistability with pre in on SOM-VIP synapses
-        exp_fig4DEFG_mutual_inhibition(wNS=1.2, stimdown=-0.4, target_VS=True, save=f'{SUPP_PATH}fig34_supp2c.pdf')
-        exp_fig3BC_bistability(target_VS=True, save=f'{SUPP_PATH}fig34_supp2d.pdf')
+        exp_fig4DEFG_mutual_inhibition(wNS=1.2, stimdown=-0.4, target_VS=True, save=f'{SUPP_PATH}fig34_supp2c.pdf',
+                                       cache=cache)
+        exp_fig4BC_bistability(target_VS=True, save=f'{SUPP_PATH}fig34_supp2d.pdf', cache=cache)
 
     plt.show()
\ No newline at end of file
@@ -13,7 +13,9 @@ if 'pretty' in plt.style.available:
 lw = mpl.rcParams['lines.linewidth']
 
 import model_base as mb
-from helpers import get_null_ff_input_arrays, get_model_colours
+import branching
+from helpers import get_model_colours, model_seed
+from inputs import ExpKernel
 
 # get model colours
 cPC, cPV, cSOM, cNDNF, cVIP, cpi = get_model_colours()
@@ -21,10 +23,12 @@ cPC, cPV, cSOM, cNDNF, cVIP, cpi = get_model_colours()
 # figure path and settings
 FIG_PATH = '../results/figs/Naumann23_draft1/'
 SUPP_PATH = '../results/figs/Naumann23_draft1/supps/'
+CACHE_PATH = '../results/cache/'
 DPI = 300
 
 
-def exp_fig5B_IPSC_timescale(dur=1000, dt=1, w_hetero=True, mean_pop=False, pre_inh=True, noise=0.1, save=False):
+def exp_fig5B_IPSC_timescale(dur=1000, dt=1, w_hetero=True, mean_pop=False, pre_inh=True, noise=0.1, save=False, seed=0,
+                             cache=None):
     """
     Paired "in vitro" recordings and plot. Stimulate NDNF and SOM, record the 'currents' to PC to show the slower IPSC
     elicted by NDNFs compared to SOMs. "in vitro" means all cells have 0 baseline activity. 
@@ -38,13 +42,14 @@ def exp_fig5B_IPSC_timescale(dur=1000, dt=1, w_hetero=True, mean_pop=False, pre_
     - pre_inh: whether to include presynaptic inhibition
     - noise: level of white noise added to neural activity
     - save: if it's a string, name of the saved file, else if False nothing is saved
+    - seed: root seed of the models (see helpers.model_seed), None to draw their seeds from the global random state
+    - cache: cache of simulation results (see caching.ResultCache) or path of its directory, None for no caching
     """
 
-    # simulation paramters
-    nt = int(dur / dt)
-    t = np.arange(0, dur, dt)
-    t0 = 100
-    amp = 3
+    # simulate
+    res = run_fig5B_IPSC_timescale(dur=dur, dt=dt, w_hetero=w_hetero, mean_pop=mean_pop, pre_inh=pre_inh, noise=noise,
+                                   seed=seed, cache=cache)
+    t = res['t']
 
     # create figure
     dpi = 300 if save else DPI
@@ -52,40 +57,64 @@ def exp_fig5B_IPSC_timescale(dur=1000, dt=1, w_hetero=True, mean_pop=False, pre_
     fig, ax = plt.subplots(1, 1, figsize=(1.8, 1.15), dpi=dpi, sharex=True, sharey='row',
                            gridspec_kw={'right': 0.95, 'bottom': 0.33, 'left': 0.25})
 
-    # get default parameters
-    N_cells, w_mean, conn_prob, bg_inputs, taus = mb.get_default_params(flag_mean_pop=mean_pop)
-
     # labels
     labelz = ['SOM', 'NDNF']
 
+    # plot the mean current to PCs when SOM and NDNF are stimulated, respectively
+    for i, cell in enumerate(['S', 'N']):
+        mean_act = res['curr_rE'][cell]
+        ax.plot(t[1:]/1000, -mean_act, c=eval('c'+labelz[i]), label=f'{labelz[i]} inh.', lw=1)
+
+    ax.legend(loc=(0.35, 0.56), handlelength=1, frameon=False, fontsize=8)
+    ax.set(xlabel='time (s)', ylim=[-0.05, 0.8], xticks=[0, 1], ylabel='PC curr. (au)')
+
+    if save:
+        fig.savefig(f'{FIG_PATH}exp_fig5B_IPSCs.pdf', dpi=300)
+        plt.close(fig)
+
+
+def run_fig5B_IPSC_timescale(dur=1000, dt=1, w_hetero=True, mean_pop=False, pre_inh=True, noise=0.1, seed=0,
+                             cache=None):
+    """
+    Simulations of exp_fig5B_IPSC_timescale (see there for the parameters), without plotting.
+
+    Returns:
+    -------
+    - dictionary with the time array ('t'), the mean input current to PCs when SOM ('S') or NDNF ('N') is stimulated
+      ('curr_rE') and the number of integration steps of both simulations ('n_steps')
+    """
+
+    # simulation paramters
+    t0 = 100
+    amp = 3
+
+    # get default parameters
+    N_cells, w_mean, conn_prob, bg_inputs, taus = mb.get_default_params(flag_mean_pop=mean_pop)
+
     # stimulate SOM and NDNF, respectively
+    curr_rE = dict()
+    n_steps = 0
     print("Running model for IPSC timescale experiment...")
-    for i, cell in enumerate(['S', 'N']):
+    for cell in ['S', 'N']:
 
         # array of FF input, instantaneous increase and exponential decay
-        xFF = get_null_ff_input_arrays(nt, N_cells)
-        xFF[cell][:, :] = amp * np.tile(np.exp(-(t - t0) / 50) * np.heaviside(t - t0, 1), (N_cells[cell], 1)).T
+        xFF = {cell: ExpKernel(amp, t0, 50)}
 
         # create model and run
         model = mb.NetworkModel(N_cells, w_mean, conn_prob, taus, bg_inputs, wED=1, flag_w_hetero=w_hetero,
-                                flag_pre_inh=pre_inh, gamma=1)
-        t, rE, rD, rS, rN, rP, rV, p, cGABA, other = model.run(dur, xFF, dt=dt, init_noise=0, noise=noise, 
-                                                               rE0=0, rD0=1, rN0=0, rS0=0, rP0=0, monitor_currents=True)
+                                flag_pre_inh=pre_inh, gamma=1, seed=model_seed(seed, cell))
+        res = model.run(dur, xFF, dt=dt, init_noise=0, noise=noise, rE0=0, rD0=1, rN0=0, rS0=0, rP0=0,
+                        monitor_currents=True, cache=cache)
         # note: dendritic activity is set to 1 so that the inhibition by SOM and NDNF shows in the soma
 
-        # plotting and labels
-        mean_act = np.mean(other['curr_rE'], axis=1)
-        ax.plot(t[1:]/1000, -mean_act, c=eval('c'+labelz[i]), label=f'{labelz[i]} inh.', lw=1)
-
-    ax.legend(loc=(0.35, 0.56), handlelength=1, frameon=False, fontsize=8)
-    ax.set(xlabel='time (s)', ylim=[-0.05, 0.8], xticks=[0, 1], ylabel='PC curr. (au)')
+        curr_rE[cell] = np.mean(res.other['curr_rE'], axis=1)
+        n_steps += res.total_steps
 
-    if save:
-        fig.savefig(f'{FIG_PATH}exp_fig5B_IPSCs.pdf', dpi=300)
-        plt.close(fig)
+    return dict(t=res.t, curr_rE=curr_rE, n_steps=n_steps)
 
 
-def exp_fig5CD_transient_signals(mean_pop=False, w_hetero=True, save=False, noise=0.1, plot_supp=False):
+def exp_fig5CD_transient_signals(mean_pop=False, w_hetero=True, save=False, noise=0.1, plot_supp=False, seed=0,
+                                 cache=None):
     """
     Study transmission of transient signals by NDNF and SOM. Stimulate NDNF and SOM with pulses of different length
     and record the change in PC activity. Perform the same experiment with and without presynaptic inhibition and
@@ -97,25 +126,15 @@ def exp_fig5CD_transient_signals(mean_pop=False, w_hetero=True, save=False, nois
     - w_hetero: whether to add heterogeneity to weight matrices
     - save: whether to save the figure
     - noise: level of white noise added to neural activity
+    - plot_supp: whether to also plot the supplementary figures
+    - seed: root seed of the models (see helpers.model_seed), None to draw their seeds from the global random state
+    - cache: cache of simulation results (see caching.ResultCache) or path of its directory, None for no caching
     """
 
-    # define parameter dictionaries
-    N_cells, w_mean, conn_prob, bg_inputs, taus = mb.get_default_params(flag_mean_pop=mean_pop)
-
-    # increase NDNF-dendrite inhibition
-    wDNs = [w_mean['DN'], 0.8]      
-
-    # simulation paramters
-    dur = 5000
-    dt = 1
-    nt = int(dur/dt)
-    stim_durs = (np.array([10, 20, 50, 100, 200, 500, 1000])*dt).astype(int)
-    ts = int(1000*dt)
-    amp = 1.5
-
-    # empty arrays for storage of PC signal amplitudes
-    deltaPC_stim_N = np.zeros(len(stim_durs))
-    deltaPC_stim_S = np.zeros(len(stim_durs))
+    # simulate
+    res = run_fig5CD_transient_signals(mean_pop=mean_pop, w_hetero=w_hetero, noise=noise, traces=plot_supp, seed=seed,
+                                       cache=cache)
+    t, ts, stim_durs, traces = res['t'], res['ts'], res['stim_durs'], res['traces']
 
     i_show = 5
 
@@ -133,53 +152,28 @@ def exp_fig5CD_transient_signals(mean_pop=False, w_hetero=True, save=False, nois
         i_supp_list = [3, 4, 5]
 
     # loop over presynaptic inhibition and NDNF-dendrite inhibition strength
-    print("Running model for transient input experiment...")
     for k, pre_inh in enumerate([True, False]):
 
-        print(f"\t - pre inh = {pre_inh}")  # print progress
+        for j in range(len(res['wDN'])):
 
-        for j, wDN in enumerate(wDNs):
-
-            # change wDN parameter
-            w_mean['DN'] = wDN
-            model = mb.NetworkModel(N_cells, w_mean, conn_prob, taus, bg_inputs, wED=1, flag_w_hetero=w_hetero, flag_pre_inh=pre_inh)
+            # change in PC activity for input to SOM and NDNF
+            deltaPC_stim_S = res['deltaPC_S'][k, j]
+            deltaPC_stim_N = res['deltaPC_N'][k, j]
 
             for i, sdur in enumerate(stim_durs):
 
-                xff_null = np.zeros(nt)
-                xff_stim = xff_null.copy()
-                xff_stim[ts:ts+sdur] = amp
-                
-                # simulate with sine input to SOM
-                xFF = get_null_ff_input_arrays(nt, N_cells)
-                xFF['S'] = np.tile(xff_stim, [N_cells['S'], 1]).T
-                xFF['N'] = np.tile(xff_null, [N_cells['N'], 1]).T
-                t, rE1, rD1, rS1, rN1, rP1, rV1, p1, cGABA1, other1 = model.run(dur, xFF, dt=dt, calc_bg_input=True, noise=noise, monitor_dend_inh=True)
-
-                # simulate with sine input to NDNF
-                xFF = get_null_ff_input_arrays(nt, N_cells)
-                xFF['S'] = np.tile(xff_null, [N_cells['S'], 1]).T
-                xFF['N'] = np.tile(xff_stim, [N_cells['N'], 1]).T
-                t, rE2, rD2, rS2, rN2, rP2, rV2, p2, cGABA2, other2 = model.run(dur, xFF, dt=dt, calc_bg_input=True, noise=noise, monitor_dend_inh=True)
-
-                # compute change in PC activity
-                bl1 = np.mean(rE1[500:ts])
-                bl2 = np.mean(rE2[500:ts])
-                deltaPC_stim_S[i] = (np.mean(rE1[ts:ts+sdur]-bl1))
-                deltaPC_stim_N[i] = (np.mean(rE2[ts:ts+sdur]-bl2))
-
                 if pre_inh and i==i_show:
-                    ax2.plot(t/1000, np.mean(rE2, axis=1), color=cols_PC[j])
+                    ax2.plot(t/1000, traces['rE'][k, j, i], color=cols_PC[j])
 
                 if plot_supp and pre_inh and (i in i_supp_list):
                     axx = ax3 if j == 0 else ax4
-                    axx[0, plot_count].plot(t/1000, np.mean(rE2, axis=1), c=cPC)
-                    axx[1, plot_count].plot(t/1000, np.mean(rN2, axis=1), c=cNDNF)
-                    axx[1, plot_count].plot(t/1000, np.mean(rS2, axis=1), c=cSOM)
-                    axx[1, plot_count].plot(t/1000, np.mean(rP2, axis=1), c=cPV)
-                    mean_inh_NDNF = np.mean(np.array(other2['dend_inh_NDNF']), axis=1)
-                    mean_inh_SOM = np.mean(np.array(other2['dend_inh_SOM']), axis=1)
-                    mean_inh_PV = np.mean(np.array(other2['soma_inh_PV']), axis=1)
+                    axx[0, plot_count].plot(t/1000, traces['rE'][k, j, i], c=cPC)
+                    axx[1, plot_count].plot(t/1000, traces['rN'][k, j, i], c=cNDNF)
+                    axx[1, plot_count].plot(t/1000, traces['rS'][k, j, i], c=cSOM)
+                    axx[1, plot_count].plot(t/1000, traces['rP'][k, j, i], c=cPV)
+                    mean_inh_NDNF = traces['dend_inh_NDNF'][k, j, i]
+                    mean_inh_SOM = traces['dend_inh_SOM'][k, j, i]
+                    mean_inh_PV = traces['soma_inh_PV'][k, j, i]
                     axx[2, plot_count].plot(t/1000, mean_inh_NDNF-np.mean(mean_inh_NDNF[:ts]), c=cNDNF, lw=1, ls='--')
                     axx[2, plot_count].plot(t/1000, mean_inh_SOM-np.mean(mean_inh_SOM[:ts]), c=cSOM, lw=1, ls='--')
                     axx[2, plot_count].plot(t/1000, mean_inh_PV-np.mean(mean_inh_PV[:ts]), c=cPV, lw=1, ls='--')
@@ -221,7 +215,101 @@ def exp_fig5CD_transient_signals(mean_pop=False, w_hetero=True, save=False, nois
             plt.close(fig4)
 
 
-def exp_fig5E_inh_change(mean_pop=False, w_hetero=True, pre_inh=True, noise=0.1, wDN=0.4, save=False):
+def run_fig5CD_transient_signals(mean_pop=False, w_hetero=True, noise=0.1, traces=False, seed=0, cache=None):
+    """
+    Simulations of exp_fig5CD_transient_signals (see there for the parameters), without plotting.
+
+    Parameters:
+    ----------
+    - traces: whether to also return the population means of the IN rates and of the inhibition of the simulations
+              with input to NDNF (only the mean PC rate otherwise)
+
+    Returns:
+    -------
+    - dictionary with the time array ('t'), the stimulus onset ('ts') and durations ('stim_durs'), the NDNF-dendrite
+      weights ('wDN'), the change in PC activity for input to SOM and NDNF ('deltaPC_S', 'deltaPC_N', of shape
+      (pre inh on/off, wDN, stimulus duration)), the population means of the simulations with input to NDNF
+      ('traces', with the same leading axes followed by time: PC rate 'rE', and with traces also 'rN', 'rS', 'rP',
+      'dend_inh_NDNF', 'dend_inh_SOM', 'soma_inh_PV') and the number of integration steps of all simulations
+      ('n_steps', the shared first second counts once per input)
+    """
+
+    # define parameter dictionaries
+    N_cells, w_mean, conn_prob, bg_inputs, taus = mb.get_default_params(flag_mean_pop=mean_pop)
+
+    # increase NDNF-dendrite inhibition
+    wDNs = [w_mean['DN'], 0.8]      
+
+    # simulation paramters
+    dur = 5000
+    dt = 1
+    nt = int(dur/dt)
+    stim_durs = (np.array([10, 20, 50, 100, 200, 500, 1000])*dt).astype(int)
+    ts = int(1000*dt)
+    amp = 1.5
+
+    # empty arrays for storage of PC signal amplitudes and population means
+    deltaPC_stim_N = np.zeros((2, len(wDNs), len(stim_durs)))
+    deltaPC_stim_S = np.zeros((2, len(wDNs), len(stim_durs)))
+    names = ['rE', 'rN', 'rS', 'rP', 'dend_inh_NDNF', 'dend_inh_SOM', 'soma_inh_PV'] if traces else ['rE']
+    mean_traces = {name: np.zeros((2, len(wDNs), len(stim_durs), nt)) for name in names}
+    n_steps = 0
+
+    # loop over presynaptic inhibition and NDNF-dendrite inhibition strength
+    print("Running model for transient input experiment...")
+    for k, pre_inh in enumerate([True, False]):
+
+        print(f"\t - pre inh = {pre_inh}")  # print progress
+
+        for j, wDN in enumerate(wDNs):
+
+            # change wDN parameter
+            w_mean['DN'] = wDN
+            model = mb.NetworkModel(N_cells, w_mean, conn_prob, taus, bg_inputs, wED=1, flag_w_hetero=w_hetero,
+                                    flag_pre_inh=pre_inh, seed=model_seed(seed, k, j))
+
+            # inputs to SOM and NDNF for all stimulus durations, which share the unstimulated dynamics before ts
+            xff_null = np.zeros(nt)
+            branches = []
+            for sdur in stim_durs:
+                xff_stim = xff_null.copy()
+                xff_stim[ts:ts+sdur] = amp
+                branches += [dict(S=xff_stim, N=xff_null), dict(S=xff_null, N=xff_stim)]
+
+            # simulate the shared first second once and branch off for each input
+            results = branching.run_branches(model, dur, ts*dt, branches, dt=dt, calc_bg_input=True, noise=noise,
+                                             monitor_dend_inh=True, cache=cache)
+            n_steps += sum(res.total_steps for res in results)
+
+            for i, sdur in enumerate(stim_durs):
+
+                # simulation with input to SOM
+                t, rE1, rD1, rS1, rN1, rP1, rV1, p1, cGABA1, other1 = results[2*i]
+
+                # simulation with input to NDNF
+                t, rE2, rD2, rS2, rN2, rP2, rV2, p2, cGABA2, other2 = results[2*i+1]
+
+                # compute change in PC activity
+                bl1 = np.mean(rE1[500:ts])
+                bl2 = np.mean(rE2[500:ts])
+                deltaPC_stim_S[k, j, i] = (np.mean(rE1[ts:ts+sdur]-bl1))
+                deltaPC_stim_N[k, j, i] = (np.mean(rE2[ts:ts+sdur]-bl2))
+
+                # population means with input to NDNF
+                mean_traces['rE'][k, j, i] = np.mean(rE2, axis=1)
+                if traces:
+                    mean_traces['rN'][k, j, i] = np.mean(rN2, axis=1)
+                    mean_traces['rS'][k, j, i] = np.mean(rS2, axis=1)
+                    mean_traces['rP'][k, j, i] = np.mean(rP2, axis=1)
+                    for name in ['dend_inh_NDNF', 'dend_inh_SOM', 'soma_inh_PV']:
+                        mean_traces[name][k, j, i] = np.mean(other2[name], axis=1)
+
+    return dict(t=t, ts=ts, stim_durs=stim_durs, wDN=wDNs, deltaPC_S=deltaPC_stim_S, deltaPC_N=deltaPC_stim_N,
+                traces=mean_traces, n_steps=n_steps)
+
+
+def exp_fig5E_inh_change(mean_pop=False, w_hetero=True, pre_inh=True, noise=0.1, wDN=0.4, save=False, seed=0,
+                         cache=None):
     """
     Study the change in inhibition at PCs for different stimulus durations. Stimulate NDNF and SOM with pulses
     of different length and monitor the NDNF-dendrite, SOM-dendrite and PV-PC inhibition. Plot results.
@@ -234,6 +322,48 @@ def exp_fig5E_inh_change(mean_pop=False, w_hetero=True, pre_inh=True, noise=0.1,
     - noise: level of white noise added to neural activity
     - wDN: strength of NDNF-dendrite inhibition
     - save: whether to save the figure
+    - seed: seed of the model (see helpers.model_seed), None to draw it from the global random state
+    - cache: cache of simulation results (see caching.ResultCache) or path of its directory, None for no caching
+    """
+
+    # simulate
+    res = run_fig5E_inh_change(mean_pop=mean_pop, w_hetero=w_hetero, pre_inh=pre_inh, noise=noise, wDN=wDN, seed=seed,
+                               cache=cache)
+
+    # set up figure
+    dpi = 300 if save else 300
+    fig, ax = plt.subplots(1, 1, dpi=300, figsize=(1.5, 0.9), sharex=True, sharey=True, gridspec_kw=dict(left=0.25, right=0.97))
+
+    # loop over stimulus durations
+    for i in range(len(res['stim_durs'])):
+
+        # plot change in dendritic and somatic inhibition
+        ddi_NDNF, ddi_SOM, dsi_PV = res['ddi_NDNF'][i], res['ddi_SOM'][i], res['dsi_PV'][i]
+        ax.bar(i*1.3-0.3, ddi_NDNF, facecolor='none', edgecolor=cNDNF, hatch='/////', width=0.2, label='NDNF' if i==0 else None)
+        ax.bar(i*1.3-0.1, ddi_SOM, facecolor='none', edgecolor=cSOM, hatch='/////', width=0.2, label='SOM' if i==0 else None)
+        ax.bar(i*1.3+0.1, dsi_PV, facecolor='none', edgecolor=cPV, hatch='/////', width=0.2, label='PV' if i==0 else None)
+        ax.bar(i*1.3+0.3, ddi_SOM+ddi_NDNF+dsi_PV, facecolor='none', edgecolor='silver', hatch='/////', width=0.2)
+        # labels and formatting
+        ax.hlines(0, -0.5, 1.8, color='k', lw=1)
+        ax.set(ylabel=r'$\Delta$ inh.', xticks=[], ylim=[-0.6, 1.1])
+        ax.spines['bottom'].set_visible(False)
+
+    # save
+    if save:
+        wDN_str = str(wDN).replace('.', 'p')
+        fig.savefig(f"{FIG_PATH}exp_fig5E_inh_change_{wDN_str}.pdf", dpi=300)
+        plt.close(fig)
+
+
+def run_fig5E_inh_change(mean_pop=False, w_hetero=True, pre_inh=True, noise=0.1, wDN=0.4, seed=0, cache=None):
+    """
+    Simulations of exp_fig5E_inh_change (see there for the parameters), without plotting.
+
+    Returns:
+    -------
+    - dictionary with the stimulus durations ('stim_durs'), the change in NDNF- and SOM-mediated dendritic and
+      PV-mediated somatic inhibition during input to NDNF for each duration ('ddi_NDNF', 'ddi_SOM', 'dsi_PV') and the
+      number of integration steps of all simulations ('n_steps')
     """
 
     # define parameter dictionaries
@@ -250,12 +380,15 @@ def exp_fig5E_inh_change(mean_pop=False, w_hetero=True, pre_inh=True, noise=0.1,
     ts = int(1000*dt)
     amp = 1.5
 
-    # set up figure
-    dpi = 300 if save else 300
-    fig, ax = plt.subplots(1, 1, dpi=300, figsize=(1.5, 0.9), sharex=True, sharey=True, gridspec_kw=dict(left=0.25, right=0.97))
-
     # create model
-    model = mb.NetworkModel(N_cells, w_mean, conn_prob, taus, bg_inputs, wED=1, flag_w_hetero=w_hetero, flag_pre_inh=pre_inh)
+    model = mb.NetworkModel(N_cells, w_mean, conn_prob, taus, bg_inputs, wED=1, flag_w_hetero=w_hetero,
+                            flag_pre_inh=pre_inh, seed=model_seed(seed))
+
+    # empty arrays for the change in inhibition
+    ddi_SOM = np.zeros(len(stim_durs))
+    ddi_NDNF = np.zeros(len(stim_durs))
+    dsi_PV = np.zeros(len(stim_durs))
+    n_steps = 0
 
     # loop over stimulus durations
     print("Running model for inhibition change experiment...")
@@ -266,59 +399,46 @@ def exp_fig5E_inh_change(mean_pop=False, w_hetero=True, pre_inh=True, noise=0.1,
         xff_stim[ts:ts+sdur] = amp
         
         # simulate with input to SOM
-        xFF = get_null_ff_input_arrays(nt, N_cells)
-        xFF['S'] = np.tile(xff_stim, [N_cells['S'], 1]).T
-        xFF['N'] = np.tile(xff_null, [N_cells['N'], 1]).T
-        t, rE1, rD1, rS1, rN1, rP1, rV1, p1, cGABA1, other1 = model.run(dur, xFF, dt=dt, calc_bg_input=True, noise=noise, monitor_dend_inh=True)
+        xFF = dict(S=xff_stim, N=xff_null)
+        res1 = model.run(dur, xFF, dt=dt, calc_bg_input=True, noise=noise, monitor_dend_inh=True, cache=cache)
 
         # simulate with input to NDNF
-        xFF = get_null_ff_input_arrays(nt, N_cells)
-        xFF['S'] = np.tile(xff_null, [N_cells['S'], 1]).T
-        xFF['N'] = np.tile(xff_stim, [N_cells['N'], 1]).T
-        t, rE2, rD2, rS2, rN2, rP2, rV2, p2, cGABA2, other2 = model.run(dur, xFF, dt=dt, calc_bg_input=True, noise=noise, monitor_dend_inh=True)
+        xFF = dict(S=xff_null, N=xff_stim)
+        res2 = model.run(dur, xFF, dt=dt, calc_bg_input=True, noise=noise, monitor_dend_inh=True, cache=cache)
+        n_steps += res1.total_steps + res2.total_steps
 
         # compute change in PC activity
-        # bl2 = np.mean(rE2[500:ts])
-        # amplitude = (np.mean(rE2[ts:ts+sdur]-bl2))
+        # bl2 = np.mean(res2.rE[500:ts])
+        # amplitude = (np.mean(res2.rE[ts:ts+sdur]-bl2))
         # print(f"stim dur = {sdur}, amplitude = {amplitude:1.3f}")
 
-        # plot change in dendritic and somatic inhibition
-        dend_inh_SOM = np.array(other2['dend_inh_SOM']).mean(axis=1)
-        dend_inh_NDNF = np.array(other2['dend_inh_NDNF']).mean(axis=1)
-        soma_inh_PV = np.array(other2['soma_inh_PV']).mean(axis=1)
-        ddi_SOM = np.mean(dend_inh_SOM[ts:ts+sdur])-np.mean(dend_inh_SOM[:ts])
-        ddi_NDNF = np.mean(dend_inh_NDNF[ts:ts+sdur])-np.mean(dend_inh_NDNF[:ts])
-        dsi_PV = np.mean(soma_inh_PV[ts:ts+sdur])-np.mean(soma_inh_PV[:ts])
-        ax.bar(i*1.3-0.3, ddi_NDNF, facecolor='none', edgecolor=cNDNF, hatch='/////', width=0.2, label='NDNF' if i==0 else None)
-        ax.bar(i*1.3-0.1, ddi_SOM, facecolor='none', edgecolor=cSOM, hatch='/////', width=0.2, label='SOM' if i==0 else None)
-        ax.bar(i*1.3+0.1, dsi_PV, facecolor='none', edgecolor=cPV, hatch='/////', width=0.2, label='PV' if i==0 else None)
-        ax.bar(i*1.3+0.3, ddi_SOM+ddi_NDNF+dsi_PV, facecolor='none', edgecolor='silver', hatch='/////', width=0.2)
-        # labels and formatting
-        ax.hlines(0, -0.5, 1.8, color='k', lw=1)
-        ax.set(ylabel=r'$\Delta$ inh.', xticks=[], ylim=[-0.6, 1.1])
-        ax.spines['bottom'].set_visible(False)
+        # change in dendritic and somatic inhibition
+        dend_inh_SOM = res2.other['dend_inh_SOM'].mean(axis=1)
+        dend_inh_NDNF = res2.other['dend_inh_NDNF'].mean(axis=1)
+        soma_inh_PV = res2.other['soma_inh_PV'].mean(axis=1)
+        ddi_SOM[i] = np.mean(dend_inh_SOM[ts:ts+sdur])-np.mean(dend_inh_SOM[:ts])
+        ddi_NDNF[i] = np.mean(dend_inh_NDNF[ts:ts+sdur])-np.mean(dend_inh_NDNF[:ts])
+        dsi_PV[i] = np.mean(soma_inh_PV[ts:ts+sdur])-np.mean(soma_inh_PV[:ts])
 
-    # save
-    if save:
-        wDN_str = str(wDN).replace('.', 'p')
-        fig.savefig(f"{FIG_PATH}exp_fig5E_inh_change_{wDN_str}.pdf", dpi=300)
-        plt.close(fig)
+    return dict(stim_durs=stim_durs, ddi_NDNF=ddi_NDNF, ddi_SOM=ddi_SOM, dsi_PV=dsi_PV, n_steps=n_steps)
 
 
 if __name__ in "__main__":
 
     SAVE = False
+    CACHE = True  # reuse the simulations of earlier runs
     plot_supps = False
+    cache = CACHE_PATH if CACHE else None
 
     # Figure 5: redistribution of inhibition in time
     # ----------------------------------------------
 
     # # Fig 5 B: timescale of inhibition (SOM vs NDNF) 
-    exp_fig5B_IPSC_timescale(save=SAVE)
+    exp_fig5B_IPSC_timescale(save=SAVE, cache=cache)
 
     # # Fig 5 C, D, E: responses of PC to SOM/NDNF stimulation depend on parameters and stimulus duration
-    exp_fig5CD_transient_signals(save=SAVE, plot_supp=plot_supps)
-    exp_fig5E_inh_change(save=SAVE, wDN=0.4)
-    exp_fig5E_inh_change(save=SAVE, wDN=0.8)
+    exp_fig5CD_transient_signals(save=SAVE, plot_supp=plot_supps, cache=cache)
+    exp_fig5E_inh_change(save=SAVE, wDN=0.4, cache=cache)
+    exp_fig5E_inh_change(save=SAVE, wDN=0.8, cache=cache)
 
     plt.show()
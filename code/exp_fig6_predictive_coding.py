@@ -6,7 +6,7 @@ if 'pretty' in plt.style.available:
     plt.style.use('pretty')
 
 import model_base as mb
-from helpers import get_model_colours, get_null_ff_input_arrays, slice_dict
+from helpers import get_model_colours, slice_dict, model_seed
 
 # colours
 cPC, cPV, cSOM, cNDNF, cVIP, cpi = get_model_colours()
@@ -16,12 +16,13 @@ csens = '#F5B656'
 # figure path and settings
 FIG_PATH = '../results/figs/Naumann23_draft1/'
 SUPP_PATH = '../results/figs/Naumann23_draft1/supps/'
+CACHE_PATH = '../results/cache/'
 DPI = 300
 
 
 def fig6_predictive_coding(mean_pop=False, w_hetero=True, pre_inh=True, with_NDNF=True, with_wPN=False, NDNF_get_P=False,
                            noise=0.1, NDNF_act_strength=1, rN0=4, b=0.15, plot_all_variables=False, save=False,
-                           is_supp=False, plot_vary_NDNF_input=False):
+                           is_supp=False, plot_vary_NDNF_input=False, seed=0, cache=None):
     """
     Experiments to explore predictive coding microcircuit. Plots all panels for the paper (Fig. 6).
 
@@ -41,8 +42,109 @@ def fig6_predictive_coding(mean_pop=False, w_hetero=True, pre_inh=True, with_NDN
     - save:       bool, whether to save figures
     - is_supp:    bool, if True, save figures in supplementary folder
     - plot_vary_NDNF_input: bool, if True, plot effect of varying NDNF input on mismatch responses
+    - seed:       int, seed of the model (see helpers.model_seed), None to draw it from the global random state
+    - cache:      cache of simulation results (see caching.ResultCache) or path of its directory, None for no caching
+    """
+
+    # Simulate
+    # --------
+    sim = run_fig6_predictive_coding(mean_pop=mean_pop, w_hetero=w_hetero, pre_inh=pre_inh, with_NDNF=with_NDNF,
+                                     with_wPN=with_wPN, NDNF_get_P=NDNF_get_P, noise=noise,
+                                     NDNF_act_strength=NDNF_act_strength, rN0=rN0, b=b,
+                                     vary_NDNF_input=plot_vary_NDNF_input, seed=seed, cache=cache)
+    t, sensory, prediction = sim['t'], sim['sensory'], sim['prediction']
+    buffer, dur_stim, save_name_add = sim['buffer'], sim['dur_stim'], sim['save_name_add']
+    res_fp, res_op, res_up = sim['default']
+    res_fp_act, res_op_act, res_up_act = sim['act']
+
+    # plot mismatch responses without manipulations
+    plot_mismatch_responses(t, res_fp, res_op, res_up, prediction, sensory,
+                            save=save, save_name='default'+save_name_add, is_supp=is_supp)
+    # plot_changes_bars(t, res_fp, res_op, res_up, prediction, sensory, buffer, dur_stim)  # old
+    if plot_all_variables:
+        plot_all_variables_all_phases(t, res_fp, res_op, res_up, prediction, sensory)
+
+    # plot mismatch responses with additional NDNF activation
+    plot_mismatch_responses(t, res_fp_act, res_op_act, res_up_act, prediction, sensory,
+                            save_name='actNDNF'+save_name_add, save=save, is_supp=is_supp)
+    if plot_all_variables:
+        plot_all_variables_all_phases(t, res_fp_act, res_op_act, res_up_act, prediction, sensory)
+
+
+    # Change in inh and exc inputs to PCs
+    # -----------------------------------
+    fig, ax = plt.subplots(1, 2, dpi=DPI, figsize=(2.8, 1.), sharey=True,
+                            gridspec_kw={'wspace': 0.1, 'right': 0.98, 'left': 0.15, 'bottom': 0.1, 'top': 0.95})
+    for i, res in enumerate([res_fp, res_fp_act]):
+
+        dend_inh_SOM = res['other']['dend_inh_SOM'].mean(axis=1)
+        dend_inh_NDNF = res['other']['dend_inh_NDNF'].mean(axis=1)
+        soma_inh_PV = res['other']['soma_inh_PV'].mean(axis=1)
+
+        ddi_SOM = np.mean(dend_inh_SOM[buffer:buffer+dur_stim])-np.mean(dend_inh_SOM[:buffer])
+        ddi_NDNF = np.mean(dend_inh_NDNF[buffer:buffer+dur_stim])-np.mean(dend_inh_NDNF[:buffer])
+        dsi_PV = np.mean(soma_inh_PV[buffer:buffer+dur_stim])-np.mean(soma_inh_PV[:buffer])
+        ax[i].bar(0-0.3, ddi_NDNF, facecolor='none', edgecolor=cNDNF, hatch='/////', width=0.2)
+        ax[i].bar(-0.1, ddi_SOM, facecolor='none', edgecolor=cSOM, hatch='/////', width=0.2)
+        ax[i].bar(0+0.1, ddi_SOM+ddi_NDNF, facecolor='none', edgecolor='silver', hatch='/////', width=0.2)
+        ax[i].bar(0+0.3, prediction[buffer:buffer+dur_stim].mean(), facecolor='none', edgecolor=cpred, hatch='/////', width=0.2)
+
+        ax[i].bar(0+0.7, dsi_PV, facecolor='none', edgecolor=cPV, hatch='/////', width=0.2)
+        ax[i].bar(0+0.9, sensory[buffer:buffer+dur_stim].mean(), facecolor='none', edgecolor=csens, hatch='/////', width=0.2)
+
+        ax[i].set(ylim=[-1.5, 2.5], xticks=[])
+        ax[i].spines['bottom'].set_visible(False)
+        ax[i].axhline(0, c='k', lw=1)
+    ax[0].set(ylabel=r'$\Delta$ exc./inh.')
+
+    # saving
+    if save:
+        file_path = SUPP_PATH if is_supp else FIG_PATH
+        fig.savefig(file_path+'exp_fig6_mismatch_inh_exc'+save_name_add+'.pdf', dpi=300)
+        plt.close(fig)
+
+
+    # Fedback, mismatch and playback response for different levels of NDNF activation
+    # (optional plotting)
+    # -------------------------------------------------------------------------------
+    if plot_vary_NDNF_input:
+
+        ndnf_act_levels = sim['vary']['ndnf_act']
+        fb_response, mm_response, pb_response = sim['vary']['feedback'], sim['vary']['mismatch'], sim['vary']['playback']
+
+        # plotting
+        fig2, ax2 = plt.subplots(1, 1, dpi=DPI, figsize=(2.5, 1.), gridspec_kw={'right': 0.95, 'left': 0.2, 'bottom': 0.35, 'top': 0.94})
+        ax2.plot(ndnf_act_levels, mm_response, c=cpred, lw=1, ls='-', marker='.', label='mismatch')
+        ax2.plot(ndnf_act_levels, pb_response, c=csens, lw=1, ls='-', marker='.', label='playback')
+        ax2.plot(ndnf_act_levels, fb_response, c='k', ls='-', marker='.', lw=1, label='feedback')
+        ax2.set(xlabel='NDNF activation', ylabel=r'$\Delta$ PC act.', ylim=[-0.05, 0.7], yticks=[0, 0.5], xticks=[0, 1])
+
+        # saving
+        if save:
+            file_path = SUPP_PATH if is_supp else FIG_PATH
+            fig2.savefig(f"{file_path}exp_fig6_vary_NDNF_input{save_name_add}.pdf", dpi=300)
+            plt.close(fig2)
+
+
+def run_fig6_predictive_coding(mean_pop=False, w_hetero=True, pre_inh=True, with_NDNF=True, with_wPN=False,
+                               NDNF_get_P=False, noise=0.1, NDNF_act_strength=1, rN0=4, b=0.15, vary_NDNF_input=False,
+                               seed=0, cache=None):
+    """
+    Simulations of fig6_predictive_coding (see there for the parameters), without plotting.
+
+    Parameters:
+    ----------
+    - vary_NDNF_input: bool, if True, also simulate different levels of NDNF activation
+
+    Returns:
+    -------
+    - dict with the time vector of one phase ('t', in s), the sensory and prediction input ('sensory', 'prediction'),
+      the buffer and stimulus duration ('buffer', 'dur_stim'), the suffix of the saved files of the model variant
+      ('save_name_add'), the results of the three phases (see run_pc_phases) without manipulations ('default') and
+      with additional NDNF activation ('act'), the feedback, mismatch and playback responses for each level of NDNF
+      activation ('vary', with keys 'ndnf_act', 'feedback', 'mismatch', 'playback', None if not simulated) and the
+      number of integration steps of all simulations ('n_steps')
     """
-    
 
     # define deafault parameter dictionaries
     N_cells, w_mean, conn_prob, bg_inputs, taus = mb.get_default_params(flag_mean_pop=mean_pop)
@@ -100,14 +202,10 @@ def fig6_predictive_coding(mean_pop=False, w_hetero=True, pre_inh=True, with_NDN
     sensory, prediction = get_s_and_p_inputs(amp_s, amp_p, dur_stim, buffer, nt)
 
     # set input of cells
-    xFF = get_null_ff_input_arrays(nt, N_cells)
-    xFF['E'] = np.tile(sensory, [N_cells['E'], 1]).T
-    xFF['D'] = np.tile(prediction, [N_cells['D'], 1]).T
-    xFF['P'] = np.tile(sensory, [N_cells['P'], 1]).T
-    xFF['S'] = np.tile(sensory, [N_cells['S'], 1]).T
-    xFF['V'] = np.tile(prediction, [N_cells['V'], 1]).T
+    # note: inputs are shared by all neurons of a cell type, so arrays of shape (nt,) suffice
+    xFF = dict(E=sensory, D=prediction, P=sensory, S=sensory, V=prediction, N=np.zeros(nt))
     if NDNF_get_P:
-        xFF['N'] = np.tile(prediction, [N_cells['N'], 1]).T
+        xFF['N'] = prediction
 
     # store baseline ff input to NDNFs (to be manipulated later)
     xFF_NDNF_bl = xFF['N']
@@ -116,20 +214,16 @@ def fig6_predictive_coding(mean_pop=False, w_hetero=True, pre_inh=True, with_NDN
     # Instantiate model
     # -----------------
     model = mb.NetworkModel(N_cells, w_mean.copy(), conn_prob, taus, bg_inputs.copy(), wED=1, flag_w_hetero=w_hetero, flag_pre_inh=pre_inh, flag_with_NDNF=with_NDNF,
-                            w_std_rel=0.01, b=b)
+                            w_std_rel=0.01, b=b, seed=model_seed(seed))
     
 
     # Run simulation without manipulations
     # -------------------------------------
     print(f"Running predictive coding experiment without manipulations...")
-    t, res_fp, res_op, res_up, bg_inputs_df = run_pc_phases(dur, model, xFF, rN0=rN0, p0=model.g_func(rN0), dt=dt, calc_bg_input=True, noise=noise)
+    t, res_fp, res_op, res_up, bg_inputs_df = run_pc_phases(dur, model, xFF, rN0=rN0, p0=model.g_func(rN0), dt=dt, calc_bg_input=True, noise=noise,
+                                                            cache=cache)
+    p_scale_df = model.g_func(rN0)  # release probability by which the weights were scaled
 
-    # plot mismatch responses
-    plot_mismatch_responses(t, res_fp, res_op, res_up, prediction, sensory,
-                            save=save, save_name='default'+save_name_add, is_supp=is_supp)
-    # plot_changes_bars(t, res_fp, res_op, res_up, prediction, sensory, buffer, dur_stim)  # old
-    if plot_all_variables:
-        plot_all_variables_all_phases(t, res_fp, res_op, res_up, prediction, sensory)
 
 
     # Activate NDNF interneurons and simulate again, use calculated background inputs
@@ -138,58 +232,20 @@ def fig6_predictive_coding(mean_pop=False, w_hetero=True, pre_inh=True, with_NDN
     rN0 = 6 if pre_inh else 4.8                # adapt initial value of NDNF activity
     if NDNF_get_P:
         rN0 = 5.
-    # set background inputs to defaults, they are not recomputed
-    model.Xbg = bg_inputs_df
+    # use the default background inputs and weight scaling, they are not recomputed
 
     # run simulations
     print(f"Running predictive coding experiment with additional NDNF activation...")
     t, res_fp_act, res_op_act, res_up_act, _ = run_pc_phases(dur, model, xFF, rN0=rN0, p0=model.g_func(rN0), dt=dt, noise=noise,
-                                                             calc_bg_input=False, scale_w_by_p=False)
-
-    # plotting
-    plot_mismatch_responses(t, res_fp_act, res_op_act, res_up_act, prediction, sensory,
-                            save_name='actNDNF'+save_name_add, save=save, is_supp=is_supp)
-    if plot_all_variables:
-        plot_all_variables_all_phases(t, res_fp_act, res_op_act, res_up_act, prediction, sensory)
-
-
-    # Change in inh and exc inputs to PCs
-    # -----------------------------------
-    fig, ax = plt.subplots(1, 2, dpi=DPI, figsize=(2.8, 1.), sharey=True,
-                            gridspec_kw={'wspace': 0.1, 'right': 0.98, 'left': 0.15, 'bottom': 0.1, 'top': 0.95})
-    for i, res in enumerate([res_fp, res_fp_act]):
-
-        dend_inh_SOM = np.array(res['other']['dend_inh_SOM']).mean(axis=1)
-        dend_inh_NDNF = np.array(res['other']['dend_inh_NDNF']).mean(axis=1)
-        soma_inh_PV = np.array(res['other']['soma_inh_PV']).mean(axis=1)
-
-        ddi_SOM = np.mean(dend_inh_SOM[buffer:buffer+dur_stim])-np.mean(dend_inh_SOM[:buffer])
-        ddi_NDNF = np.mean(dend_inh_NDNF[buffer:buffer+dur_stim])-np.mean(dend_inh_NDNF[:buffer])
-        dsi_PV = np.mean(soma_inh_PV[buffer:buffer+dur_stim])-np.mean(soma_inh_PV[:buffer])
-        ax[i].bar(0-0.3, ddi_NDNF, facecolor='none', edgecolor=cNDNF, hatch='/////', width=0.2)
-        ax[i].bar(-0.1, ddi_SOM, facecolor='none', edgecolor=cSOM, hatch='/////', width=0.2)
-        ax[i].bar(0+0.1, ddi_SOM+ddi_NDNF, facecolor='none', edgecolor='silver', hatch='/////', width=0.2)
-        ax[i].bar(0+0.3, prediction[buffer:buffer+dur_stim].mean(), facecolor='none', edgecolor=cpred, hatch='/////', width=0.2)
-
-        ax[i].bar(0+0.7, dsi_PV, facecolor='none', edgecolor=cPV, hatch='/////', width=0.2)
-        ax[i].bar(0+0.9, sensory[buffer:buffer+dur_stim].mean(), facecolor='none', edgecolor=csens, hatch='/////', width=0.2)
-
-        ax[i].set(ylim=[-1.5, 2.5], xticks=[])
-        ax[i].spines['bottom'].set_visible(False)
-        ax[i].axhline(0, c='k', lw=1)
-    ax[0].set(ylabel=r'$\Delta$ exc./inh.')
-
-    # saving
-    if save:
-        file_path = SUPP_PATH if is_supp else FIG_PATH
-        fig.savefig(file_path+'exp_fig6_mismatch_inh_exc'+save_name_add+'.pdf', dpi=300)
-        plt.close(fig)
+                                                             calc_bg_input=False, Xbg=bg_inputs_df, p_scale=p_scale_df,
+                                                             cache=cache)
+    n_steps = sum(res['n_steps'] for res in [res_fp, res_op, res_up, res_fp_act, res_op_act, res_up_act])
 
 
     # Fedback, mismatch and playback response for different levels of NDNF activation
-    # (optional plotting)
     # -------------------------------------------------------------------------------
-    if plot_vary_NDNF_input:
+    vary = None
+    if vary_NDNF_input:
 
         # levels of NDNF activation
         ndnf_act_levels = np.arange(0, 1.6, 0.2)
@@ -204,27 +260,22 @@ def fig6_predictive_coding(mean_pop=False, w_hetero=True, pre_inh=True, with_NDN
         for j, ndnf_act in enumerate(ndnf_act_levels):
             print(f"\t - NDNF activation: {ndnf_act:1.1f}")
             xFF['N'] = xFF_NDNF_bl + ndnf_act
-            t, res_fp, res_op, res_up, _ = run_pc_phases(dur, model, xFF, rN0=rN0, p0=model.g_func(rN0) , dt=dt, calc_bg_input=False, scale_w_by_p=False)
-            fb_response[j] = np.mean(res_fp['rE'][buffer:buffer+dur_stim])-np.mean(res_fp['rE'][:buffer])
-            mm_response[j] = np.mean(res_op['rE'][buffer:buffer+dur_stim])-np.mean(res_op['rE'][:buffer])
-            pb_response[j]  = np.mean(res_up['rE'][buffer:buffer+dur_stim])-np.mean(res_up['rE'][:buffer])
+            t, res_fp_j, res_op_j, res_up_j, _ = run_pc_phases(dur, model, xFF, rN0=rN0, p0=model.g_func(rN0) , dt=dt, calc_bg_input=False,
+                                                               Xbg=bg_inputs_df, p_scale=p_scale_df, cache=cache)
+            fb_response[j] = np.mean(res_fp_j['rE'][buffer:buffer+dur_stim])-np.mean(res_fp_j['rE'][:buffer])
+            mm_response[j] = np.mean(res_op_j['rE'][buffer:buffer+dur_stim])-np.mean(res_op_j['rE'][:buffer])
+            pb_response[j]  = np.mean(res_up_j['rE'][buffer:buffer+dur_stim])-np.mean(res_up_j['rE'][:buffer])
+            n_steps += sum(res['n_steps'] for res in [res_fp_j, res_op_j, res_up_j])
 
-        # plotting
-        fig2, ax2 = plt.subplots(1, 1, dpi=DPI, figsize=(2.5, 1.), gridspec_kw={'right': 0.95, 'left': 0.2, 'bottom': 0.35, 'top': 0.94})
-        ax2.plot(ndnf_act_levels, mm_response, c=cpred, lw=1, ls='-', marker='.', label='mismatch')
-        ax2.plot(ndnf_act_levels, pb_response, c=csens, lw=1, ls='-', marker='.', label='playback')
-        ax2.plot(ndnf_act_levels, fb_response, c='k', ls='-', marker='.', lw=1, label='feedback')
-        ax2.set(xlabel='NDNF activation', ylabel=r'$\Delta$ PC act.', ylim=[-0.05, 0.7], yticks=[0, 0.5], xticks=[0, 1])
+        vary = dict(ndnf_act=ndnf_act_levels, feedback=fb_response, mismatch=mm_response, playback=pb_response)
 
-        # saving
-        if save:
-            file_path = SUPP_PATH if is_supp else FIG_PATH
-            fig2.savefig(f"{file_path}exp_fig6_vary_NDNF_input{save_name_add}.pdf", dpi=300)
-            plt.close(fig2)
+    return dict(t=t, sensory=sensory, prediction=prediction, buffer=buffer, dur_stim=dur_stim,
+                save_name_add=save_name_add, default=(res_fp, res_op, res_up), act=(res_fp_act, res_op_act, res_up_act),
+                vary=vary, n_steps=n_steps)
 
 
 def run_pc_phases(dur, model, xFF, rE0=1, rD0=0, rS0=4, rP0=4, rV0=4, rN0=4, p0=0.5, dt=1, calc_bg_input=True,
-                  scale_w_by_p=True, p_scale=None, noise=0.1):
+                  Xbg=None, scale_w_by_p=True, p_scale=None, noise=0.1, continuous=False, cache=None):
     """
     Run predictive coding experiment for a given circuit model and input. The input is split into three phases:
     - fp (fully predicted = feedback): prediction and sensory input
@@ -245,9 +296,13 @@ def run_pc_phases(dur, model, xFF, rE0=1, rD0=0, rS0=4, rP0=4, rV0=4, rN0=4, p0=
     - p0:           float, initial value of release factor
     - dt:           int, integration time step (ms)
     - calc_bg_input: bool, if True, calculate background input to the model
+    - Xbg:          dict, background inputs used if calc_bg_input is False (default: background inputs of the model)
     - scale_w_by_p: bool, if True, scale weights affected by pre. inh.
     - p_scale:      float, if not None, use this value to scale weights affected by pre. inh. (p_scale)
     - noise:        float, noise level in the model (std of added Gaussian white noise)
+    - continuous:   bool, if True, each phase continues from the final state of the previous one instead of starting
+                    from the initial values
+    - cache:        cache of simulation results (see caching.ResultCache) or path of its directory, None for no caching
 
     Returns:
     -------
@@ -255,7 +310,8 @@ def run_pc_phases(dur, model, xFF, rE0=1, rD0=0, rS0=4, rP0=4, rV0=4, rN0=4, p0=
     - res_fp:        dict, results of the simulation for the fully predicted phase
     - res_op:        dict, results of the simulation for the overpredicted phase
     - res_up:        dict, results of the simulation for the underpredicted phase
-    - bg_inputs_calc: dict, calculated background inputs to the model
+                     (each with the number of integration steps 'n_steps')
+    - bg_inputs_calc: dict, background inputs of the simulations
     """
 
     # split FF input into three phases
@@ -264,21 +320,29 @@ def run_pc_phases(dur, model, xFF, rE0=1, rD0=0, rS0=4, rP0=4, rV0=4, rN0=4, p0=
     xFFup = slice_dict(xFF, 2*dur, 3*dur)
 
     # run simulation
-    t, rEfp, rDfp, rSfp, rNfp, rPfp, rVfp, pfp, cGABAfp, otherfp = model.run(dur, xFFfp, dt=dt, rE0=rE0, rP0=rP0, rS0=rS0, rV0=rV0, rN0=rN0, rD0=rD0, p0=p0,
-                                                                            calc_bg_input=calc_bg_input, scale_w_by_p=scale_w_by_p, init_noise=0, noise=noise,
-                                                                            monitor_dend_inh=True, p_scale=p_scale)
-    t, rEop, rDop, rSop, rNop, rPop, rVop, pop, cGABAop, otherop = model.run(dur, xFFop, dt=dt, rE0=rE0, rP0=rP0, rS0=rS0, rV0=rV0, rN0=rN0, rD0=rD0, p0=p0,
-                                                                            calc_bg_input=calc_bg_input, scale_w_by_p=scale_w_by_p, init_noise=0, noise=noise,
-                                                                            monitor_dend_inh=True, p_scale=p_scale)
-    t, rEup, rDup, rSup, rNup, rPup, rVup, pup, cGABAup, otherup = model.run(dur, xFFup, dt=dt, rE0=rE0, rP0=rP0, rS0=rS0, rV0=rV0, rN0=rN0, rD0=rD0, p0=p0,
-                                                                            calc_bg_input=calc_bg_input, scale_w_by_p=scale_w_by_p, init_noise=0, noise=noise,
-                                                                            monitor_dend_inh=True, p_scale=p_scale)
+    res = model.run(dur, xFFfp, dt=dt, rE0=rE0, rP0=rP0, rS0=rS0, rV0=rV0, rN0=rN0, rD0=rD0, p0=p0,
+                    calc_bg_input=calc_bg_input, Xbg=Xbg, scale_w_by_p=scale_w_by_p, init_noise=0, noise=noise,
+                    monitor_dend_inh=True, p_scale=p_scale, cache=cache)
+    t, rEfp, rDfp, rSfp, rNfp, rPfp, rVfp, pfp, cGABAfp, otherfp = res
+    n_steps_fp = res.total_steps
+    res = model.run(dur, xFFop, dt=dt, rE0=rE0, rP0=rP0, rS0=rS0, rV0=rV0, rN0=rN0, rD0=rD0, p0=p0,
+                    calc_bg_input=calc_bg_input, Xbg=Xbg, scale_w_by_p=scale_w_by_p, init_noise=0, noise=noise,
+                    monitor_dend_inh=True, p_scale=p_scale, state=res.state if continuous else None, cache=cache)
+    t, rEop, rDop, rSop, rNop, rPop, rVop, pop, cGABAop, otherop = res
+    n_steps_op = res.total_steps
+    res = model.run(dur, xFFup, dt=dt, rE0=rE0, rP0=rP0, rS0=rS0, rV0=rV0, rN0=rN0, rD0=rD0, p0=p0,
+                    calc_bg_input=calc_bg_input, Xbg=Xbg, scale_w_by_p=scale_w_by_p, init_noise=0, noise=noise,
+                    monitor_dend_inh=True, p_scale=p_scale, state=res.state if continuous else None, cache=cache)
+    t, rEup, rDup, rSup, rNup, rPup, rVup, pup, cGABAup, otherup = res
     
-    res_fp = dict(rE=rEfp, rD=rDfp, rS=rSfp, rN=rNfp, rP=rPfp, rV=rVfp, p=pfp, cGABA=cGABAfp, other=otherfp)
-    res_op = dict(rE=rEop, rD=rDop, rS=rSop, rN=rNop, rP=rPop, rV=rVop, p=pop, cGABA=cGABAop, other=otherop)
-    res_up = dict(rE=rEup, rD=rDup, rS=rSup, rN=rNup, rP=rPup, rV=rVup, p=pup, cGABA=cGABAup, other=otherup)
+    res_fp = dict(rE=rEfp, rD=rDfp, rS=rSfp, rN=rNfp, rP=rPfp, rV=rVfp, p=pfp, cGABA=cGABAfp, other=otherfp,
+                  n_steps=n_steps_fp)
+    res_op = dict(rE=rEop, rD=rDop, rS=rSop, rN=rNop, rP=rPop, rV=rVop, p=pop, cGABA=cGABAop, other=otherop,
+                  n_steps=n_steps_op)
+    res_up = dict(rE=rEup, rD=rDup, rS=rSup, rN=rNup, rP=rPup, rV=rVup, p=pup, cGABA=cGABAup, other=otherup,
+                  n_steps=res.total_steps)
 
-    bg_inputs_calc = model.Xbg
+    bg_inputs_calc = res.Xbg
 
     return t/1000, res_fp, res_op, res_up, bg_inputs_calc
 
@@ -436,11 +500,13 @@ def plot_mismatch_responses(t, res_fp, res_op, res_up, prediction, sensory, save
 if __name__ in "__main__":
 
     SAVE = False
+    CACHE = True  # reuse the simulations of earlier runs
     plot_supps = False
+    cache = CACHE_PATH if CACHE else None
 
     # Figure 6: predictive coding example
     # -----------------------------------
-    fig6_predictive_coding(NDNF_act_strength=1, save=SAVE, plot_vary_NDNF_input=True)
+    fig6_predictive_coding(NDNF_act_strength=1, save=SAVE, plot_vary_NDNF_input=True, cache=cache)
 
 
     if plot_supps:
@@ -449,13 +515,13 @@ if __name__ in "__main__":
         # --------------
 
         # no presynaptic inhibition
-        fig6_predictive_coding(NDNF_act_strength=1, save=SAVE, pre_inh=False, is_supp=True)
+        fig6_predictive_coding(NDNF_act_strength=1, save=SAVE, pre_inh=False, is_supp=True, cache=cache)
 
         # NDNFs get prediction
-        fig6_predictive_coding(NDNF_act_strength=0.5, save=SAVE, NDNF_get_P=True, is_supp=True)
+        fig6_predictive_coding(NDNF_act_strength=0.5, save=SAVE, NDNF_get_P=True, is_supp=True, cache=cache)
 
         # with NDNF-to-PV inhibition
-        fig6_predictive_coding(NDNF_act_strength=1, save=SAVE, with_wPN=True, is_supp=True)
+        fig6_predictive_coding(NDNF_act_strength=1, save=SAVE, with_wPN=True, is_supp=True, cache=cache)
 
     plt.show()
 
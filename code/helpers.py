@@ -1,6 +1,8 @@
 import numpy as np
 import matplotlib.pyplot as plt
 
+from caching import content_seed
+
 
 def get_null_ff_input_arrays(nt, N_cells):
     """
@@ -79,4 +81,48 @@ def slice_dict(dic, ts, te):
     for k in dic.keys():
         dic_new[k] = dic[k][ts:te]
 
-    return dic_new
\ No newline at end of file
+    return dic_new
+
+def spawn_seeds(seed, n):
+    """
+    Create independent seeds for n models, e.g. one per point of a parameter sweep. Each model then draws its
+    connectivity, initial state and noise from its own streams, so sweep points can be simulated in any order or
+    process and give the same results as a serial run.
+
+    Parameters:
+    ----------
+    - seed: int or SeedSequence, root seed of the sweep
+    - n:    int, number of seeds
+
+    Returns:
+    -------
+    - list of n numpy SeedSequences (pass as seed to NetworkModel)
+    """
+
+    root = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+
+    return root.spawn(n)
+
+
+def model_seed(seed, *key):
+    """
+    Seed of one model of an experiment, derived from the root seed of the experiment and a key that identifies the
+    model within it (e.g. the index of a varied parameter). With a fixed root seed, every run of the experiment
+    builds the same models, so that their simulations can be reused from a cache (see caching.ResultCache).
+
+    Parameters:
+    ----------
+    - seed: int or SeedSequence, root seed of the experiment, or None
+    - key:  values that identify the model within the experiment
+
+    Returns:
+    -------
+    - numpy SeedSequence (pass as seed to NetworkModel), or None if seed is None (the model then draws its seed from
+      the global random state)
+    """
+
+    if seed is None:
+        return None
+    root = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+
+    return content_seed(root, key)
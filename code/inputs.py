@@ -0,0 +1,269 @@
+"""
+Compact feedforward input specifications for NetworkModel.run. Instead of dense arrays of shape (nt, N), the inputs
+to a cell type can be given as
+- a scalar (constant input to all neurons),
+- an array that broadcasts across neurons and/or time, e.g. of shape (nt,), (nt, 1), (1, N) or (B, 1, 1),
+- a dense array of shape (nt, N) or (B, nt, N),
+- a declarative protocol (Constant, Pulse, ExpKernel, Sine, Schedule, or sums, multiples and shifts of these).
+Inputs are evaluated one chunk of time steps at a time during the simulation (see evaluate_input).
+"""
+
+import numpy as np
+
+
+def batch_param(value):
+    """Reshape a protocol parameter that varies across a batch to a column vector (leave scalars untouched)."""
+    return np.reshape(value, (-1, 1)) if np.size(value) > 1 else np.ravel(value)[0]
+
+
+class InputProtocol:
+    """
+    Base class for input protocols. A protocol describes a time course that is shared by all neurons of a cell type.
+    Protocol parameters can be arrays of shape (B,) to vary the input across a batch (see NetworkModel.run_batch).
+    Protocols can be added to each other and multiplied by constants.
+    """
+
+    def time_course(self, t):
+        """
+        Evaluate the protocol.
+
+        Parameters:
+        ----------
+        - t: array of time points (in ms)
+
+        Returns:
+        -------
+        - array of inputs of shape (len(t),), or (B, len(t)) if parameters vary across a batch
+        """
+        raise NotImplementedError
+
+    @property
+    def n_batch(self):
+        """Batch size of the protocol (1 if no parameter varies across a batch)."""
+        return np.atleast_2d(self.time_course(np.zeros(1))).shape[0]
+
+    def __add__(self, other):
+        return Sum(self, other)
+
+    def __radd__(self, other):
+        return Sum(other, self)
+
+    def __mul__(self, factor):
+        return Scaled(self, factor)
+
+    def __rmul__(self, factor):
+        return Scaled(self, factor)
+
+
+class Constant(InputProtocol):
+    """Constant input."""
+
+    def __init__(self, value):
+        """
+        Parameters:
+        ----------
+        - value: input strength
+        """
+        self.value = value
+
+    def time_course(self, t):
+        return batch_param(self.value) * np.ones(len(t))
+
+
+class Pulse(InputProtocol):
+    """Rectangular pulse of input, active for t_start <= t < t_end."""
+
+    def __init__(self, amp, t_start, t_end):
+        """
+        Parameters:
+        ----------
+        - amp:     amplitude of the pulse
+        - t_start: onset of the pulse (in ms)
+        - t_end:   offset of the pulse (in ms)
+        """
+        self.amp = amp
+        self.t_start = t_start
+        self.t_end = t_end
+
+    def time_course(self, t):
+        active = (t >= batch_param(self.t_start)) & (t < batch_param(self.t_end))
+        return np.where(active, batch_param(self.amp), 0.)
+
+
+class ExpKernel(InputProtocol):
+    """Instantaneous increase of input at t_start followed by exponential decay."""
+
+    def __init__(self, amp, t_start, tau):
+        """
+        Parameters:
+        ----------
+        - amp:     amplitude at onset
+        - t_start: onset of the input (in ms)
+        - tau:     decay time constant (in ms)
+        """
+        self.amp = amp
+        self.t_start = t_start
+        self.tau = tau
+
+    def time_course(self, t):
+        t_rel = t - batch_param(self.t_start)
+        return np.where(t_rel >= 0, batch_param(self.amp) * np.exp(-np.maximum(t_rel, 0) / batch_param(self.tau)), 0.)
+
+
+class Sine(InputProtocol):
+    """
+    Sinusoidal input offset + amp * sin(2*pi*freq*t + phase). Sine(freq, amp=0.5, offset=0.5) corresponds to
+    helpers.make_sine (for dt=1ms).
+    """
+
+    def __init__(self, freq, amp=1, offset=0, phase=0):
+        """
+        Parameters:
+        ----------
+        - freq:   frequency (in Hz)
+        - amp:    amplitude
+        - offset: mean input
+        - phase:  phase at t=0 (in rad)
+        """
+        self.freq = freq
+        self.amp = amp
+        self.offset = offset
+        self.phase = phase
+
+    def time_course(self, t):
+        phase = 2 * np.pi * batch_param(self.freq) * t / 1000 + batch_param(self.phase)
+        return batch_param(self.offset) + batch_param(self.amp) * np.sin(phase)
+
+
+class Schedule(InputProtocol):
+    """
+    Piecewise constant input: values[k] from times[k] until times[k+1] (the last value holds until the end). The input
+    is zero before times[0].
+    """
+
+    def __init__(self, times, values):
+        """
+        Parameters:
+        ----------
+        - times:  increasing switching times (in ms)
+        - values: input after each switching time, array of shape (K,) or (B, K)
+        """
+        self.times = np.asarray(times)
+        self.values = np.asarray(values, dtype=float)
+
+    def time_course(self, t):
+        k = np.searchsorted(self.times, t, side='right') - 1
+        return np.where(k >= 0, self.values[..., np.maximum(k, 0)], 0.)
+
+
+class Sum(InputProtocol):
+    """Sum of two protocols (or of a protocol and a constant)."""
+
+    def __init__(self, first, second):
+        self.first = first if isinstance(first, InputProtocol) else Constant(first)
+        self.second = second if isinstance(second, InputProtocol) else Constant(second)
+
+    def time_course(self, t):
+        return self.first.time_course(t) + self.second.time_course(t)
+
+
+class Scaled(InputProtocol):
+    """Protocol multiplied by a constant factor."""
+
+    def __init__(self, protocol, factor):
+        self.protocol = protocol
+        self.factor = factor
+
+    def time_course(self, t):
+        return batch_param(self.factor) * self.protocol.time_course(t)
+
+
+class Shifted(InputProtocol):
+    """Protocol that starts later in its time course, e.g. to continue a simulation from a saved state."""
+
+    def __init__(self, protocol, offset):
+        """
+        Parameters:
+        ----------
+        - protocol: input protocol
+        - offset:   time of the protocol at t=0 (in ms)
+        """
+        self.protocol = protocol
+        self.offset = offset
+
+    def time_course(self, t):
+        return self.protocol.time_course(t + self.offset)
+
+
+def input_batch_size(spec):
+    """
+    Batch size of an input specification.
+
+    Parameters:
+    ----------
+    - spec: input specification (scalar, array or InputProtocol)
+
+    Returns:
+    -------
+    - batch size (1 if the input is shared across the batch)
+    """
+    if isinstance(spec, InputProtocol):
+        return spec.n_batch
+    return np.shape(spec)[0] if np.ndim(spec) == 3 else 1
+
+
+def evaluate_input(spec, ts, te, dt):
+    """
+    Evaluate an input specification for the time steps ts to te (excluding te).
+
+    Parameters:
+    ----------
+    - spec: input specification (scalar, array or InputProtocol)
+    - ts:   first time step
+    - te:   last time step (excluded)
+    - dt:   time step (in ms)
+
+    Returns:
+    -------
+    - array of shape (1 or B, 1 or te-ts, 1 or N), broadcastable to the inputs of a batch of cell populations
+    """
+
+    if isinstance(spec, InputProtocol):
+        return np.reshape(spec.time_course(np.arange(ts, te) * dt), (-1, te-ts, 1))
+
+    spec = np.asarray(spec)
+    if spec.ndim > 3:
+        raise ValueError(f"Inputs must have at most 3 dimensions (batch, time, neurons), got shape {spec.shape}.")
+    spec = np.reshape(spec, (1,) * (3 - spec.ndim) + spec.shape) if spec.ndim != 1 else spec[np.newaxis, :, np.newaxis]
+    if spec.shape[1] == 1:  # constant in time
+        return spec
+    if spec.shape[1] < te:
+        raise ValueError(f"Input with {spec.shape[1]} time steps is shorter than the simulation ({te} time steps).")
+
+    return spec[:, ts:te]
+
+
+def shift_input(spec, steps, dt):
+    """
+    Input specification that starts at a later time step of another one, e.g. for a simulation that continues from
+    the state at that time step (see NetworkModel.run).
+
+    Parameters:
+    ----------
+    - spec:  input specification (scalar, array or InputProtocol)
+    - steps: time step of spec at which the shifted input starts
+    - dt:    time step (in ms)
+
+    Returns:
+    -------
+    - input specification
+    """
+
+    if isinstance(spec, InputProtocol):
+        return Shifted(spec, steps * dt)
+    shape = np.shape(spec)
+    if len(shape) in [1, 2] and shape[0] > 1:
+        return np.asarray(spec)[steps:]
+    if len(shape) == 3 and shape[1] > 1:
+        return np.asarray(spec)[:, steps:]
+    return spec  # constant in time
@@ -0,0 +1,188 @@
+"""
+Compiled integration kernel for NetworkModel (optional, requires numba).
+"""
+
+import numpy as np
+from scipy import sparse
+
+try:
+    import numba
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        """Fallback decorator if numba is not installed: leave the function uncompiled."""
+        return lambda func: func
+
+
+# number of synapses from which the input currents of a time step are computed in parallel (below, starting the
+# threads takes longer than the products)
+PARALLEL_MIN_SYNAPSES = 100000
+
+# number of synapses above which the kernel on a single thread is slower than the sparse products of scipy (per time
+# step about 0.22 vs 0.22 ms for 2.9e5 synapses, 0.9 vs 0.8 ms for 1.2e6 and 4.5 vs 2.6 ms for 4.7e6)
+SERIAL_MAX_SYNAPSES = 500000
+
+
+# codes for the modulation of block operators by the release probability
+MODULATION_CODES = {None: 0, 'p': 1, 'pDN': 2, 'pVS': 3}
+
+
+def combine_operators(operators, n_batch):
+    """
+    Combine the block operators of a model into one sparse operator, so that the kernel can compute all input currents
+    in one pass. Entries are sorted by row and, within each row, by the operator (term) they belong to.
+
+    Parameters:
+    ----------
+    - operators: list of tuples (W, modulation, scale) as returned by NetworkModel.get_block_operators
+    - n_batch:   batch size
+
+    Returns:
+    -------
+    - indptr:                pointers to the entries of each row and term, the entries of row i and term k are
+                             indptr[i*n_terms+k]:indptr[i*n_terms+k+1]
+    - indices, data:         column indices (unsigned 32 bit, which halves the memory traffic of the
+                             indices in the products of large networks) and values of the entries
+    - mod:                   modulation code of each term (see MODULATION_CODES)
+    - scale:                 per-batch scaling factor of each term, array of shape (n_terms, n_batch)
+    """
+
+    rows, cols, vals, terms = [], [], [], []
+    mod = np.zeros(len(operators), dtype=np.int64)
+    scale = np.ones((len(operators), n_batch))
+    for k, (W, modulation, w_scale) in enumerate(operators):
+        W = sparse.coo_matrix(W)
+        rows.append(W.row)
+        cols.append(W.col)
+        vals.append(W.data)
+        terms.append(np.full(W.nnz, k))
+        mod[k] = MODULATION_CODES[modulation]
+        if w_scale is not None:
+            scale[k] = np.ravel(w_scale)
+    rows, cols, vals, terms = [np.concatenate(arr) for arr in [rows, cols, vals, terms]]
+
+    # sort entries by row and term
+    n_state, n_terms = operators[0][0].shape[0], len(operators)
+    row_term = rows * n_terms + terms
+    order = np.argsort(row_term, kind='stable')
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(row_term, minlength=n_state*n_terms))]).astype(np.int64)
+
+    return indptr, cols[order].astype(np.uint32), vals[order], mod, scale
+
+
+def select_kernel(Ws):
+    """
+    Choose the kernel for the weight matrices of a model: the parallel kernel for large networks if numba runs
+    several threads, the serial kernel for small networks.
+
+    Parameters:
+    ----------
+    - Ws: dictionary of weight matrices (dense or sparse)
+
+    Returns:
+    -------
+    - euler_steps_parallel or euler_steps, or None if the network is too large for the kernel to be faster than
+      the sparse products of the numpy backend on a single thread (see SERIAL_MAX_SYNAPSES)
+    """
+    n_synapses = sum(W.nnz if sparse.issparse(W) else np.count_nonzero(W) for W in Ws.values())
+    if numba.get_num_threads() > 1 and n_synapses >= PARALLEL_MIN_SYNAPSES:
+        return euler_steps_parallel
+    return euler_steps if n_synapses <= SERIAL_MAX_SYNAPSES else None
+
+
+@njit(cache=True)
+def _row_current(i, indptr, indices, data, fac, r, acc):
+    """Input current of row i of the combined operator for rates r, release factors fac and external input acc."""
+    n_terms = fac.shape[0]
+    for k in range(n_terms):
+        acc_k = 0.
+        for j in range(indptr[i*n_terms+k], indptr[i*n_terms+k+1]):
+            acc_k += data[j] * r[indices[j]]
+        acc += fac[k] * acc_k
+    return acc
+
+
+def _euler_steps(v, R, p, curr_rec, indptr, indices, data, mod, scale, tau, bg, x, xi, dt, flag_pre_inh,
+                 b, r0, p_low, taup, alph_p_on_DN, g_start, g_end, n_rates):
+    """
+    Euler integration of a batch of networks over a block of time steps, in place. Same dynamics as the NumPy loop
+    in NetworkModel._integrate with fused block operators. Compiled as euler_steps and as euler_steps_parallel, in
+    which the rows of the input currents are distributed over the threads of numba (see select_kernel), with the
+    same result.
+
+    Parameters:
+    ----------
+    - v:              activations (pre rectification) of shape (n_batch, N_state), updated in place
+    - R:              state array of shape (n_batch, n_steps+1, N_state), R[:, 0] holds the current state
+    - p:              release probabilities of shape (n_batch, n_steps+1), p[:, 0] holds the current value
+    - curr_rec:       array of shape (n_batch, n_steps, N_state) to record input currents (or with 0 time steps)
+    - indptr, indices, data, mod, scale: combined operator (see combine_operators)
+    - tau:            time constants of the state vector
+    - bg:             background inputs of shape (1 or n_batch, N_state)
+    - x:              feedforward inputs of shape (1 or n_batch, n_steps, N_state)
+    - xi:             white noise of shape (n_steps, n_batch, n_rates) (or with 0 time steps for no noise)
+    - dt:             time step (in ms)
+    - flag_pre_inh:   whether to include presynaptic inhibition
+    - b, r0, p_low:   parameters of the presynaptic inhibition transfer function
+    - taup:           time constant of presynaptic inhibition
+    - alph_p_on_DN:   scaling factor for strength of pre inh on NDNF-dendrite synapses
+    - g_start, g_end: range of the GABA spillover in the state vector
+    - n_rates:        number of rate variables in the state vector
+    """
+
+    n_batch = R.shape[0]
+    n_steps = R.shape[1] - 1
+    n_state = tau.shape[0]
+    n_terms = mod.shape[0]
+    fac = np.empty(n_terms)
+    curr = np.empty(n_state)
+    r = np.empty(n_state)
+
+    for ti in range(n_steps):
+        for bi in range(n_batch):
+
+            # release factor and scaling of each term
+            pt = p[bi, ti]
+            for k in range(n_terms):
+                if mod[k] == 0:
+                    fac[k] = scale[k, bi]
+                elif mod[k] == 2:
+                    fac[k] = (alph_p_on_DN*pt + (1-alph_p_on_DN)) * scale[k, bi]
+                else:
+                    fac[k] = pt * scale[k, bi]
+
+            # input currents
+            i_bg = bi if bg.shape[0] > 1 else 0
+            i_x = bi if x.shape[0] > 1 else 0
+            r[:] = R[bi, ti]
+            for i in prange(n_state):
+                curr[i] = _row_current(i, indptr, indices, data, fac, r, bg[i_bg, i] + x[i_x, ti, i])
+            if xi.shape[0] > 0:
+                curr[:n_rates] += xi[ti, bi]
+            if curr_rec.shape[1] > 0:
+                curr_rec[bi, ti] = curr
+
+            # presynaptic inhibition
+            if flag_pre_inh:
+                mean_gaba = 0.
+                for i in range(g_start, g_end):
+                    mean_gaba += R[bi, ti, i]
+                mean_gaba /= g_end - g_start
+                g = min(max(1 - b * (mean_gaba - r0), p_low), 1.)
+                p[bi, ti+1] = pt + (-pt + g) / taup * dt
+
+            # Euler integration and rectification, GABA spillover is rectified directly
+            for i in range(n_state):
+                v[bi, i] = v[bi, i] + (-v[bi, i] + curr[i]) / tau[i] * dt
+                if g_start <= i < g_end:
+                    v[bi, i] = max(v[bi, i], 0.)
+                R[bi, ti+1, i] = max(v[bi, i], 0.)
+
+
+# the parallel kernel is compiled in each session, the on-disk cache of numba does not tell both variants apart
+euler_steps = njit(cache=True)(_euler_steps)
+euler_steps_parallel = njit(parallel=True)(_euler_steps)
@@ -3,17 +3,71 @@ Model base: contains model class and function for default parameters
 """
 
 # imports
+import time
 import numpy as np
+import warnings
 import matplotlib.pyplot as plt
+from scipy import sparse
+from scipy.sparse import linalg as sparse_linalg
+
+import caching
+import inputs
+import kernels
+import profiling
+import recording
+import stopping
+from results import Monitors, NetworkState, SimulationResult
+
+
+# monitored dendritic/somatic inhibition and input currents (with their cell type)
+DEND_INH_MONITORS = ['dend_inh_SOM', 'dend_inh_NDNF', 'soma_inh_PV']
+CURRENT_MONITORS = dict(curr_rS='S', curr_rN='N', curr_rE='E')
+
+# integration methods (see NetworkModel._integrate)
+METHODS = ['euler', 'euler_maruyama', 'exp_euler', 'adaptive']
+
+# floating point types of weights and simulations (see NetworkModel)
+FLOAT_TYPES = ['float64', 'float32']
+
+
+class RunContext:
+    """
+    Adjustments of a model for one simulation (see NetworkModel.prepare): weight matrices scaled by the release
+    probability, background inputs and initial values. The model itself is not changed, so that one model can be
+    shared by simulations with different adjustments.
+    """
+
+    def __init__(self, Ws, Xbg, r0, p_start):
+        """
+        Parameters:
+        ----------
+        - Ws:       dictionary of the weight matrices of the simulation (unscaled matrices are those of the model)
+        - Xbg:      dictionary of background inputs
+        - r0:       dictionary of initial rates
+        - p_start:  initial release probability
+        """
+        self.Ws = Ws
+        self.Xbg = Xbg
+        self.r0 = r0
+        self.p_start = p_start
+
+    def __repr__(self):
+        return f"RunContext(Xbg={self.Xbg}, p_start={self.p_start})"
 
 
 class NetworkModel:
-    """Class for network model with two-compartment PCs, SOMs, NDNFs and optionally PVs."""
+    """
+    Class for network model with two-compartment PCs, SOMs, NDNFs and optionally PVs. The weight matrices and
+    background inputs of a model are not changed by simulations (see prepare), so a model can be reused for any number
+    of simulations, also from several threads if each passes its own random generator (see run), which then draws the
+    initial values and the noise instead of the random streams of the model.
+    """
 
     def __init__(self, N_cells, w_mean, conn_prob, taus, bg_inputs, wED=1, b=0.5, r0=0, p_low=0, taup=100,
                  tauG=200, gamma=1, w_std_rel=0.1,
                  flag_w_hetero=False, flag_pre_inh=True, flag_with_VIP=True,
-                 flag_with_NDNF=True, flag_with_PV=True, flag_p_on_DN=False, flag_p_on_VS=False):
+                 flag_with_NDNF=True, flag_with_PV=True, flag_p_on_DN=False, flag_p_on_VS=False, flag_sparse=False,
+                 w_sampling='vectorized', seed=None, dtype='float64'):
         """
         Parameters:
         ----------
@@ -37,17 +91,39 @@ class NetworkModel:
         - flag_with_PV:     whether to include PVs
         - flag_p_on_DN:     whether to include presynaptic inhibition on NDNF->dendrite synapses
         - flag_p_on_VS:     whether to include presynaptic inhibition on SOM->VIP synapses
+        - flag_sparse:      whether to store weight matrices in sparse (CSR) format, for large populations
+        - w_sampling:       how to sample connectivity, 'vectorized' (default) or 'per_row' (see make_weight_mat)
+        - seed:             seed for the random number generators (int, SeedSequence or Generator); connectivity,
+                            initial states and noise are drawn from independent substreams. If None, the seed is
+                            drawn from the global numpy random state.
+        - dtype:            floating point type of the weight matrices, the integrated state and the stored
+                            trajectories and monitors, 'float64' (default) or 'float32' (half the memory and faster
+                            matrix products, the deviations from float64 are far below the noise, see precision.py)
         """
 
-        # network parameters
-        self.N_cells = N_cells
-        self.w_mean = w_mean
+        # network parameters (copies, the flags below must not change the dictionaries of the caller)
+        self.N_cells = dict(N_cells)
+        self.w_mean = dict(w_mean)
+        bg_inputs = dict(bg_inputs)
 
         # flags
         self.flag_w_hetero = flag_w_hetero
         self.flag_with_VIP = flag_with_VIP
         self.flag_with_NDNF = flag_with_NDNF
         self.flag_with_PV = flag_with_PV
+        self.flag_sparse = flag_sparse
+
+        # floating point type of weights and simulations
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in FLOAT_TYPES:
+            raise ValueError(f"Unsupported dtype '{dtype}', use one of {FLOAT_TYPES}.")
+
+        # random number generators: independent substreams for connectivity, initial state and noise
+        self.seed_seq = make_seed_sequence(seed)
+        seed_conn, seed_init, seed_noise = self.seed_seq.spawn(3)
+        self.rng_conn = np.random.default_rng(seed_conn)
+        self.rng_init = np.random.default_rng(seed_init)
+        self.rng_noise = np.random.default_rng(seed_noise)
 
         # adapt weights to model variation
         if not flag_w_hetero:
@@ -74,10 +150,13 @@ class NetworkModel:
         for conn in self.w_mean.keys():
             post, pre = conn[0], conn[1]
             self.Ws[conn] = self.make_weight_mat(N_cells[pre], N_cells[post], conn_prob[conn], self.w_mean[conn],
-                                                 w_std_rel=w_std_rel, no_autapse=(pre == post))
+                                                 w_std_rel=w_std_rel, no_autapse=(pre == post), sparse_format=flag_sparse,
+                                                 sampling=w_sampling)
+            # weight matrices are fixed, simulations use scaled copies (see prepare)
+            (self.Ws[conn].data if sparse.issparse(self.Ws[conn]) else self.Ws[conn]).setflags(write=False)
 
         # time constants
-        self.taus = taus
+        self.taus = dict(taus)
 
         # background inputs
         self.Xbg = bg_inputs
@@ -95,45 +174,124 @@ class NetworkModel:
         self.taup = taup
         self.flag_p_on_DN = flag_p_on_DN
         self.flag_p_on_VS = flag_p_on_VS
-        self.weights_scaled_by = 1
+        self.alph_p_on_DN = 0.5  # scaling factor for strength of pre inh on NDNF-dendrite synapses
+
+        # layout of the packed state vector: rates of all cell types followed by GABA spillover at NDNFs ('G')
+        self.cell_types = ['E', 'D', 'S', 'N', 'P', 'V']
+        self.state_slices = dict()
+        i_start = 0
+        for cell in self.cell_types + ['G']:
+            n = N_cells['N'] if cell == 'G' else N_cells[cell]
+            self.state_slices[cell] = slice(i_start, i_start+n)
+            i_start += n
+        self.N_state = i_start
 
 
-    def make_weight_mat(self, Npre, Npost, c_prob, w_mean, w_std_rel=0, no_autapse=False):
+    def make_weight_mat(self, Npre, Npost, c_prob, w_mean, w_std_rel=0, no_autapse=False, sparse_format=False,
+                        sampling='vectorized'):
         """
         Create weight matrix from connection probability and mean weight.
 
         Parameters:
-        - Npre:        number of presynaptic cells
-        - Npost:       number of postsynaptic cells
-        - c_prob:      connection probability
-        - w_mean:      mean weight for connections
-        - w_std_rel:   standard deviation of weights relative to mean
-        - no_autapse:  whether autapses are allowed (i.e. connections from i to i)
+        - Npre:          number of presynaptic cells
+        - Npost:         number of postsynaptic cells
+        - c_prob:        connection probability
+        - w_mean:        mean weight for connections
+        - w_std_rel:     standard deviation of weights relative to mean
+        - no_autapse:    whether autapses are allowed (i.e. connections from i to i)
+        - sparse_format: whether to return the matrix in sparse (CSR) format
+        - sampling:      'vectorized' to draw all rows at once (see sample_presynaptic) or 'per_row' to draw the
+                         presynaptic partners and weights row by row (reference implementation)
 
         Returns:
-        - weight matrix W
+        - weight matrix W (of the floating point type of the model)
         """
 
-        W = np.zeros((Npost, Npre))  # initialise matrix
-
         n_in = np.round(c_prob * Npre).astype(int)  # determine number of presynaptic cells (in-degree)
 
         if Npre == 1 and Npost == 1:  # if pre an post are only one neuron, make suer they're connected
             n_in = 1
             no_autapse = False
 
-        for i_post in range(Npost):  # determine presynaptic cells for each postsynaptic cell
-            if no_autapse:
-                pre_opt = np.delete(np.arange(Npre), i_post)
-            else:
-                pre_opt = np.arange(Npre)
-            js_pre = np.random.choice(pre_opt, n_in, replace=False)  # choose presynaptic partners for neuron i
-            W[i_post, js_pre] = np.maximum(np.random.normal(w_mean, w_mean * w_std_rel, size=n_in) / n_in,
-                                           0)  # set weights
+        # presynaptic partners and weights for each postsynaptic cell (fixed in-degree)
+        if sampling == 'vectorized':
+            js_pre = self.sample_presynaptic(Npre, Npost, n_in, no_autapse=no_autapse)
+            ws = np.maximum(self.rng_conn.normal(w_mean, w_mean * w_std_rel, size=(Npost, n_in)) / n_in, 0)
+        elif sampling == 'per_row':
+            js_pre = np.zeros((Npost, n_in), dtype=int)
+            ws = np.zeros((Npost, n_in))
+            for i_post in range(Npost):  # determine presynaptic cells for each postsynaptic cell
+                if no_autapse:
+                    pre_opt = np.delete(np.arange(Npre), i_post)
+                else:
+                    pre_opt = np.arange(Npre)
+                js_pre[i_post] = self.rng_conn.choice(pre_opt, n_in, replace=False)  # choose presynaptic partners
+                ws[i_post] = np.maximum(self.rng_conn.normal(w_mean, w_mean * w_std_rel, size=n_in) / n_in, 0)
+        else:
+            raise ValueError(f"Unknown sampling method '{sampling}', use 'vectorized' or 'per_row'.")
+        ws = ws.astype(self.dtype, copy=False)  # weights are drawn in double precision, then rounded
+
+        if sparse_format:
+            # every row has n_in entries (possibly none), so the row pointer is a simple range
+            return sparse.csr_matrix((ws.ravel(), js_pre.ravel(), np.arange(Npost+1) * n_in),
+                                     shape=(Npost, Npre))
+
+        W = np.zeros((Npost, Npre), dtype=self.dtype)  # initialise matrix
+        W[np.arange(Npost)[:, np.newaxis], js_pre] = ws
 
         return W
     
 
+    def sample_presynaptic(self, Npre, Npost, n_in, no_autapse=False):
+        """
+        Draw n_in distinct presynaptic partners for every postsynaptic cell, uniformly among all allowed partners
+        (same statistics as np.random.choice without replacement per row). All rows are sampled at once: indices are
+        drawn with replacement and duplicates are redrawn until every row is distinct, which takes O(Npost*n_in) time.
+        If more than half of the partners are chosen, the excluded partners are sampled instead.
+
+        Parameters:
+        ----------
+        - Npre:       number of presynaptic cells
+        - Npost:      number of postsynaptic cells
+        - n_in:       number of presynaptic partners per postsynaptic cell (in-degree)
+        - no_autapse: whether to exclude connections from i to i
+
+        Returns:
+        -------
+        - array of presynaptic indices of shape (Npost, n_in), sorted within each row
+        """
+
+        n_opt = Npre - 1 if no_autapse else Npre  # number of allowed partners
+        if n_in > n_opt:
+            raise ValueError(f"Cannot choose {n_in} distinct presynaptic partners out of {n_opt}.")
+
+        # sample the smaller of the set of chosen and excluded partners
+        complement = n_in > n_opt // 2
+        k = n_opt - n_in if complement else n_in
+
+        # draw with replacement and redraw duplicates until all rows are distinct
+        js = np.sort(self.rng_conn.integers(0, n_opt, size=(Npost, k)), axis=1)
+        dupl = js[:, 1:] == js[:, :-1]
+        while np.any(dupl):
+            rows = np.flatnonzero(np.any(dupl, axis=1))
+            js_rows = js[rows]
+            js_rows[:, 1:][dupl[rows]] = self.rng_conn.integers(0, n_opt, size=np.count_nonzero(dupl))
+            js[rows] = np.sort(js_rows, axis=1)
+            dupl = js[:, 1:] == js[:, :-1]
+
+        # chosen partners are the complement of the excluded ones
+        if complement:
+            chosen = np.ones((Npost, n_opt), dtype=bool)
+            chosen[np.arange(Npost)[:, np.newaxis], js] = False
+            js = np.nonzero(chosen)[1].reshape(Npost, n_in)
+
+        # skip the postsynaptic cell itself
+        if no_autapse:
+            js = js + (js >= np.arange(Npost)[:, np.newaxis])
+
+        return js
+
+
     def g_func(self, r):
         """Presynaptic inhibition transfer function.
 
@@ -145,20 +303,26 @@ class NetworkModel:
         -------
         - release probability p
         """
-        return np.clip(1 - self.b * (r - self.r0), self.p_low, 1)
+        return np.minimum(np.maximum(1 - self.b * (r - self.r0), self.p_low), 1)
 
 
     def run(self, dur, xFF, rE0=1, rS0=1, rN0=1, rP0=1, rD0=1, rV0=1, p0=0.5, init_noise=0.1, noise=0.1, dt=1,
-            monitor_boutons=False, monitor_dend_inh=False, monitor_currents=False, calc_bg_input=True, scale_w_by_p=True, p_scale=None):
+            monitor_boutons=False, monitor_dend_inh=False, monitor_currents=False, calc_bg_input=True, scale_w_by_p=True, p_scale=None,
+            fused=False, rng=None, noise_chunk=1000, backend='numpy', record=None, early_stop=None, method='euler',
+            step_tol=1e-4, cache=None, state=None, Xbg=None, profile=None):
         """
         Function to run the dynamics of the network.
         
-        Returns arrays for time and neuron firing rates and a dictionary of 'other' things, such as currents.
+        Returns a SimulationResult with arrays for time and neuron firing rates and a dictionary of 'other' things, such
+        as currents. The weights are scaled by the release probability and the background inputs are calculated for
+        this simulation only (see prepare), the model is not changed.
 
         Parameters:
         ----------
         - dur:              duration of stimulation (in ms)
-        - xFF:              dictionary of inputs (FF or FB) to the cells ('E', 'D', 'P', 'S', 'N', 'V')
+        - xFF:              dictionary of inputs (FF or FB) to the cells ('E', 'D', 'P', 'S', 'N', 'V'): scalars,
+                            arrays of shape (nt, N) or broadcastable to it (e.g. (nt,)), or input protocols (see
+                            inputs.py); cell types missing in the dictionary receive no input
         - rE0:              initial rate for somatic compartment of PCs, also baseline rate if bg input calculated
         - rS0:              initial rate/ baseline of SOMs
         - rN0:              initial rate/ baseline of NDNFs
@@ -175,9 +339,40 @@ class NetworkModel:
         - calc_bg_input:    whether to calculcate the background inputs to achieve target rates
         - scale_w_by_p:     whether to scale weights by release probability
         - p_scale:          if not None, scale weights by this value
+        - fused:            whether to compute all input currents with one block operator per release factor instead
+                            of one matrix product per connection (see get_block_operators), about 2x faster per time
+                            step at the default network size
+        - rng:              numpy random Generator for the initial values and the white noise (default: streams of the
+                            model), pass one per thread to simulate the same model from several threads
+        - noise_chunk:      number of time steps for which white noise is drawn and inputs are evaluated at once
+        - backend:          'numpy' or 'numba' (compiled integration kernel, falls back to numpy if numba is missing
+                            or if the kernel would be slower, see kernels.select_kernel)
+        - record:           what to store (see recording.Recorder), e.g. Recorder(['N'], stride=10, mean=True) or a
+                            dictionary of its arguments (default: all variables of every neuron and time step), use
+                            recording.DiskRecorder to stream long simulations into memory-mapped files
+        - early_stop:       criterion to end the simulation once the network has settled or diverges (see
+                            stopping.EarlyStop), e.g. EarlyStop('mean', window=500, tol=1e-3, min_dur=3000) or a
+                            dictionary of its arguments (default: simulate the full duration)
+        - method:           integration method: 'euler', 'euler_maruyama' (noise scaled with dt), 'exp_euler' or
+                            'adaptive' (see _integrate), use integration_error to check the error for a given dt
+        - step_tol:         tolerance of the local error per substep for the adaptive method
+        - cache:            cache of simulation results (see caching.ResultCache) or path of its directory, the
+                            simulation is only run if no result is stored for the same model, arguments, states of
+                            the random streams and code version (default: no caching)
+        - state:            NetworkState to continue from (e.g. the state of a previous result), instead of the initial
+                            rates, p0 and init_noise (the baselines still determine the background inputs and weight
+                            scaling); the random streams are restored to the states stored with it, so that the
+                            continuation is the same as an uninterrupted simulation
+        - Xbg:              dictionary of background inputs, used if calc_bg_input is False (default: background
+                            inputs of the model)
+        - profile:          whether to time the sections of the integration loop and measure the memory of the
+                            recorded arrays, True, a dictionary of arguments of profiling.Profile (e.g. a callback
+                            that receives the report) or a Profile (default: no instrumentation); profiled
+                            simulations are not cached
 
         Returns:
         -------
+        SimulationResult with the following fields, which unpacks like a tuple in this order:
         - t:                time array
         - rE:               array of rates of somatic compartments of PCs
         - rD:               array of activities of dendrites
@@ -187,155 +382,1453 @@ class NetworkModel:
         - rV:               array of rates of VIPs
         - p:                array of release probabilities
         - cGABA:            array of GABA spillover
-        - other:            dictionary of other stuff (boutons_SOM, dend_inh_SOM, dend_inh_NDNF, soma_inh_PV)
+        - other:            dictionary of other stuff (boutons_SOM, dend_inh_SOM, dend_inh_NDNF, soma_inh_PV, curr_rS,
+                            curr_rN, curr_rE) as arrays over time, bouton signals and inhibition are computed from the
+                            trajectories on first access
+        (variables that are not stored by the recorder are None, with a stride all arrays are downsampled in time and
+        population means have no neuron axis)
+        The result also holds the reason for an early stop (stop_reason, None if the full duration was simulated) and
+        the time of the stop (stop_time), after which the final state is held (or the trajectories end, see
+        stopping.EarlyStop), information on the integration (integration, see _integrate) and the NetworkState at the
+        last time point (state), from which the simulation can be continued, the background inputs of the
+        simulation (Xbg) and the report of the profile (profile, see profiling.Profile.finish, None without profiling).
         """
 
         # time arrays
         t = np.arange(0, dur, dt)
         nt = len(t)
 
-        # presynaptic inhibition adjustments to the model
+        # weights and background inputs of this simulation
+        context = self.prepare(rE0, rS0, rN0, rP0, rD0, rV0, p0, calc_bg_input, Xbg, scale_w_by_p, p_scale)
+
+        # integrate the network as a batch of size one
+        self._restore_streams(state, rng)
+        recorder = recording.as_recorder(record)
+        profile = profiling.as_profile(profile)
+        args = (nt, dt, xFF, context.Xbg, context.r0, context.p_start, init_noise, noise, 1, dict(), monitor_boutons,
+                monitor_dend_inh, monitor_currents, fused, rng, noise_chunk, backend, recorder, early_stop, method,
+                step_tol, state, context.Ws, profile)
+        data, derived, stop, integration, final = self._integrate_cached(cache, args, rng)
+
+        return self._make_result(t, data, derived, dict(), stop, recorder.stride, integration, final, context.Ws,
+                                 context.Xbg, squeeze=True, profile=profile)
+
+
+    def _restore_streams(self, state, rng=None):
+        """
+        Set the random streams of a simulation to the states stored in a snapshot (see NetworkState), if it holds
+        them.
+
+        Parameters:
+        ----------
+        - state:    NetworkState or None
+        - rng:      random Generator of the simulation, which is set to the state of the noise stream (None: set the
+                    streams of the model)
+        """
+        if state is not None and state.rng is not None:
+            if rng is None:
+                self.rng_init.bit_generator.state = state.rng['init']
+                self.rng_noise.bit_generator.state = state.rng['noise']
+            else:
+                rng.bit_generator.state = state.rng['noise']
+
+
+    def prepare(self, rE0=1, rS0=1, rN0=1, rP0=1, rD0=1, rV0=1, p0=0.5, calc_bg_input=True, Xbg=None,
+                scale_w_by_p=True, p_scale=None):
+        """
+        Compute the adjustments of the model for a simulation with run, without changing the model: the weight
+        matrices scaled by the release probability and the background inputs that establish the baseline rates.
+
+        Parameters:
+        ----------
+        - rE0, ..., rV0:    initial rates/ baselines (see run)
+        - p0:               initial release probability
+        - calc_bg_input:    whether to calculcate the background inputs to achieve target rates
+        - Xbg:              dictionary of background inputs, used if calc_bg_input is False (default: background
+                            inputs of the model)
+        - scale_w_by_p:     whether to scale weights by release probability
+        - p_scale:          if not None, scale weights by this value
+
+        Returns:
+        -------
+        - RunContext
+        """
+
+        r0 = dict(E=rE0, D=rD0, S=rS0, N=rN0, P=rP0, V=rV0)
+        Ws = dict(self.Ws)
+        scaled = lambda conn, factor: (self.Ws[conn]/factor).astype(self.dtype, copy=False)
+
+        # presynaptic inhibition adjustments: copies of the weights scaled by release probability
         p_init = p0
-        alph_p_on_DN = 0.5 # scaling factor for strength of pre inh on NDNF-dendrite synapses
+        alph_p_on_DN = self.alph_p_on_DN
         if self.flag_pre_inh:
-            p0 = p_scale if p_scale else self.g_func(rN0)
-            # scale weights by release probability
+            p0 = p_scale if p_scale else self.g_func(r0['N'])
             if scale_w_by_p:
-                self.Ws['NS'] = self.Ws['NS']/p0*self.weights_scaled_by
-                self.Ws['DS'] = self.Ws['DS']/p0*self.weights_scaled_by
+                Ws['NS'] = scaled('NS', p0)
+                Ws['DS'] = scaled('DS', p0)
                 if self.flag_p_on_DN:
-                    self.Ws['DN'] = self.Ws['DN']/(alph_p_on_DN*p0+(1-alph_p_on_DN)*1)*self.weights_scaled_by
+                    Ws['DN'] = scaled('DN', alph_p_on_DN*p0+(1-alph_p_on_DN)*1)
                 if self.flag_p_on_VS:
-                    self.Ws['VS'] = self.Ws['VS']/p0*self.weights_scaled_by
-                self.weights_scaled_by = p0  # we're saving this so we don't scale weights again upon next run
-                                            # if the function is called again with the same p0, weights remain the same
+                    Ws['VS'] = scaled('VS', p0)
         else:
             p0 = 1
 
         # calculate background input to establish baselines specified by initial rates
+        Xbg = dict(self.Xbg if Xbg is None else Xbg)
         if calc_bg_input:
-            if self.flag_with_NDNF:
-                self.Xbg['N'] = rN0 + self.w_mean['NS'] * rS0 + self.w_mean['NN'] * rN0
+            Xbg_calc, r0 = self.calc_bg_inputs(self.w_mean, r0)
+            Xbg.update(Xbg_calc)
+            # note: no need to scale weights by p0 here because the weight matrices are divided by p0 and then again
+            #       multiplied by the current p during the simulation
+
+        return RunContext(Ws, Xbg, r0, p_init if p_init else p0)
+
+
+    def run_iter(self, dur, xFF, rE0=1, rS0=1, rN0=1, rP0=1, rD0=1, rV0=1, p0=0.5, init_noise=0.1, noise=0.1, dt=1,
+                 monitor_boutons=False, monitor_dend_inh=False, monitor_currents=False, calc_bg_input=True,
+                 scale_w_by_p=True, p_scale=None, fused=False, rng=None, chunk=1000, backend='numpy', record=None,
+                 early_stop=None, method='euler', step_tol=1e-4, state=None, Xbg=None, profile=None):
+        """
+        Run the dynamics of the network like run (with the same weights and background inputs, see prepare),
+        but yield the simulated trajectories chunk by chunk while the network is integrated, so that they can be
+        processed online with memory bounded by the chunk size. Concatenating the chunks of each variable in time
+        gives the trajectories returned by run.
+
+        Parameters:
+        ----------
+        - chunk:            number of time steps per chunk (the last chunk also contains the final time step; with
+                            early stopping, chunks span one window and the held final state follows in chunks)
+        - record:           what to store of each chunk (variables, neurons, stride, population means), see
+                            recording.Recorder
+        - profile:          profiling of the integration loop (see run), the wall time includes the time between
+                            chunks, in which they are processed by the caller
+        - all other parameters: see run
+
+        Yields:
+        -------
+        SimulationResult of each chunk: time points of the state variables (t), rates, release probability, GABA
+        spillover and a dictionary of the monitored quantities (other) during the chunk (None if not stored). Monitored
+        inhibition is stored one time step ahead of the rates (see run), so the first chunk holds one value more.
+        The last chunk also holds the reason and time of an early stop, the information on the integration, the
+        NetworkState at the last time point and the report of the profile.
+        """
+
+        # time arrays
+        t = np.arange(0, dur, dt)
+        nt = len(t)
+
+        # weights and background inputs of this simulation
+        context = self.prepare(rE0, rS0, rN0, rP0, rD0, rV0, p0, calc_bg_input, Xbg, scale_w_by_p, p_scale)
+
+        # integrate the network as a batch of size one, with a recorder that keeps only the current chunk
+        self._restore_streams(state, rng)
+        spec = recording.as_recorder(record)
+        recorder = recording.ChunkRecorder(spec.variables, spec.neurons, spec.stride, spec.mean)
+        profile = profiling.as_profile(profile)
+        steps = self._integrate_chunks(nt, dt, xFF, context.Xbg, context.r0, context.p_start, init_noise, noise, 1,
+                                       dict(), monitor_boutons, monitor_dend_inh, monitor_currents, fused, rng, chunk,
+                                       backend, recorder, early_stop, method, step_tol, state, context.Ws, profile)
+
+        def result(data, t0, stop=(None, None), integration=None, final=None, report=None):
+            """SimulationResult of a chunk whose first stored time step is t0 (or the next one on the stride)."""
+            t0 = t0 + (-t0) % recorder.stride
+            n_time = next((val.shape[1] for name, val in data.items() if name in recording.STATE_VARIABLES
+                           and val is not None), 0)
+            fields = [None if data.get(name) is None else data[name][0] for name in recording.STATE_VARIABLES]
+            other = Monitors({name: val[0] for name, val in data.items()
+                              if name not in recording.STATE_VARIABLES and val is not None})
+            t_chunk = t[t0:t0 + n_time * recorder.stride:recorder.stride]
+            return SimulationResult(t_chunk, *fields[:6], fields[6], fields[7], other, stop_reason=stop[0],
+                                    stop_time=stop[1], integration=integration, state=final, Xbg=context.Xbg,
+                                    profile=report)
+
+        t0 = 0
+        while True:
+            try:
+                step = next(steps)
+            except StopIteration as end:
+                data, _, (reason, stop_step, _), integration, final = end.value
+                break
+            yield result(recorder.take(), t0)
+            t0 = step
+
+        # final chunk, after an early stop the held final state is split into chunks
+        stop = (reason, t[stop_step] if reason is not None else None)
+        m = max(chunk // recorder.stride, 1)
+        n_stored = max([val.shape[1] for val in data.values() if val is not None], default=0)
+        starts = list(range(0, n_stored, m)) if n_stored > m + 1 else [0]
+        t0 = t0 + (-t0) % recorder.stride
+        for k in starts:
+            last = k == starts[-1]
+            piece = {name: None if val is None else val[:, k:None if last else k+m] for name, val in data.items()}
+            if last:
+                yield result(piece, t0 + k * recorder.stride, stop, integration, final.squeeze(),
+                             None if profile is None else profile.report)
+            else:
+                yield result(piece, t0 + k * recorder.stride)
+
+
+    def run_batch(self, dur, xFF, w_scale=None, rE0=1, rS0=1, rN0=1, rP0=1, rD0=1, rV0=1, p0=0.5, init_noise=0.1,
+                  noise=0.1, dt=1, monitor_boutons=False, monitor_dend_inh=False, monitor_currents=False,
+                  calc_bg_input=True, Xbg=None, scale_w_by_p=True, p_scale=None, fused=False, rng=None,
+                  noise_chunk=1000, backend='numpy', record=None, early_stop=None, method='euler', step_tol=1e-4,
+                  cache=None, state=None, profile=None):
+        """
+        Run a batch of B networks that share the connectivity of the model but differ in their inputs, initial rates
+        and/or mean weights. All conditions are advanced together with one matrix product per connection and time
+        step. The scaling of the weights by the release probability is applied as a scaling factor of the matrix
+        products (see _prepare_batch).
+
+        Parameters:
+        ----------
+        - dur:              duration of stimulation (in ms)
+        - xFF:              dictionary of inputs to the cells (see run), inputs shared across the batch or arrays of
+                            shape (B, nt, N) and protocols with parameters of shape (B,)
+        - w_scale:          dictionary of scaling factors for the weight matrices, scalars or arrays of shape (B,)
+                            (e.g. dict(NS=wNS/w_mean['NS']) to vary the mean SOM->NDNF weight across the batch)
+        - rE0, ..., rV0:    initial rates/ baselines, scalars or arrays of shape (B,)
+        - p0:               initial release probability, scalar or array of shape (B,)
+        - noise:            level of white noise added to neural activity
+        - init_noise:       noise in initial values of variables
+        - dt:               time step (in ms)
+        - monitor_boutons:  whether to monitor SOM boutons
+        - monitor_dend_inh: whether to monitor dendritic inhibition
+        - monitor_currents: whether to monitor input currents to SOM and NDNF
+        - calc_bg_input:    whether to calculcate the background inputs to achieve target rates
+        - Xbg:              dictionary of background inputs (scalars or arrays of shape (B,)), used if calc_bg_input
+                            is False (default: background inputs of the model)
+        - scale_w_by_p:     whether to scale weights by release probability
+        - p_scale:          if not None, scale weights by this value
+        - fused:            whether to compute all input currents with block operators (see get_block_operators)
+        - rng:              numpy random Generator for the initial values and the white noise (default: streams of the
+                            model), pass one per thread to simulate the same model from several threads
+        - noise_chunk:      number of time steps for which white noise is drawn and inputs are evaluated at once
+        - backend:          'numpy' or 'numba' (compiled integration kernel, falls back to numpy if numba is missing
+                            or if the kernel would be slower, see kernels.select_kernel)
+        - record:           what to store (see recording.Recorder), e.g. Recorder(['N'], stride=10, mean=True) or a
+                            dictionary of its arguments (default: all variables of every neuron and time step), use
+                            recording.DiskRecorder to stream long simulations into memory-mapped files
+        - early_stop:       criterion to end the simulation once the network has settled or diverges (see
+                            stopping.EarlyStop), e.g. EarlyStop('mean', window=500, tol=1e-3, min_dur=3000) or a
+                            dictionary of its arguments (default: simulate the full duration)
+        - method:           integration method: 'euler', 'euler_maruyama' (noise scaled with dt), 'exp_euler' or
+                            'adaptive' (see _integrate), use integration_error to check the error for a given dt
+        - step_tol:         tolerance of the local error per substep for the adaptive method
+        - cache:            cache of simulation results or path of its directory (see run)
+        - state:            NetworkState to continue from (see run), of a single network (shared by the batch) or of
+                            a batch of B networks
+        - profile:          profiling of the integration loop (see run)
+
+        Returns:
+        -------
+        - same as run, with a leading batch axis on all arrays except t; entries of other are arrays of shape
+          (B, nt, N) (or (B, nt-1, N) for boutons and currents)
+        """
+
+        # time arrays
+        t = np.arange(0, dur, dt)
+        nt = len(t)
+
+        # batch size and per-batch parameters
+        r0 = dict(E=rE0, D=rD0, S=rS0, N=rN0, P=rP0, V=rV0)
+        n_batch, w_scale, Xbg, r0, p_start = self._prepare_batch(xFF, w_scale, r0, p0, calc_bg_input, Xbg,
+                                                                 scale_w_by_p, p_scale, state)
+
+        self._restore_streams(state, rng)
+        recorder = recording.as_recorder(record)
+        profile = profiling.as_profile(profile)
+        args = (nt, dt, xFF, Xbg, r0, p_start, init_noise, noise, n_batch, w_scale, monitor_boutons, monitor_dend_inh,
+                monitor_currents, fused, rng, noise_chunk, backend, recorder, early_stop, method, step_tol, state, None,
+                profile)
+        data, derived, stop, integration, final = self._integrate_cached(cache, args, rng)
+
+        return self._make_result(t, data, derived, w_scale, stop, recorder.stride, integration, final, Xbg=Xbg,
+                                 profile=profile)
+
+
+    def integration_error(self, dur, xFF, method='exp_euler', dt=1, reference_tol=1e-8, **kwargs):
+        """
+        Estimate the error introduced by an integration method and time step: a noise-free simulation is compared to
+        a reference with tightly controlled adaptive substeps on the same time grid (in both, inputs are constant
+        during each time step). Neither simulation changes the model (see run_batch).
+
+        Parameters:
+        ----------
+        - dur:           duration of stimulation (in ms)
+        - xFF:           dictionary of inputs to the cells (see run_batch)
+        - method:        integration method (see run)
+        - dt:            time step (in ms)
+        - reference_tol: tolerance of the local error per substep of the reference
+        - kwargs:        further arguments of run_batch (e.g. w_scale or initial rates), noise is switched off
+
+        Returns:
+        -------
+        - dictionary of the maximal absolute errors of the rates of each cell type, the release probability ('p') and
+          the GABA spillover ('G')
+        """
+
+        kwargs.update(noise=0, init_noise=0, record=None, early_stop=None)
+        res = self.run_batch(dur, xFF, dt=dt, method=method, **kwargs)
+        ref = self.run_batch(dur, xFF, dt=dt, method='adaptive', step_tol=reference_tol, **kwargs)
+
+        return {name: float(np.max(np.abs(res[i+1] - ref[i+1]))) for i, name in enumerate(recording.STATE_VARIABLES)}
+
+
+    def steady_state(self, xFF=None, w_scale=None, rE0=1, rS0=1, rN0=1, rP0=1, rD0=1, rV0=1, p0=0.5,
+                     calc_bg_input=True, Xbg=None, scale_w_by_p=True, p_scale=None, tol=1e-10, max_iter=100,
+                     start=None, relax=0):
+        """
+        Solve for the fixed point of the noise-free network dynamics directly, for a batch of conditions as in
+        run_batch. For a fixed release probability, the rates obey piecewise-linear equations that are solved with an
+        active-set method, and the release probability is iterated to its equilibrium g_func(mean cGABA). If this does
+        not converge, the coupled equations are solved with a (semi-smooth) Newton method.
+        Note: the fixed point is not necessarily stable, and if there are several fixed points (e.g. in the bistable
+        regime) the solution depends on the starting point (the baselines and p0).
+
+        Parameters:
+        ----------
+        - xFF:              dictionary of constant inputs to the cells (see run_batch), inputs that vary in time are
+                            evaluated at the first time step
+        - w_scale:          dictionary of scaling factors for the weight matrices, scalars or arrays of shape (B,)
+        - rE0, ..., rV0:    baseline rates (also starting point of the solver), scalars or arrays of shape (B,)
+        - p0:               initial release probability (starting point of the solver), scalar or array of shape (B,)
+        - calc_bg_input:    whether to calculcate the background inputs to achieve target rates
+        - Xbg:              dictionary of background inputs, used if calc_bg_input is False
+        - scale_w_by_p:     whether to scale weights by release probability
+        - p_scale:          if not None, scale weights by this value
+        - tol:              tolerance for the residual of the fixed-point equations
+        - max_iter:         maximum number of iterations of each method
+        - start:            dictionary of starting rates of the solver for some cell types (scalars or arrays of
+                            shape (B,)) and of the starting release probability ('p'), instead of the baselines and p0
+                            (if only NDNF rates are given, p starts in equilibrium with them)
+        - relax:            duration (in ms) of a noise-free simulation from the starting point before solving, then
+                            the solver finds the fixed point in whose basin of attraction the start lies (unless the
+                            relaxation ends close to a boundary between basins)
+
+        Returns:
+        -------
+        - ss:               dictionary with the steady state of each batch member: rates of each cell type ('E', ...,
+                            'V') and GABA spillover ('G') of shape (B, N), release probability ('p') of shape (B,),
+                            monitored inhibition ('boutons_SOM', 'dend_inh_SOM', 'dend_inh_NDNF', 'soma_inh_PV') of
+                            shape (B, N), whether the solver converged ('converged') of shape (B,) and the scaling
+                            factors of the weight matrices including the scaling by the release probability
+                            ('w_scale', see jacobian)
+        """
+
+        xFF = dict() if xFF is None else xFF
+        sl = self.state_slices
+
+        # batch size and per-batch parameters
+        r0 = dict(E=rE0, D=rD0, S=rS0, N=rN0, P=rP0, V=rV0)
+        n_batch, w_scale, Xbg, r0, p_start = self._prepare_batch(xFF, w_scale, r0, p0, calc_bg_input, Xbg,
+                                                                 scale_w_by_p, p_scale)
+        w_scale = {conn: np.reshape(scale, (-1, 1)) for conn, scale in w_scale.items()}
+        start = dict() if start is None else start
+        if 'N' in start and 'p' not in start and self.flag_pre_inh:
+            p_start = self.g_func(self.gamma * np.asarray(start['N']))  # in equilibrium with the starting NDNF rates
+        p_start = np.broadcast_to(start.get('p', p_start), (n_batch,))
+
+        # constant inputs and starting point in the layout of the state vector
+        c = self._constant_inputs(xFF, Xbg, n_batch)
+        v_start = np.zeros((n_batch, self.N_state))
+        for cell in self.cell_types:
+            v_start[:, sl[cell]] = np.reshape(start.get(cell, r0[cell]), (-1, 1))
+        v_start[:, sl['G']] = self.gamma * np.reshape(start.get('N', r0['N']), (-1, 1))
+
+        # relax towards the fixed point by simulating the dynamics with constant inputs
+        if relax:
+            x_const = {cell: inputs.evaluate_input(xFF[cell], 0, 1, 1) for cell in xFF}
+            r_start = {cell: v_start[:, sl[cell].start] if cell in start else r0[cell] for cell in self.cell_types}
+            record = recording.Recorder(stride=int(relax))
+            data, _, _, _, _ = self._integrate(int(relax)+1, 1, x_const, Xbg, r_start, p_start, 0, 0, n_batch,
+                                               {conn: scale[:, 0] for conn, scale in w_scale.items()}, record=record,
+                                               method='exp_euler')
+            v_start = np.concatenate([data[cell][:, -1] for cell in self.cell_types + ['G']], axis=1)
+            p_start = data['p'][:, -1]
+
+        # solve for each batch member
+        operators = self.get_block_operators(w_scale)
+        V = np.zeros((n_batch, self.N_state))
+        p = np.ones(n_batch)
+        converged = np.zeros(n_batch, dtype=bool)
+        for bi in range(n_batch):
+            terms = [(W if scale is None else scale[bi, 0] * W, mod) for W, mod, scale in operators]
+            V[bi], p[bi], converged[bi] = self._solve_fixed_point(terms, c[bi], v_start[bi], p_start[bi], tol,
+                                                                  max_iter)
+        if not np.all(converged):
+            warnings.warn(f"Steady state not found for {np.sum(~converged)} of {n_batch} conditions.")
+
+        # rates and monitored inhibition at the steady state
+        R = np.maximum(V, 0)
+        ss = {cell: R[:, sl[cell]] for cell in self.cell_types + ['G']}
+        r = {cell: np.repeat(R[:, np.newaxis, sl[cell]], 2, axis=1) for cell in ['S', 'P', 'G']}
+        other = self._trajectory_monitors(r, np.repeat(p[:, np.newaxis], 2, axis=1), w_scale, True, True)
+        ss.update({key: val[:, 0] for key, val in other.items()}, p=p, converged=converged)
+        ss['w_scale'] = {conn: scale[:, 0] for conn, scale in w_scale.items()}
+
+        return ss
+
+
+    def jacobian(self, state, w_scale=None):
+        """
+        Jacobian of the noise-free rate dynamics at a given state, for a batch of states. The state vector consists of
+        the activations of all cell types and the GABA spillover (see state_slices), followed by the release
+        probability if presynaptic inhibition is included. Rectified units (rate zero) do not feed back into the
+        network. The release probability enters through the modulated connections (SOM->NDNF and SOM->dendrite, and
+        depending on the flags NDNF->dendrite and SOM->VIP) and depends on the mean GABA spillover.
+
+        Parameters:
+        ----------
+        - state:    dictionary with the rates of each cell type ('E', ..., 'V') and the GABA spillover ('G'), arrays of
+                    shape (N,) or (B, N), and the release probability ('p'), e.g. as returned by steady_state
+        - w_scale:  dictionary of scaling factors for the weight matrices, scalars or arrays of shape (B,), including
+                    the scaling by the release probability (default: state['w_scale'] if present)
+
+        Returns:
+        -------
+        - J:        array of shape (B, n, n), with n = N_state+1 (N_state without presynaptic inhibition), or a list
+                    of sparse matrices for a model with sparse weights
+        """
+
+        sl = self.state_slices
+        w_scale = state.get('w_scale', dict()) if w_scale is None else w_scale
+        w_scale = {conn: np.reshape(scale, (-1, 1)) for conn, scale in w_scale.items()}
+
+        # rates in the layout of the state vector and time constants
+        n_batch = max([np.size(state['p'])] + [np.shape(np.atleast_2d(state[cell]))[0] for cell in sl.keys()])
+        R = np.zeros((n_batch, self.N_state))
+        tau = np.zeros(self.N_state)
+        for cell in sl.keys():
+            R[:, sl[cell]] = np.atleast_2d(state[cell])
+            tau[sl[cell]] = self.taus[cell] if cell in self.taus else self.tauG
+        p = np.broadcast_to(state['p'], (n_batch,))
+        n_G = sl['G'].stop - sl['G'].start
+
+        operators = self.get_block_operators(w_scale)
+        J = []
+        for bi in range(n_batch):
+            terms = [(W if scale is None else scale[bi, 0] * W, mod) for W, mod, scale in operators]
+            active = R[bi] > 0
+            leak = sparse.diags(1 / tau) if self.flag_sparse else (1 / tau)[:, np.newaxis]
+            A = self._mask_columns(self._weighted_operator(terms, p[bi]), active)
+            J_vv = leak @ (A - sparse.identity(self.N_state)) if self.flag_sparse else leak * (A - np.eye(self.N_state))
+            if not self.flag_pre_inh:
+                J.append(J_vv.tocsr() if self.flag_sparse else J_vv)
+                continue
+            J_vp = np.reshape(self._weighted_operator(terms, p[bi], derivative=True) @ R[bi] / tau, (-1, 1))
+            J_pv = np.zeros((1, self.N_state))
+            J_pv[0, sl['G']] = self._p_equilibrium(R[bi])[1] * active[sl['G']] / n_G / self.taup
+            J_pp = np.array([[-1 / self.taup]])
+            if self.flag_sparse:
+                J.append(sparse.bmat([[J_vv, J_vp], [J_pv, J_pp]], format='csr'))
+            else:
+                J.append(np.block([[J_vv, J_vp], [J_pv, J_pp]]))
+
+        return J if self.flag_sparse else np.array(J)
+
+
+    def stability(self, xFF=None, w_scale=None, starts=None, relax=500, eig_tol=1e-9, **kwargs):
+        """
+        Find fixed points of the noise-free dynamics for a batch of conditions (e.g. a grid of weights and inputs)
+        from one or several starting points and classify their stability by the eigenvalues of the Jacobian. Several
+        distinct stable fixed points indicate multistability, e.g. in the SOM-NDNF switch regime.
+
+        Parameters:
+        ----------
+        - xFF:      dictionary of constant inputs to the cells (see steady_state)
+        - w_scale:  dictionary of scaling factors for the weight matrices, scalars or arrays of shape (B,)
+        - starts:   list of dictionaries of starting points (see steady_state), e.g. [dict(N=0), dict(N=3)]
+                    (default: start at the baselines)
+        - relax:    duration (in ms) of a noise-free simulation from each start before solving (see steady_state)
+        - eig_tol:  fixed points are stable if the real parts of all eigenvalues are below -eig_tol, and fixed points
+                    are distinct if their rates differ by more than sqrt(eig_tol)
+        - kwargs:   further arguments of steady_state (baselines, background inputs, tolerance etc.)
+
+        Returns:
+        -------
+        - stab:     dictionary with the fixed points found from each start ('fixed_points', list of dictionaries as
+                    returned by steady_state), the largest real part of the eigenvalues ('max_real', shape (S, B) for
+                    S starts), the stability of each fixed point ('stable', shape (S, B), False if the solver did not
+                    converge) and the number of distinct stable fixed points ('n_stable', shape (B,))
+        """
+
+        starts = [None] if starts is None else starts
+        fixed_points, max_real = [], []
+        for start in starts:
+            ss = self.steady_state(xFF, w_scale, start=start, relax=relax, **kwargs)
+            max_real.append([self._max_real_eigenvalue(J) for J in self.jacobian(ss)])
+            fixed_points.append(ss)
+        max_real = np.array(max_real)
+        stable = (max_real < -eig_tol) & np.array([ss['converged'] for ss in fixed_points])
+
+        # count distinct stable fixed points of each batch member
+        rates = np.array([np.concatenate([ss[cell] for cell in self.state_slices.keys()], axis=1)
+                          for ss in fixed_points])
+        n_stable = np.zeros(rates.shape[1], dtype=int)
+        for bi in range(rates.shape[1]):
+            found = []
+            for si in np.flatnonzero(stable[:, bi]):
+                if all(np.max(np.abs(rates[si, bi] - r)) > np.sqrt(eig_tol) for r in found):
+                    found.append(rates[si, bi])
+            n_stable[bi] = len(found)
+
+        return dict(fixed_points=fixed_points, max_real=max_real, stable=stable, n_stable=n_stable)
+
+
+    def _max_real_eigenvalue(self, J):
+        """Largest real part of the eigenvalues of a Jacobian (dense or sparse)."""
+        if sparse.issparse(J):
+            if J.shape[0] > 1000:
+                try:
+                    return np.real(sparse_linalg.eigs(J, k=1, which='LR', return_eigenvectors=False)[0])
+                except sparse_linalg.ArpackNoConvergence:
+                    pass
+            J = J.toarray()
+        return np.max(np.real(np.linalg.eigvals(J)))
+
+
+    def _constant_inputs(self, xFF, Xbg, n_batch):
+        """
+        Sum of background and feedforward inputs in the layout of the state vector, for inputs that are constant
+        (inputs that vary in time are evaluated at the first time step).
+
+        Parameters:
+        ----------
+        - xFF:      dictionary of inputs to the cells
+        - Xbg:      dictionary of background inputs, scalars or arrays of shape (n_batch,)
+        - n_batch:  batch size
+
+        Returns:
+        -------
+        - c:        array of shape (n_batch, N_state)
+        """
+        sl = self.state_slices
+        c = np.zeros((n_batch, self.N_state))
+        for cell in self.cell_types:
+            c[:, sl[cell]] += np.reshape(Xbg[cell], (-1, 1))
+            if cell in xFF:
+                c[:, sl[cell]] += inputs.evaluate_input(xFF[cell], 0, 1, 1)[:, 0]
+        return c
+
+
+    def _solve_fixed_point(self, terms, c, v, p, tol=1e-10, max_iter=100):
+        """
+        Solve the fixed-point equations v = A(p) [v]_+ + c and p = g_func(mean cGABA) of one network (see
+        steady_state), where A(p) is the sum of the block operators weighted by their release factors.
+
+        Parameters:
+        ----------
+        - terms:    list of tuples (W, modulation) of block operators
+        - c:        constant inputs (background and feedforward) in the layout of the state vector
+        - v:        starting point (activations pre rectification)
+        - p:        starting point of the release probability
+        - tol:      tolerance for the residual
+        - max_iter: maximum number of iterations of each method
+
+        Returns:
+        -------
+        - v:        activations at the fixed point
+        - p:        release probability at the fixed point
+        - converged: whether the residual is below tol
+        """
+
+        sl_G = self.state_slices['G']
+        n_G = sl_G.stop - sl_G.start
+        eye = sparse.identity(self.N_state, format='csr') if self.flag_sparse else np.eye(self.N_state)
+        solve = sparse_linalg.spsolve if self.flag_sparse else np.linalg.solve
+        operator = lambda p, derivative=False: self._weighted_operator(terms, p, derivative)
+        p_equilibrium = self._p_equilibrium
+        mask_columns = self._mask_columns
+
+        def residual(v, p):
+            return np.concatenate([-v + operator(p) @ np.maximum(v, 0) + c, [p_equilibrium(v)[0] - p]])
+
+        # active-set solve of the piecewise-linear rate equations, alternated with updates of the release probability
+        p = p if self.flag_pre_inh else 1.
+        try:
+            for i in range(max_iter):
+                A = operator(p)
+                active = v > 0
+                for j in range(max_iter):
+                    v = solve(eye - mask_columns(A, active), c)
+                    if np.array_equal(v > 0, active):
+                        break
+                    active = v > 0
+                if np.max(np.abs(residual(v, p))) < tol:
+                    return v, p, True
+                p = p_equilibrium(v)[0]
+        except np.linalg.LinAlgError:
+            pass
+
+        # fallback: semi-smooth Newton method on the coupled equations for activations and release probability
+        for i in range(max_iter):
+            F = residual(v, p)
+            if np.max(np.abs(F)) < tol:
+                return v, p, True
+            active = v > 0
+            J_vv = -eye + mask_columns(operator(p), active)
+            J_vp = np.reshape(operator(p, derivative=True) @ np.maximum(v, 0), (-1, 1))
+            J_pv = np.zeros((1, self.N_state))
+            J_pv[0, sl_G] = p_equilibrium(v)[1] * active[sl_G] / n_G
+            J_pp = np.array([[-1.]])
+            if self.flag_sparse:
+                J = sparse.bmat([[J_vv, J_vp], [J_pv, J_pp]], format='csc')
             else:
-                self.Xbg['N'] = 0
-                rN0 = 0
-            if self.flag_with_VIP:
-                self.Xbg['V'] = rV0 - self.w_mean['VE'] * rE0 + self.w_mean['VS'] * rS0 + self.w_mean['VN'] * rN0
+                J = np.block([[J_vv, J_vp], [J_pv, J_pp]])
+            try:
+                step = solve(J, -F)
+            except np.linalg.LinAlgError:
+                break
+            v, p = v + step[:-1], p + step[-1]
+
+        return v, p, bool(np.max(np.abs(residual(v, p))) < tol)
+
+
+    def _weighted_operator(self, terms, p, derivative=False):
+        """
+        Sum of block operators weighted by their release factors for release probability p (or by the derivatives of
+        the release factors with respect to p).
+
+        Parameters:
+        ----------
+        - terms:      list of tuples (W, modulation) of block operators
+        - p:          release probability
+        - derivative: whether to weight by the derivatives of the release factors
+
+        Returns:
+        -------
+        - operator of shape (N_state, N_state)
+        """
+        alph = self.alph_p_on_DN
+        factors = {None: (1, 0), 'p': (p, 1), 'pDN': (alph*p + (1-alph), alph), 'pVS': (p, 1)}
+        return sum(factors[mod][derivative] * W for W, mod in terms)
+
+    def _p_equilibrium(self, v):
+        """Equilibrium release probability for activations v and its slope with respect to the mean GABA spillover."""
+        if not self.flag_pre_inh:
+            return 1., 0.
+        mean_gaba = np.mean(np.maximum(v[self.state_slices['G']], 0))
+        g = 1 - self.b * (mean_gaba - self.r0)
+        return self.g_func(mean_gaba), -self.b if self.p_low < g < 1 else 0.
+
+    def _mask_columns(self, A, active):
+        """Operator A restricted to the active units (columns of inactive units are set to zero)."""
+        return A @ sparse.diags(active.astype(float)) if self.flag_sparse else A * active
+
+
+    def _prepare_batch(self, xFF, w_scale, r0, p0, calc_bg_input=True, Xbg=None, scale_w_by_p=True, p_scale=None,
+                       state=None):
+        """
+        Determine the batch size and the per-batch parameters of run_batch (and steady_state), without changing the
+        model.
+
+        Parameters:
+        ----------
+        - xFF:              dictionary of inputs to the cells
+        - w_scale:          dictionary of scaling factors for the weight matrices (or None)
+        - r0:               dictionary of baseline rates of each cell type, scalars or arrays of shape (B,)
+        - p0:               initial release probability, scalar or array of shape (B,)
+        - calc_bg_input, Xbg, scale_w_by_p, p_scale, state: see run_batch
+
+        Returns:
+        -------
+        - n_batch:          batch size
+        - w_scale:          dictionary of scaling factors for the weight matrices, including the scaling by the
+                            release probability
+        - Xbg:              dictionary of background inputs
+        - r0:               dictionary of baseline rates
+        - p_start:          initial release probability
+        """
+
+        # determine batch size from all arguments that can vary across the batch
+        w_scale = {conn: np.asarray(scale, dtype=float) for conn, scale in (w_scale or dict()).items()}
+        r0 = {cell: np.asarray(r, dtype=float) for cell, r in r0.items()}
+        Xbg = dict(self.Xbg if Xbg is None else Xbg)
+        sizes = [np.size(x) for x in list(w_scale.values()) + list(r0.values()) + [p0]]
+        sizes += [np.size(Xbg[cell]) for cell in Xbg.keys()]
+        sizes += [inputs.input_batch_size(spec) for spec in xFF.values()]
+        sizes += [state.n_batch] if state is not None else []
+        n_batch = max(sizes)
+        if any(size not in [1, n_batch] for size in sizes):
+            raise ValueError(f"Inconsistent batch sizes {sorted(set(sizes))}.")
+
+        # mean weights of each batch member (used for background inputs)
+        w_mean = {conn: self.w_mean[conn] * w_scale.get(conn, 1) for conn in self.w_mean.keys()}
+
+        # presynaptic inhibition: fold the scaling of weights by release probability into the batch scaling factors
+        alph_p_on_DN = self.alph_p_on_DN
+        if self.flag_pre_inh:
+            p0_w = p_scale if p_scale else self.g_func(r0['N'])
+            if scale_w_by_p:
+                w_scale['NS'] = w_scale.get('NS', 1) / p0_w
+                w_scale['DS'] = w_scale.get('DS', 1) / p0_w
+                if self.flag_p_on_DN:
+                    w_scale['DN'] = w_scale.get('DN', 1) / (alph_p_on_DN*p0_w+(1-alph_p_on_DN)*1)
+                if self.flag_p_on_VS:
+                    w_scale['VS'] = w_scale.get('VS', 1) / p0_w
+        else:
+            p0_w = 1
+        p_start = np.where(np.asarray(p0) != 0, p0, p0_w) if p0 is not None else p0_w
+
+        # calculate background input to establish baselines specified by initial rates
+        if calc_bg_input:
+            Xbg, r0 = self.calc_bg_inputs(w_mean, r0)
+
+        return n_batch, w_scale, Xbg, r0, p_start
+
+
+    def calc_bg_inputs(self, w_mean, r0):
+        """
+        Calculate the background inputs that establish the baseline rates r0.
+
+        Parameters:
+        ----------
+        - w_mean:   dictionary of mean weights for each synapse type (scalars or arrays over a batch)
+        - r0:       dictionary of baseline rates for each cell type (scalars or arrays over a batch)
+
+        Returns:
+        -------
+        - Xbg:      dictionary of background inputs
+        - r0:       dictionary of baseline rates, with rates of cell types not included in the model set to 0
+        """
+
+        r0 = dict(r0)
+        Xbg = dict()
+        if self.flag_with_NDNF:
+            Xbg['N'] = r0['N'] + w_mean['NS'] * r0['S'] + w_mean['NN'] * r0['N']
+        else:
+            Xbg['N'] = 0
+            r0['N'] = 0
+        if self.flag_with_VIP:
+            Xbg['V'] = r0['V'] - w_mean['VE'] * r0['E'] + w_mean['VS'] * r0['S'] + w_mean['VN'] * r0['N']
+        else:
+            Xbg['V'] = 0
+            r0['V'] = 0
+        if self.flag_with_PV:
+            Xbg['P'] = r0['P'] - w_mean['PE'] * r0['E'] + w_mean['PS'] * r0['S'] + w_mean['PN'] * r0['N'] \
+                       + w_mean['PV'] * r0['V'] + w_mean['PP'] * r0['P']
+        else:
+            Xbg['P'] = 0
+            r0['P'] = 0
+        Xbg['E'] = r0['E'] + w_mean['EP'] * r0['P'] - self.wED * r0['D']
+        Xbg['D'] = r0['D'] + w_mean['DS'] * r0['S'] + w_mean['DN'] * r0['N'] - w_mean['DE'] * r0['E']
+        Xbg['S'] = r0['S'] - w_mean['SE'] * r0['E'] + w_mean['SV'] * r0['V']
+
+        return Xbg, r0
+
+
+    def get_block_operators(self, w_scale=None, Ws=None):
+        """
+        Assemble the weight matrices into signed block operators acting on the packed state vector (see
+        state_slices). Connections modulated by the release probability (NS, DS and, depending on the flags, DN and
+        VS) are collected in separate operators. Connections with a scaling factor that varies across a batch get an
+        operator of their own, uniform scaling factors are folded into the operators.
+
+        Parameters:
+        ----------
+        - w_scale:  dictionary of scaling factors for the weight matrices, scalars or arrays of shape (B, 1)
+        - Ws:       dictionary of weight matrices (default: weights of the model)
+
+        Returns:
+        -------
+        - operators: list of tuples (W, modulation, scale) with the block operator W of shape (N_state, N_state), the
+                     modulation (None, 'p', 'pDN' or 'pVS') and the per-batch scaling factor (None or array (B, 1))
+        """
+
+        w_scale = dict() if w_scale is None else w_scale
+        Ws = self.Ws if Ws is None else Ws
+        sl = self.state_slices
+
+        # modulation of each connection by presynaptic inhibition
+        modulation = dict(NS='p', DS='p')
+        if self.flag_p_on_DN:
+            modulation['DN'] = 'pDN'
+        if self.flag_p_on_VS:
+            modulation['VS'] = 'pVS'
+
+        # fixed couplings: dendrite->soma and NDNF rate->GABA spillover
+        fixed = [(sl['E'], sl['D'], self.wED * sparse.eye(self.N_cells['E'], self.N_cells['D'])),
+                 (sl['G'], sl['N'], self.gamma * sparse.eye(self.N_cells['N']))]
+
+        # sort connections into blocks, NDNF->dendrite inhibition acts via GABA spillover
+        blocks = {None: (fixed, None, None)}
+        for conn in Ws.keys():
+            post, pre = conn[0], 'G' if conn == 'DN' else conn[1]
+            sign = 1 if pre == 'E' else -1
+            mod = modulation.get(conn)
+            scale = np.reshape(w_scale.get(conn, 1), (-1, 1))
+            if scale.size > 1:
+                key, W = conn, sign * Ws[conn]
             else:
-                self.Xbg['V'] = 0
-                rV0 = 0
-            if self.flag_with_PV:
-                self.Xbg['P'] = rP0 - self.w_mean['PE'] * rE0 + self.w_mean['PS'] * rS0 + self.w_mean['PN'] * rN0 + self.w_mean['PV'] * rV0 \
-                            + self.w_mean['PP'] * rP0
+                key, W, scale = mod, sign * scale.item() * Ws[conn], None
+            if key not in blocks:
+                blocks[key] = ([], mod, scale)
+            blocks[key][0].append((sl[post], sl[pre], W))
+
+        # assemble operators (sparse if the weight matrices are sparse)
+        operators = []
+        for block_list, mod, scale in blocks.values():
+            if self.flag_sparse:
+                rows, cols, vals = [], [], []
+                for sl_post, sl_pre, Wb in block_list:
+                    Wb = sparse.coo_matrix(Wb)
+                    rows.append(Wb.row + sl_post.start)
+                    cols.append(Wb.col + sl_pre.start)
+                    vals.append(Wb.data)
+                W = sparse.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                                      shape=(self.N_state, self.N_state))
             else:
-                self.Xbg['P'] = 0
-                rP0 = 0
-            self.Xbg['E'] = rE0 + self.w_mean['EP'] * rP0 - self.wED * rD0
-            self.Xbg['D'] = rD0 + self.w_mean['DS'] * rS0 + self.w_mean['DN'] * rN0 - self.w_mean['DE'] * rE0
-            self.Xbg['S'] = rS0 - self.w_mean['SE'] * rE0 + self.w_mean['SV'] * rV0
-            # note: no need to scale weights by p0 here because the weight matrices are divided by p0 and then again
-            #       multiplied by the current p during the simulation
+                W = np.zeros((self.N_state, self.N_state), dtype=self.dtype)
+                for sl_post, sl_pre, Wb in block_list:
+                    W[sl_post, sl_pre] = Wb.toarray() if sparse.issparse(Wb) else Wb
+            operators.append((W, mod, scale))
+
+        return operators
+
+
+    def _trajectory_monitors(self, r, p, w_scale, monitor_boutons=False, monitor_dend_inh=False, Ws=None,
+                             initial=False):
+        """
+        Compute monitored synaptic inputs from a stretch of trajectories, with one matrix product over all time steps.
+        Matches the inputs used in each step of the integration.
+
+        Parameters:
+        ----------
+        - r:                dictionary of trajectories of shape (n_batch, T+1, N) of SOMs ('S'), PVs ('P'), GABA
+                            spillover ('G') and, if initial is True, NDNFs ('N')
+        - p:                release probabilities of shape (n_batch, T+1)
+        - w_scale:          dictionary of scaling factors for the weight matrices, arrays of shape (n_batch, 1)
+        - monitor_boutons:  whether to compute SOM bouton signals
+        - monitor_dend_inh: whether to compute dendritic (and PV somatic) inhibition
+        - Ws:               dictionary of weight matrices (default: weights of the model)
+        - initial:          whether the trajectories start at the beginning of the simulation, then the monitored
+                            inhibition starts with its initial value (as returned by run)
+
+        Returns:
+        -------
+        - other:            dictionary of monitored arrays of shape (n_batch, T, N), one entry per time step (T+1
+                            entries for the inhibition if initial is True)
+        """
+
+        Ws = self.Ws if Ws is None else Ws
+        rS, rP, cGABA = [r[cell][:, :-1] for cell in ['S', 'P', 'G']]
+        pt = p[:, :-1, np.newaxis]
+        pDN = self.alph_p_on_DN*pt + (1-self.alph_p_on_DN)*1 if self.flag_p_on_DN else 1
+
+        def syn(conn, r):
+            """Synaptic input through connection conn for presynaptic trajectories r of shape (n_batch, T, Npre)."""
+            scale = np.reshape(np.asarray(w_scale[conn], dtype=self.dtype), (-1, 1, 1)) if conn in w_scale else 1
+            return scale * apply_weights(Ws[conn], r)
 
-        # create empty arrays
-        rE = np.zeros((nt, self.N_cells['E']))
-        rD = np.zeros((nt, self.N_cells['D']))
-        rS = np.zeros((nt, self.N_cells['S']))
-        rN = np.zeros((nt, self.N_cells['N']))
-        rP = np.zeros((nt, self.N_cells['P']))
-        rV = np.zeros((nt, self.N_cells['V']))
-
-        # set initial rates/values
-        rE[0] = np.random.normal(rE0, rE0*init_noise, size=self.N_cells['E'])
-        rD[0] = np.random.normal(rD0, rD0*init_noise, size=self.N_cells['D'])
-        rS[0] = np.random.normal(rS0, rS0*init_noise, size=self.N_cells['S'])
-        rN[0] = np.random.normal(rN0, rN0*init_noise, size=self.N_cells['N'])
-        rP[0] = np.random.normal(rP0, rP0*init_noise, size=self.N_cells['P'])
-        rV[0] = np.random.normal(rV0, rP0*init_noise, size=self.N_cells['P'])
-
-        # variables for other shenanigans
-        p = np.ones(nt)
-        p[0] = p_init if p_init else p0
-        cGABA = np.zeros((nt, self.N_cells['N']))
-        cGABA[0] = rN0
-
-        # optional recording of stuff
         other = dict()
+        if monitor_boutons or monitor_dend_inh:
+            inh_SOM = pt*syn('DS', rS)
         if monitor_boutons:
-            other['boutons_SOM'] = []
+            other['boutons_SOM'] = inh_SOM
         if monitor_dend_inh:
-            other['dend_inh_SOM'] = [p[0]*self.Ws['DS']@rS[0]]
-            other['dend_inh_NDNF'] = [self.Ws['DN']@rN[0]]  # todo: include flag for pi on wDN
-            other['soma_inh_PV'] = [self.Ws['EP']@rP[0]]
-        if monitor_currents:
-            other['curr_rS'] = []
-            other['curr_rN'] = []
-            other['curr_rE'] = []
+            other['dend_inh_SOM'] = inh_SOM
+            other['dend_inh_NDNF'] = pDN*syn('DN', cGABA)
+            other['soma_inh_PV'] = syn('EP', rP)
+            if initial:
+                # note: the first entry is the initial value, followed by the inputs used in each time step
+                init = dict(dend_inh_SOM=inh_SOM[:, :1], dend_inh_NDNF=syn('DN', r['N'][:, :1]),
+                            soma_inh_PV=other['soma_inh_PV'][:, :1])
+                for name in DEND_INH_MONITORS:
+                    other[name] = np.concatenate([init[name], other[name]], axis=1)
 
-        # initialise activations (rates pre rectification)
-        vS, vN, vE, vD, vP, vV = rS[0], rN[0], rE[0], rD[0], rP[0], rV[0]
+        return other
+
+
+    def _make_result(self, t, data, derived, w_scale, stop=(None, None, None), stride=1, integration=None,
+                     final=None, Ws=None, Xbg=None, squeeze=False, profile=None):
+        """
+        Collect the stored variables of a simulation in a SimulationResult.
+
+        Parameters:
+        ----------
+        - t:           time array of the full simulation
+        - data:        dictionary of stored variables (see _integrate)
+        - derived:     names of monitored quantities that are computed from the trajectories on first access
+        - w_scale:     dictionary of scaling factors for the weight matrices used in the simulation
+        - stop:        reason for stopping early, index of the last simulated time step and number of time points of
+                       the trajectories (see _integrate)
+        - stride:      recording stride
+        - integration: information on the integration (see _integrate)
+        - final:       NetworkState at the last time point
+        - Ws:          dictionary of the weight matrices of the simulation (default: weights of the model)
+        - Xbg:         dictionary of the background inputs of the simulation
+        - squeeze:     whether to remove the batch axis (for a batch of size one)
+        - profile:     Profile of the simulation (see profiling.Profile), None without profiling
+
+        Returns:
+        -------
+        - SimulationResult
+        """
+
+        Ws = self.Ws if Ws is None else Ws
+        w_scale = {conn: np.reshape(scale, (-1, 1)) for conn, scale in w_scale.items()}
+        unbatch = (lambda val: val[0]) if squeeze else (lambda val: val)
+
+        def derive(name):
+            """Compute a monitored quantity (and those computed alongside) from the stored trajectories."""
+            group = DEND_INH_MONITORS if name in DEND_INH_MONITORS else [name]
+            other = self._trajectory_monitors(data, data['p'], w_scale, name == 'boutons_SOM',
+                                              name in DEND_INH_MONITORS, Ws=Ws, initial=True)
+            return {key: unbatch(other[key]) for key in group if key in derived}
 
-        # time integration
-        for ti in range(nt-1):
+        fields = [unbatch(data[name]) if name in data else None for name in recording.STATE_VARIABLES]
+        stored = {key: unbatch(val) for key, val in data.items() if key not in recording.STATE_VARIABLES}
 
-            # white noise
-            xiE = np.random.normal(0, noise, size=self.N_cells['E'])
-            xiD = np.random.normal(0, noise, size=self.N_cells['D'])
-            xiS = np.random.normal(0, noise, size=self.N_cells['S'])
-            xiN = np.random.normal(0, noise, size=self.N_cells['N'])
-            xiP = np.random.normal(0, noise, size=self.N_cells['P'])
-            xiV = np.random.normal(0, noise, size=self.N_cells['V'])
+        # time points of the stored trajectories (which end at an early stop unless the final state is held)
+        reason, stop_step, n_time = stop
+        stop_time = t[stop_step] if reason is not None else None
+
+        if final is not None and squeeze:
+            final = final.squeeze()
+
+        return SimulationResult(t[:n_time:stride], *fields, Monitors(stored, derived, derive), stop_reason=reason,
+                                stop_time=stop_time, integration=integration, state=final, Xbg=Xbg,
+                                profile=None if profile is None else profile.report)
+
+
+    def _integrate_cached(self, cache, args, rng=None):
+        """
+        Integrate the network (see _integrate), or load the result from a cache. The key covers the arguments, the
+        complete state of the model (weights, background inputs, parameters, flags and seed), the states of the random
+        streams and the code version. The random streams are left in the same state as after the simulation.
+
+        Parameters:
+        ----------
+        - cache:    ResultCache, path of a cache directory or None (no caching)
+        - args:     arguments of _integrate
+        - rng:      random Generator passed to _integrate (None: streams of the model)
+
+        Returns:
+        -------
+        - same as _integrate
+        """
+        cache = caching.as_cache(cache)
+        if cache is None:
+            return self._integrate(*args)
+        if any(isinstance(arg, recording.DiskRecorder) for arg in args):
+            warnings.warn("Simulations that are streamed to disk are not cached.")
+            return self._integrate(*args)
+        if any(isinstance(arg, profiling.Profile) for arg in args):
+            warnings.warn("Profiled simulations are not cached.")
+            return self._integrate(*args)
+
+        generators = [self.rng_init, self.rng_noise] if rng is None else [rng]
+        model = {name: value for name, value in vars(self).items() if not name.startswith('rng_')}
+        try:
+            content = caching.freeze(('_integrate', args, model, generators))
+        except TypeError as error:
+            warnings.warn(f"Simulation is not cached: {error}")
+            return self._integrate(*args)
+
+        return cache.evaluate(lambda: self._integrate(*args), content, generators)
+
+
+    def _integrate(self, nt, dt, xFF, Xbg, r0, p_start, init_noise, noise, n_batch, w_scale,
+                   monitor_boutons=False, monitor_dend_inh=False, monitor_currents=False, fused=False, rng=None,
+                   noise_chunk=1000, backend='numpy', record=None, early_stop=None, method='euler', step_tol=1e-4,
+                   state=None, Ws=None, profile=None):
+        """
+        Integration of a batch of networks with the connectivity of the model. The rates of all cell types and
+        the GABA spillover are packed into one state vector (see state_slices) and updated together. The network is
+        integrated in chunks of noise_chunk time steps, only the current chunk of the state is kept in memory and the
+        recorder stores the requested variables.
+
+        Parameters:
+        ----------
+        - nt:               number of time steps
+        - dt:               time step (in ms)
+        - xFF:              dictionary of input specifications (see inputs.evaluate_input)
+        - Xbg:              dictionary of background inputs, scalars or arrays of shape (n_batch,)
+        - r0:               dictionary of initial rates, scalars or arrays of shape (n_batch,)
+        - p_start:          initial release probability, scalar or array of shape (n_batch,)
+        - init_noise:       noise in initial values of variables
+        - noise:            level of white noise added to neural activity
+        - n_batch:          batch size
+        - w_scale:          dictionary of scaling factors for the weight matrices, scalars or arrays of shape (n_batch,)
+        - monitor_boutons:  whether to monitor SOM boutons
+        - monitor_dend_inh: whether to monitor dendritic inhibition
+        - monitor_currents: whether to monitor input currents to SOM and NDNF
+        - fused:            whether to compute all input currents with the block operators (see get_block_operators)
+                            instead of one matrix product per connection
+        - rng:              numpy random Generator for the initial values and the white noise (default: streams of the
+                            model)
+        - noise_chunk:      number of time steps for which white noise is drawn and inputs are evaluated at once
+        - backend:          'numpy' or 'numba' (compiled kernel on the fused operators, see kernels.select_kernel)
+        - record:           Recorder of this simulation or recording specification (see recording.as_recorder),
+                            default: store everything
+        - early_stop:       early stopping criterion (see stopping.as_early_stop), checked after every window of time
+                            steps (default: no early stopping)
+        - method:           integration method, one of
+                            'euler':          forward Euler, white noise of std noise is added to the inputs in each
+                                              time step (independent of dt, as in the original model)
+                            'euler_maruyama': forward Euler with noise scaled by 1/sqrt(dt), so that the statistics
+                                              of the noise do not depend on dt (same as 'euler' for dt=1)
+                            'exp_euler':      exponential Euler, the leak of each variable is integrated exactly for
+                                              inputs that are constant during a time step (stable for any dt) and the
+                                              noise is scaled like the exact Ornstein-Uhlenbeck process
+                            'adaptive':       deterministic Heun integration with adaptive substeps between the time
+                                              points (requires noise=0), the step size is reset where the input jumps
+        - step_tol:         tolerance of the local error per substep for the adaptive method (relative to 1+|v|)
+        - state:            NetworkState to start from (single or of shape n_batch), instead of the initial rates r0
+                            and p_start (the random streams are not changed, see _restore_streams)
+        - Ws:               dictionary of weight matrices (default: weights of the model, see prepare)
+        - profile:          Profile that times the sections of the integration loop (see profiling.Profile), default:
+                            no instrumentation
+
+        Returns:
+        -------
+        - data:             dictionary of stored variables (see recording.Recorder), by default rates of each cell
+                            type ('E', ..., 'V') and GABA spillover ('G') of shape (n_batch, nt, N), release
+                            probabilities ('p') of shape (n_batch, nt) and input currents of shape (n_batch, nt-1, N)
+        - derived:          names of monitored quantities that were not computed during the simulation because they
+                            can be derived from the stored trajectories (see _trajectory_monitors)
+        - stop:             tuple of the reason for stopping early (None if the simulation ran until the end, see
+                            stopping.STOP_REASONS), the index of the last simulated time step and the number of time
+                            points of the returned trajectories
+        - integration:      dictionary with the method, number of integration steps ('n_steps', including substeps)
+                            and the estimated maximal local error per step ('local_error', from the second
+                            differences of the trajectories or the error estimate of the adaptive method, None if
+                            there is noise)
+        - final:            NetworkState at the last time point, with the states of the random streams
+        """
+
+        steps = self._integrate_chunks(nt, dt, xFF, Xbg, r0, p_start, init_noise, noise, n_batch, w_scale,
+                                       monitor_boutons, monitor_dend_inh, monitor_currents, fused, rng, noise_chunk,
+                                       backend, record, early_stop, method, step_tol, state, Ws, profile)
+        while True:
+            try:
+                next(steps)
+            except StopIteration as end:
+                return end.value
+
+
+    def _integrate_chunks(self, nt, dt, xFF, Xbg, r0, p_start, init_noise, noise, n_batch, w_scale,
+                          monitor_boutons=False, monitor_dend_inh=False, monitor_currents=False, fused=False,
+                          rng=None, noise_chunk=1000, backend='numpy', record=None, early_stop=None, method='euler',
+                          step_tol=1e-4, state=None, Ws=None, profile=None):
+        """
+        Generator that integrates the network like _integrate (same parameters and return value, which it returns
+        when it is exhausted). It yields the index of the next time step whenever the recorder has received a chunk
+        of time steps (and, after an early stop, before the final state is held), see run_iter.
+        """
+
+        sl = self.state_slices
+        n_rates = sl['G'].start
+        n_gaba = sl['G'].stop - sl['G'].start
+        Ws = self.Ws if Ws is None else Ws
+
+        # per-batch quantities as column vectors
+        w_scale = {conn: np.reshape(np.asarray(scale, dtype=self.dtype), (-1, 1)) for conn, scale in w_scale.items()}
+        rE0, rD0, rS0, rN0, rP0, rV0 = [np.reshape(r0[cell], (-1, 1)) for cell in self.cell_types]
+        alph_p_on_DN = self.alph_p_on_DN
+
+        # time constants and background inputs in the layout of the state vector
+        tau = np.zeros(self.N_state)
+        bg = np.zeros((max(np.size(Xbg[cell]) for cell in self.cell_types), self.N_state), dtype=self.dtype)
+        for cell in self.cell_types:
+            tau[sl[cell]] = self.taus[cell]
+            bg[:, sl[cell]] = np.reshape(Xbg[cell], (-1, 1))
+        tau[sl['G']] = self.tauG
+
+        # the exponential Euler step is an Euler step with an effective time constant, noise is scaled such that its
+        # statistics do not depend on dt
+        if method not in METHODS:
+            raise ValueError(f"Unknown integration method '{method}', use one of {METHODS}.")
+        if method == 'adaptive' and noise:
+            raise ValueError("The adaptive method is deterministic, use noise=0 or a fixed-step method.")
+        taup = self.taup
+        noise_scale = None
+        if method == 'euler_maruyama':
+            noise_scale = 1 / np.sqrt(dt)
+        elif method == 'exp_euler':
+            decay = -np.expm1(-dt / tau)
+            noise_scale = np.sqrt(tau / 2 * -np.expm1(-2 * dt / tau))[:n_rates] / (tau * decay)[:n_rates]
+            tau, taup = dt / decay, dt / -np.expm1(-dt / taup)
+        tau = tau.astype(self.dtype, copy=False)
+        if noise_scale is not None:
+            noise_scale = np.asarray(noise_scale, dtype=self.dtype)
+
+        # feedforward inputs are evaluated in chunks of time steps (cell types missing in xFF receive no input)
+        n_x = max([inputs.input_batch_size(xFF[cell]) for cell in self.cell_types if cell in xFF] + [1])
+
+        def ff_input(ts, te):
+            """Feedforward inputs for the time steps ts to te in the layout of the state vector."""
+            x = np.zeros((n_x, te-ts, self.N_state), dtype=self.dtype)
+            for cell in self.cell_types:
+                if cell in xFF:
+                    x[:, :, sl[cell]] = inputs.evaluate_input(xFF[cell], ts, te, dt)
+            return x
+
+        def syn(conn, r):
+            """Synaptic input through connection conn for presynaptic rates r of shape (n_batch, Npre)."""
+            if conn in w_scale:
+                return w_scale[conn] * apply_weights(Ws[conn], r)
+            return apply_weights(Ws[conn], r)
+
+        if fused:
+            # all block operators are applied in one product with the stacked operator, then each term is scaled by
+            # its release factor
+            operators = self.get_block_operators(w_scale, Ws)
+            W_fused = sparse.vstack([W for W, _, _ in operators], format='csr') if self.flag_sparse \
+                else np.concatenate([W for W, _, _ in operators], axis=0)
+            terms = [(slice(k*self.N_state, (k+1)*self.N_state), mod, scale)
+                     for k, (_, mod, scale) in enumerate(operators)]
+
+        # sections of the loop are only timed with a profile
+        timed = profile is not None
+        n_products = 1 if fused else len(Ws)
+
+        def currents(r, pt, xt):
+            """Input currents for states r of shape (n_batch, N_state), release probabilities pt and inputs xt."""
+            if timed:
+                profile.count('products', n_products)
 
             # release factor for NDNF->dendrite and SOM->VIP depends on flag
-            pDN = alph_p_on_DN*p[ti] + (1-alph_p_on_DN)*1 if self.flag_p_on_DN else 1
-            pVS = p[ti] if self.flag_p_on_VS else 1
-
-            # compute input currents
-            curr_rE = self.wED * rD[ti] - self.Ws['EP'] @ rP[ti] + self.Xbg['E'] + xFF['E'][ti] + xiE
-            curr_rD = self.Ws['DE'] @ rE[ti] - p[ti]*self.Ws['DS'] @ rS[ti] - pDN*self.Ws['DN'] @ cGABA[ti]\
-                      + self.Xbg['D'] + xFF['D'][ti] + xiD
-            curr_rS = self.Ws['SE'] @ rE[ti] - self.Ws['SV']@rV[ti] + self.Xbg['S'] + xFF['S'][ti] + xiS
-            curr_rN = -p[ti]*self.Ws['NS'] @ rS[ti] - self.Ws['NN'] @ rN[ti] + self.Xbg['N'] + xFF['N'][ti] + xiN
-            curr_rP = self.Ws['PE'] @ rE[ti] - self.Ws['PS'] @ rS[ti] - self.Ws['PN'] @ rN[ti] - self.Ws['PP'] @ rP[ti] \
-                      - self.Ws['PV'] @ rV[ti] + self.Xbg['P'] + xFF['P'][ti] + xiP
-            curr_rV = -pVS*self.Ws['VS']@rS[ti] -self.Ws['VN']@rN[ti] + self.Ws['VE']@rE[ti] + self.Xbg['V'] + xFF['V'][ti] + xiV
-
-            # Euler integration (pre rectification)
-            vE = vE + (-vE + curr_rE) / self.taus['E'] * dt
-            vD = vD + (-vD + curr_rD) / self.taus['D'] * dt
-            vS = vS + (-vS + curr_rS )/ self.taus['S'] * dt
-            vN = vN + (-vN + curr_rN) / self.taus['N'] * dt
-            vP = vP + (-vP + curr_rP) / self.taus['P'] * dt
-            vV = vV + (-vV + curr_rV) / self.taus['V'] * dt
-
-            # presynaptic inhibition
-            if self.flag_pre_inh:
-                p[ti+1] = p[ti] + (-p[ti] + self.g_func(np.mean(cGABA[ti]))) / self.taup * dt
-
-            # GABA spillover
-            cGABA[ti+1] = cGABA[ti] + (-cGABA[ti] + self.gamma*rN[ti]) / self.tauG * dt
-            cGABA[ti+1] = np.maximum(cGABA[ti+1], 0)  # probably not necesarry, better safe than sorry
-
-            # rectification and saving
-            rE[ti + 1] = np.maximum(vE, 0)
-            rD[ti + 1] = np.maximum(vD, 0)
-            rS[ti + 1] = np.maximum(vS, 0)
-            rN[ti + 1] = np.maximum(vN, 0)
-            rP[ti + 1] = np.maximum(vP, 0)
-            rV[ti + 1] = np.maximum(vV, 0)
-
-            # storage of additional stuff
-            if monitor_boutons:
-                other['boutons_SOM'].append((p[ti]*self.Ws['DS']@rS[ti]).flatten())
-            if monitor_dend_inh:
-                other['dend_inh_SOM'].append(p[ti]*self.Ws['DS']@rS[ti])
-                other['dend_inh_NDNF'].append(pDN*self.Ws['DN']@cGABA[ti])
-                other['soma_inh_PV'].append(self.Ws['EP']@rP[ti])
+            pDN = alph_p_on_DN*pt + (1-alph_p_on_DN)*1 if self.flag_p_on_DN else 1
+            pVS = pt if self.flag_p_on_VS else 1
+
+            if fused:
+                # compute input currents with the stacked block operators
+                release = {None: 1, 'p': pt, 'pDN': pDN, 'pVS': pVS}
+                syn_all = apply_weights(W_fused, r)
+                curr = xt
+                for sl_term, mod, scale in terms:
+                    if mod is None and scale is None:
+                        curr = curr + syn_all[:, sl_term]
+                    else:
+                        curr = curr + (release[mod] if scale is None else release[mod]*scale) * syn_all[:, sl_term]
+                return curr
+
+            rE, rD, rS, rN, rP, rV, cGABA = [r[:, sl[cell]] for cell in self.cell_types + ['G']]
+            curr_rE = self.wED * rD - syn('EP', rP) + xt[:, sl['E']]
+            curr_rD = syn('DE', rE) - pt*syn('DS', rS) - pDN*syn('DN', cGABA) + xt[:, sl['D']]
+            curr_rS = syn('SE', rE) - syn('SV', rV) + xt[:, sl['S']]
+            curr_rN = -pt*syn('NS', rS) - syn('NN', rN) + xt[:, sl['N']]
+            curr_rP = syn('PE', rE) - syn('PS', rS) - syn('PN', rN) - syn('PP', rP) - syn('PV', rV) + xt[:, sl['P']]
+            curr_rV = -pVS*syn('VS', rS) - syn('VN', rN) + syn('VE', rE) + xt[:, sl['V']]
+            return np.concatenate([curr_rE, curr_rD, curr_rS, curr_rN, curr_rP, curr_rV, self.gamma*rN], axis=1)
+
+        def derivatives(v, pt, xt):
+            """Time derivatives of the activations v and release probabilities pt, and the input currents."""
+            r = np.maximum(v, 0)
+            curr = currents(r, pt, xt)
+            dp = (-pt + self.g_func(np.mean(r[:, sl['G']], axis=1, keepdims=True))) / self.taup \
+                if self.flag_pre_inh else np.zeros_like(pt)
+            return (-v + curr) / tau, dp, curr
+
+        def adaptive_interval(v, pt, xt, h):
+            """
+            Integrate over one time step with adaptive Heun substeps (with an Euler step for error control).
+            Returns the activations and release probabilities at the end of the time step, the input currents at its
+            beginning, the last step size, the number of substeps and the largest accepted local error.
+            """
+            t_loc, n_sub, err_max = 0, 0, 0
+            dv, dp, curr = derivatives(v, pt, xt)
+            while t_loc < dt:
+                h = min(h, dt - t_loc)
+                dv2, dp2, _ = derivatives(v + h*dv, pt + h*dp, xt)
+                err = h/2 * max(np.max(np.abs(dv2 - dv) / (1 + np.abs(v))), np.max(np.abs(dp2 - dp)))
+                if err <= step_tol or h <= 1e-6 * dt:
+                    v, pt = v + h/2*(dv + dv2), pt + h/2*(dp + dp2)
+                    v[:, sl['G']] = np.maximum(v[:, sl['G']], 0)
+                    t_loc, n_sub, err_max = t_loc + h, n_sub + 1, max(err_max, err)
+                    dv, dp, _ = derivatives(v, pt, xt)
+                h = h * min(5, max(0.2, 0.9 * np.sqrt(step_tol / max(err, 1e-16))))
+            return v, pt, curr, h, n_sub, err_max
+
+        if timed:
+            profile.start()
+
+        # by default, draw initial values and noise from the streams of the model
+        rng_init = self.rng_init if rng is None else rng
+        if rng is None:
+            rng = self.rng_noise
+
+        # set up the recorder (a given recorder is used as it is, it belongs to this simulation, e.g. run_iter takes the
+        # chunks from it), monitors are computed if flagged and stored or if requested by the recorder
+        recorder = record if isinstance(record, recording.Recorder) else recording.as_recorder(record)
+        monitor_boutons = recorder.monitors('boutons_SOM', monitor_boutons)
+        monitor_dend_inh = any(recorder.monitors(name, monitor_dend_inh) for name in DEND_INH_MONITORS)
+        monitor_currents = any(recorder.monitors(name, monitor_currents) for name in CURRENT_MONITORS)
+
+        # bouton signals and inhibition are derived after the simulation if the required trajectories are stored
+        derivable = all(recorder.stores_full(name) for name in ['S', 'N', 'P', 'G', 'p'])
+        derived = []
+        if monitor_boutons and derivable and recorder.stores_full('boutons_SOM'):
+            derived, monitor_boutons = derived + ['boutons_SOM'], False
+        if monitor_dend_inh and derivable and all(recorder.stores_full(name) for name in DEND_INH_MONITORS):
+            derived, monitor_dend_inh = derived + DEND_INH_MONITORS, False
+        monitors = (['boutons_SOM'] if monitor_boutons else []) + (DEND_INH_MONITORS if monitor_dend_inh else []) \
+                   + (list(CURRENT_MONITORS) if monitor_currents else [])
+        lengths = lambda n_time: {name: n_time if name in recording.STATE_VARIABLES + DEND_INH_MONITORS
+                                  else n_time-1 for name in recording.STATE_VARIABLES + monitors}
+        sizes = {cell: sl[cell].stop - sl[cell].start for cell in self.cell_types + ['G']}
+        sizes.update({name: self.N_cells[recording.MONITOR_CELLS[name]] for name in monitors}, p=None)
+        recorder.start(n_batch, lengths(nt), sizes, self.dtype)
+        if timed:
+            profile.allocated(recorder.data, recorded=True)
+
+        # the early stopping criterion is checked after each chunk, which then spans one window
+        early_stop = stopping.as_early_stop(early_stop)
+        if early_stop is not None:
+            early_stop.start()
+            noise_chunk = min(noise_chunk, early_stop.window)
+
+        # create empty arrays for the state (rates and GABA spillover) and release probability of one chunk of time
+        # steps, with views for each cell type
+        n_chunk = max(min(noise_chunk, nt-1), 1)
+        R = np.zeros((n_batch, n_chunk+1, self.N_state), dtype=self.dtype)
+        rE, rD, rS, rN, rP, rV, cGABA = [R[:, :, sl[cell]] for cell in self.cell_types + ['G']]
+        p = np.ones((n_batch, n_chunk+1), dtype=self.dtype)
+        curr_rec = np.zeros((n_batch, n_chunk if monitor_currents else 0, self.N_state), dtype=self.dtype)
+        if timed:
+            profile.allocated(dict(state=R, p=p, currents=curr_rec))
+
+        # set initial rates/values, or continue from a snapshot of the state
+        if state is None:
+            rE[:, 0] = rng_init.normal(rE0, rE0*init_noise, size=(n_batch, self.N_cells['E']))
+            rD[:, 0] = rng_init.normal(rD0, rD0*init_noise, size=(n_batch, self.N_cells['D']))
+            rS[:, 0] = rng_init.normal(rS0, rS0*init_noise, size=(n_batch, self.N_cells['S']))
+            rN[:, 0] = rng_init.normal(rN0, rN0*init_noise, size=(n_batch, self.N_cells['N']))
+            rP[:, 0] = rng_init.normal(rP0, rP0*init_noise, size=(n_batch, self.N_cells['P']))
+            rV[:, 0] = rng_init.normal(rV0, rP0*init_noise, size=(n_batch, self.N_cells['P']))
+            cGABA[:, 0] = rN0
+            p[:, 0] = p_start
+        else:
+            if state.v.shape[-1] != self.N_state or state.n_batch not in [1, n_batch]:
+                raise ValueError(f"State of shape {state.v.shape} does not fit a batch of {n_batch} networks with "
+                                 f"{self.N_state} state variables.")
+            R[:, 0] = np.maximum(np.broadcast_to(state.v, (n_batch, self.N_state)), 0)
+            p[:, 0] = np.broadcast_to(state.p.reshape(-1), (n_batch,))
+
+        # initial values of the monitored inhibition
+        if monitor_dend_inh:
+            recorder.record('dend_inh_SOM', (p[:, :1]*syn('DS', rS[:, 0]))[:, np.newaxis], 0)
+            recorder.record('dend_inh_NDNF', syn('DN', rN[:, 0])[:, np.newaxis], 0)  # todo: include flag for pi on wDN
+            recorder.record('soma_inh_PV', syn('EP', rP[:, 0])[:, np.newaxis], 0)
+
+        # initialise activations (rates pre rectification)
+        v = R[:, 0].copy() if state is None else np.array(np.broadcast_to(state.v, (n_batch, self.N_state)),
+                                                          dtype=self.dtype)
+
+        if backend == 'numba' and not kernels.NUMBA_AVAILABLE:
+            warnings.warn("numba is not available, falling back to the numpy backend.")
+            backend = 'numpy'
+        elif backend == 'numba' and method == 'adaptive':
+            warnings.warn("The numba kernel uses fixed time steps, falling back to the numpy backend.")
+            backend = 'numpy'
+        elif backend not in ['numpy', 'numba']:
+            raise ValueError(f"Unknown backend '{backend}', use 'numpy' or 'numba'.")
+
+        if backend == 'numba':
+            kernel = kernels.select_kernel(Ws)
+            if kernel is None:
+                warnings.warn("The network is too large for the numba kernel on a single thread to be faster than "
+                              "the numpy backend, falling back to the numpy backend (use several numba threads for "
+                              "the parallel kernel, see kernels.select_kernel).")
+                backend = 'numpy'
+            else:
+                operator = kernels.combine_operators(self.get_block_operators(w_scale, Ws), n_batch)
+
+        # time integration, chunk by chunk
+        reason, stop_step = None, nt-1
+        n_steps, local_error, x_prev = 0, 0, None
+        for ts in range(0, nt-1, n_chunk):
+            if ts > 0:
+                yield ts  # the previous chunk has been stored
+            te = min(ts+n_chunk, nt-1)
+            n = te - ts
+            if timed:
+                t0 = time.perf_counter()
+                profile.count('chunks')
+                profile.count('steps', n)
+
+            # feedforward inputs and white noise of the chunk (noise is skipped if there is none), the noise is drawn
+            # in double precision for any dtype, so that float32 simulations receive the same noise
+            x = ff_input(ts, te)
+            if timed:
+                t0 = profile.lap('inputs', t0)
+            xi = rng.normal(0, noise, size=(n, n_batch, n_rates)).astype(self.dtype, copy=False) if noise \
+                else np.zeros((0, n_batch, n_rates), dtype=self.dtype)
+            if noise and noise_scale is not None:
+                xi = xi * noise_scale
+            if timed:
+                t0 = profile.lap('noise', t0)
+                profile.count('random_numbers', xi.size)
+                profile.allocated(dict(inputs=x, noise=xi))
+
+            if backend == 'numba':
+                # compiled integration with the combined block operators
+                kernel(v, R[:, :n+1], p[:, :n+1], curr_rec[:, :n], *operator, tau, bg, x, xi, dt, self.flag_pre_inh,
+                       self.b, self.r0, self.p_low, taup, alph_p_on_DN, sl['G'].start, sl['G'].stop, n_rates)
+                if timed:
+                    t0 = profile.lap('kernel', t0)
+                    profile.count('products', n * len(operator[3]))
+            else:
+                for ci in range(n):
+                    pt = p[:, ci:ci+1]
+                    xt = bg + x[:, ci]
+
+                    if method == 'adaptive':
+                        # adaptive substeps, starting with a small step where the input jumps
+                        if x_prev is None or np.any(x[:, ci] != x_prev):
+                            h = 0.1 * min(dt, np.min(tau))
+                        v, pt, curr, h, n_sub, err = adaptive_interval(v, pt, xt, h)
+                        n_steps, local_error = n_steps + n_sub, max(local_error, err)
+                        x_prev = x[:, ci]
+                        if self.flag_pre_inh:
+                            p[:, ci+1] = pt[:, 0]
+                        if timed:
+                            t0 = profile.lap('adaptive', t0)
+
+                    else:
+                        # compute input currents
+                        curr = currents(R[:, ci], pt, xt)
+                        if timed:
+                            t0 = profile.lap('connectivity', t0)
+
+                        # white noise
+                        if noise:
+                            curr[:, :n_rates] += xi[ci]
+
+                        # Euler integration (pre rectification), GABA spillover is rectified directly
+                        v = v + (-v + curr) / tau * dt
+                        v[:, sl['G']] = np.maximum(v[:, sl['G']], 0)  # probably not necesarry, better safe than sorry
+                        if timed:
+                            t0 = profile.lap('euler', t0)
+
+                        # presynaptic inhibition
+                        if self.flag_pre_inh:
+                            g = self.g_func(cGABA[:, ci].sum(axis=1) / n_gaba)  # mean spillover
+                            p[:, ci+1] = p[:, ci] + (-p[:, ci] + g) / taup * dt
+                            if timed:
+                                t0 = profile.lap('pre_inh', t0)
+
+                    # rectification and saving
+                    R[:, ci+1] = np.maximum(v, 0)
+                    if timed:
+                        t0 = profile.lap('euler', t0)
+
+                    # storage of input currents
+                    if monitor_currents:
+                        curr_rec[:, ci] = curr
+                        if timed:
+                            t0 = profile.lap('monitors', t0)
+
+            # estimate the local error of fixed time steps from the second differences of the trajectories
+            if method != 'adaptive':
+                n_steps += n
+                if not noise and n > 1:
+                    d2 = np.concatenate([R[:, 2:n+1] - 2*R[:, 1:n] + R[:, :n-1],
+                                         (p[:, 2:n+1] - 2*p[:, 1:n] + p[:, :n-1])[:, :, np.newaxis]], axis=2)
+                    local_error = max(local_error, np.max(np.abs(d2)) / 2)
+            if timed:
+                t0 = profile.lap('error', t0)
+
+            # store the chunk (monitored inhibition of each step is stored after the initial value)
+            for cell in self.cell_types + ['G']:
+                recorder.record(cell, R[:, :n, sl[cell]], ts)
+            recorder.record('p', p[:, :n], ts)
+            if timed:
+                t0 = profile.lap('recording', t0)
+            r = {cell: R[:, :n+1, sl[cell]] for cell in ['S', 'P', 'G']}
+            other = self._trajectory_monitors(r, p[:, :n+1], w_scale, monitor_boutons, monitor_dend_inh, Ws=Ws)
+            if timed:
+                t0 = profile.lap('monitors', t0)
+            for name, val in other.items():
+                recorder.record(name, val, ts+1 if name in DEND_INH_MONITORS else ts)
+            if monitor_currents:
+                for name, cell in CURRENT_MONITORS.items():
+                    recorder.record(name, curr_rec[:, :n, sl[cell]], ts)
+            if timed:
+                t0 = profile.lap('recording', t0)
+
+            # check whether to stop early (on population means)
+            if early_stop is not None:
+                pop = np.stack([np.mean(R[:, :n+1, sl[cell]], axis=2) for cell in self.cell_types + ['G']], axis=2)
+                reason = early_stop.check(pop, p[:, :n+1], te*dt, dt)
+                if timed:
+                    t0 = profile.lap('early_stop', t0)
+
+            # carry the last state over to the next chunk
+            R[:, 0] = R[:, n]
+            p[:, 0] = p[:, n]
+
+            if reason is not None:
+                stop_step = te
+                break
+
+        # store the final state, after an early stop it is held until the end (or the trajectories end at the stop)
+        hold = lambda val, k: np.broadcast_to(val, val.shape[:1] + (k,) + val.shape[2:])
+        n_hold = nt - stop_step if early_stop is not None and early_stop.extend else 1
+        if n_hold > 1:
+            yield stop_step
+        for cell in self.cell_types + ['G']:
+            recorder.record(cell, hold(R[:, :1, sl[cell]], n_hold), stop_step)
+        recorder.record('p', hold(p[:, :1], n_hold), stop_step)
+        if n_hold > 1:
+            r = {cell: hold(R[:, :1, sl[cell]], 2) for cell in ['S', 'P', 'G']}
+            other = self._trajectory_monitors(r, hold(p[:, :1], 2), w_scale, monitor_boutons, monitor_dend_inh, Ws=Ws)
+            for name, val in other.items():
+                recorder.record(name, hold(val, n_hold-1), stop_step+1 if name in DEND_INH_MONITORS else stop_step)
             if monitor_currents:
-                other['curr_rS'].append(curr_rS)
-                other['curr_rN'].append(curr_rN)
-                other['curr_rE'].append(curr_rE)
+                for name, cell in CURRENT_MONITORS.items():
+                    recorder.record(name, hold(curr_rec[:, n-1:n, sl[cell]], n_hold-1), stop_step)
 
-        return t, rE, rD, rS, rN, rP, rV, p, cGABA, other
+        n_time = stop_step + n_hold
+        integration = dict(method=method, n_steps=n_steps, local_error=None if noise else local_error)
+        final = NetworkState(v.copy(), p[:, 0].copy(), {name: (s.start, s.stop) for name, s in sl.items()},
+                             (0 if state is None else state.t) + (n_time-1)*dt,
+                             dict(init=rng_init.bit_generator.state, noise=rng.bit_generator.state))
+        data = recorder.finish(lengths(n_time))
+        if timed:
+            profile.finish()
+        return data, derived, (reason, stop_step, n_time), integration, final
+
+
+def make_seed_sequence(seed=None):
+    """
+    Create a numpy SeedSequence from a seed.
+
+    Parameters:
+    ----------
+    - seed: int, sequence of ints, SeedSequence or Generator (entropy is drawn from it); if None, the entropy is drawn
+            from the global numpy random state, so that np.random.seed makes the model reproducible
+
+    Returns:
+    -------
+    - numpy SeedSequence
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    if isinstance(seed, np.random.Generator):
+        return np.random.SeedSequence(seed.integers(2**32, size=4))
+    if seed is None:
+        return np.random.SeedSequence(np.random.randint(2**32, size=4))
+    return np.random.SeedSequence(seed)
+
+
+def apply_weights(W, r):
+    """
+    Compute synaptic inputs through a (dense or sparse) weight matrix.
+
+    Parameters:
+    ----------
+    - W: weight matrix of shape (Npost, Npre)
+    - r: presynaptic rates of shape (..., Npre), e.g. (Npre,), (B, Npre) or (B, nt, Npre)
+
+    Returns:
+    -------
+    - synaptic inputs of shape (..., Npost)
+    """
+    if sparse.issparse(W):
+        return (W @ np.reshape(r, (-1, r.shape[-1])).T).T.reshape(r.shape[:-1] + (W.shape[0],))
+    return r @ W.T
 
 
 def get_default_params(flag_mean_pop=False):
@@ -0,0 +1,148 @@
+"""
+Accuracy of simulations in single precision (NetworkModel with dtype='float32'). The protocols of the figures are
+simulated in double and single precision with the same connectivity and noise (the weights and the noise are drawn in
+double precision and rounded), and the deviations of the population rates are compared with the deviations between
+two noise realizations in double precision. Run this script to repeat the check.
+
+Results with the default parameters (heterogeneous weights, noise 0.1, seed 0), maximal absolute deviation of the
+population mean rates and release probability over all time steps (trace) and of their means over the last 500 ms
+(end):
+
+    protocol                   float32 trace   float32 end   noise trace   noise end
+    fig3_ndnf_input                  6.8e-07       2.8e-07         0.046      0.0072
+    fig4_switching                   2.3e-06         2e-06         0.055       0.018
+    fig5_transient_signals           6.6e-07       1.5e-07         0.064      0.0025
+    fig6_predictive_coding           2.3e-06       4.8e-07         0.052      0.0035
+
+The deviations in single precision are more than three orders of magnitude below those caused by the noise, and the
+network ends up in the same state after the switching pulses.
+"""
+
+import time
+import numpy as np
+
+import model_base as mb
+from inputs import Pulse
+from recording import Recorder
+
+
+# recorded population means of the protocols
+VARIABLES = ['E', 'D', 'S', 'N', 'P', 'V', 'p']
+
+
+def fig3_ndnf_input(dtype, seed, rng, noise=0.1):
+    """Constant input to NDNFs of varying strength (Figure 3A/B), as a batch."""
+    N_cells, w_mean, conn_prob, bg_inputs, taus = mb.get_default_params()
+    model = mb.NetworkModel(N_cells, w_mean, conn_prob, taus, bg_inputs, wED=1, flag_w_hetero=True, seed=seed,
+                            dtype=dtype)
+    xFF = dict(N=np.arange(-1, 1, 0.05)[:, np.newaxis, np.newaxis])
+    return model.run_batch(1500, xFF, init_noise=0, noise=noise, rng=rng, record=Recorder(VARIABLES, mean=True))
+
+
+def fig4_switching(dtype, seed, rng, noise=0.1):
+    """Positive and negative pulse to NDNFs in the bistable regime (Figure 4D-G)."""
+    N_cells, w_mean, conn_prob, bg_inputs, taus = mb.get_default_params()
+    w_mean.update(NS=1.4, DN=0.6)
+    model = mb.NetworkModel(N_cells, w_mean, conn_prob, taus, bg_inputs, wED=1, flag_w_hetero=True, seed=seed,
+                            dtype=dtype)
+    xFF = dict(N=Pulse(0.5, 1000, 2000) + Pulse(-0.5, 5000, 6000))
+    return model.run(10000, xFF, noise=noise, rng=rng, record=Recorder(VARIABLES, mean=True))
+
+
+def fig5_transient_signals(dtype, seed, rng, noise=0.1):
+    """Transient input of 100 ms to SOMs or to NDNFs (Figure 5C/D), as a batch."""
+    N_cells, w_mean, conn_prob, bg_inputs, taus = mb.get_default_params()
+    model = mb.NetworkModel(N_cells, w_mean, conn_prob, taus, bg_inputs, wED=1, flag_w_hetero=True, seed=seed,
+                            dtype=dtype)
+    xFF = dict(S=Pulse(np.array([1.5, 0]), 1000, 1100), N=Pulse(np.array([0, 1.5]), 1000, 1100))
+    return model.run_batch(5000, xFF, noise=noise, rng=rng, record=Recorder(VARIABLES, mean=True))
+
+
+def fig6_predictive_coding(dtype, seed, rng, noise=0.1):
+    """Sensory and prediction inputs in the feedback, mismatch and playback phases (Figure 6), in one simulation."""
+    N_cells, w_mean, conn_prob, bg_inputs, taus = mb.get_default_params()
+    w_mean.update(EP=2, DE=0.2, DS=1, PE=1.2, PP=0.4, PS=0.3, PV=0.15, SE=1, SV=0.5, VE=1, VS=1, NS=0.5, DN=1.5,
+                  PN=0., VN=0.1)
+    model = mb.NetworkModel(N_cells, w_mean, conn_prob, taus, bg_inputs, wED=1, flag_w_hetero=True, w_std_rel=0.01,
+                            b=0.15, seed=seed, dtype=dtype)
+    buffer, dur_stim = 2000, 2000
+    dur = 2*buffer + dur_stim
+    sensory = Pulse(1, buffer, buffer+dur_stim) + Pulse(1, 2*dur+buffer, 2*dur+buffer+dur_stim)
+    prediction = Pulse(1, buffer, buffer+dur_stim) + Pulse(1, dur+buffer, dur+buffer+dur_stim)
+    xFF = dict(E=sensory, D=prediction, P=sensory, S=sensory, V=prediction)
+    return model.run(3*dur, xFF, rE0=1, rD0=0, rS0=4, rP0=4, rV0=4, rN0=4, p0=model.g_func(4), init_noise=0,
+                     noise=noise, rng=rng, record=Recorder(VARIABLES, mean=True))
+
+
+PROTOCOLS = dict(fig3_ndnf_input=fig3_ndnf_input, fig4_switching=fig4_switching,
+                 fig5_transient_signals=fig5_transient_signals, fig6_predictive_coding=fig6_predictive_coding)
+
+
+def deviations(res1, res2, window=500):
+    """
+    Maximal absolute deviations between the recorded population means of two simulations.
+
+    Parameters:
+    ----------
+    - res1, res2: SimulationResult of the same protocol
+    - window:     number of time steps at the end over which rates are averaged
+
+    Returns:
+    -------
+    - maximal deviation over all time steps
+    - maximal deviation of the means over the last window
+    """
+    trace, end = 0, 0
+    for var in VARIABLES:
+        field = 'p' if var == 'p' else f"r{var}"
+        x1, x2 = np.asarray(getattr(res1, field), dtype=float), np.asarray(getattr(res2, field), dtype=float)
+        trace = max(trace, np.max(np.abs(x1 - x2)))
+        end = max(end, np.max(np.abs(x1[..., -window:].mean(axis=-1) - x2[..., -window:].mean(axis=-1))))
+    return trace, end
+
+
+def check_precision(dtype='float32', protocols=None, seed=0, noise=0.1, verbose=True):
+    """
+    Simulate protocols in double precision and in a lower precision and compare the deviations with those between two
+    noise realizations.
+
+    Parameters:
+    ----------
+    - dtype:     floating point type to check (see NetworkModel)
+    - protocols: list of names of protocols (see PROTOCOLS, default: all)
+    - seed:      seed of the networks
+    - noise:     level of white noise
+    - verbose:   whether to print a table of the deviations
+
+    Returns:
+    -------
+    - dictionary with the deviations of each protocol ('trace', 'end', 'noise_trace', 'noise_end', see deviations)
+      and the simulation times in both precisions ('time_float64', 'time_<dtype>', in s)
+    """
+
+    protocols = list(PROTOCOLS) if protocols is None else protocols
+    report = dict()
+    for name in protocols:
+        protocol = PROTOCOLS[name]
+        t0 = time.time()
+        ref = protocol('float64', seed, np.random.default_rng(1), noise)
+        t1 = time.time()
+        low = protocol(dtype, seed, np.random.default_rng(1), noise)
+        t2 = time.time()
+        other = protocol('float64', seed, np.random.default_rng(2), noise)  # another noise realization
+        trace, end = deviations(ref, low)
+        noise_trace, noise_end = deviations(ref, other)
+        report[name] = {'trace': trace, 'end': end, 'noise_trace': noise_trace, 'noise_end': noise_end,
+                        'time_float64': t1 - t0, f"time_{dtype}": t2 - t1}
+
+    if verbose:
+        print(f"{'protocol':<24} {dtype + ' trace':>15} {dtype + ' end':>13} {'noise trace':>13} {'noise end':>11}")
+        for name, dev in report.items():
+            print(f"{name:<24} {dev['trace']:15.2g} {dev['end']:13.2g} {dev['noise_trace']:13.2g} "
+                  f"{dev['noise_end']:11.2g}")
+
+    return report
+
+
+if __name__ in "__main__":
+    check_precision()
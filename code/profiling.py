@@ -0,0 +1,207 @@
+"""
+Instrumentation of simulations: wall time spent in the sections of the integration loop, counters of the work done
+and the memory of the recorded arrays, to find out where the time of slow simulations goes without an external
+profiler.
+"""
+
+import copy
+import time
+import tracemalloc
+import numpy as np
+
+
+# sections of the integration loop (see NetworkModel._integrate)
+SECTIONS = dict(inputs='evaluation of the feedforward inputs of a chunk',
+                noise='generation of the white noise of a chunk',
+                connectivity='input currents (products of the weight matrices with the rates)',
+                euler='Euler updates of the activations, white noise and rectification',
+                pre_inh='update of the release probability (presynaptic inhibition)',
+                adaptive='adaptive substeps (input currents and updates)',
+                kernel='compiled integration of a chunk (numba backend)',
+                error='estimate of the local error from the trajectories',
+                monitors='monitored quantities (bouton signals, inhibition and input currents)',
+                recording='storage of the recorded variables',
+                early_stop='check of the early stopping criterion')
+
+# counters of the work done
+COUNTERS = dict(chunks='chunks of time steps', steps='time steps (without substeps)',
+                products='matrix products of the input currents (the stacked block operators count as one product)',
+                random_numbers='random numbers of the white noise')
+
+
+class Profile:
+    """
+    Profile of a simulation (see NetworkModel.run): the wall time spent in each section of the integration loop (see
+    SECTIONS), counters of the work done (see COUNTERS), the size of the arrays allocated by the recorder and of the
+    working arrays of a chunk, and optionally the peak memory traced during the simulation. Each simulation times a
+    copy of the given profile (see as_profile), its report is attached to the result (SimulationResult.profile) and
+    passed to the callback.
+
+    Sections are timed with time.perf_counter around every time step, which costs about a microsecond per step;
+    without a profile the loop only checks a flag.
+    """
+
+    def __init__(self, memory=False, callback=None):
+        """
+        Parameters:
+        ----------
+        - memory:   whether to trace the peak memory of the simulation with tracemalloc (slows down simulations with
+                    many small allocations, e.g. of mean-population networks). Tracing is process-wide: if it is
+                    already on, the peak is reset, which needs python 3.9 or later; with older versions the tracing
+                    is restarted, which also discards the traces of the caller. The peak of simulations run from
+                    several threads at once includes the allocations of all of them
+        - callback: function that is called with the report at the end of each simulation, e.g. to collect the
+                    profiles of a sweep
+        """
+        self.memory = memory
+        self.callback = callback
+        self.report = None
+
+    def start(self):
+        """Reset the timers and counters at the beginning of a simulation."""
+        self.times = dict.fromkeys(SECTIONS, 0.)
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.recorded_bytes = dict()
+        self.buffer_bytes = dict()
+        self._tracing = self.memory and not tracemalloc.is_tracing()
+        if self._tracing:
+            tracemalloc.start()
+        elif self.memory:
+            # tracemalloc.reset_peak only exists from python 3.9, before the peak is reset by restarting the tracing
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            else:
+                tracemalloc.stop()
+                tracemalloc.start()
+        self._t_start = time.perf_counter()
+
+    def lap(self, section, t0):
+        """Add the time since t0 to a section and return the current time (the start of the next section)."""
+        t = time.perf_counter()
+        self.times[section] += t - t0
+        return t
+
+    def count(self, name, n=1):
+        """Increase a counter."""
+        self.counts[name] += n
+
+    def allocated(self, arrays, recorded=False):
+        """
+        Note the size of arrays (the largest size of each name is kept).
+
+        Parameters:
+        ----------
+        - arrays:   dictionary of arrays (or of objects with shape and dtype, e.g. recording.NpyWriter, whose size is
+                    that of the file)
+        - recorded: whether the arrays hold the recorded variables or are working arrays of the integration
+        """
+        sizes = self.recorded_bytes if recorded else self.buffer_bytes
+        for name, array in arrays.items():
+            if hasattr(array, 'shape') and hasattr(array, 'dtype'):
+                nbytes = int(np.prod(array.shape, dtype=int)) * np.dtype(array.dtype).itemsize
+                sizes[name] = max(sizes.get(name, 0), nbytes)
+
+    def finish(self):
+        """
+        Stop the timers at the end of a simulation, store the report and pass it to the callback.
+
+        Returns:
+        -------
+        - dictionary with the total wall time of the simulation ('wall_time', in s, for NetworkModel.run_iter
+          including the time between chunks), the time of each section ('times'), the time not spent in any section
+          ('other_time'), the counters ('counts'), the size of the recorded arrays ('recorded_bytes') and of the
+          working arrays ('buffer_bytes') by name, and the peak memory traced during the simulation ('peak_bytes',
+          None if memory is not traced)
+        """
+        wall_time = time.perf_counter() - self._t_start
+        peak = None
+        if self.memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            if self._tracing:
+                tracemalloc.stop()
+        self.report = dict(wall_time=wall_time, times=dict(self.times), other_time=wall_time - sum(self.times.values()),
+                           counts=dict(self.counts), recorded_bytes=dict(self.recorded_bytes),
+                           buffer_bytes=dict(self.buffer_bytes), peak_bytes=peak)
+        if self.callback is not None:
+            self.callback(self.report)
+        return self.report
+
+    def __repr__(self):
+        return f"Profile(memory={self.memory}, callback={self.callback})"
+
+
+def as_profile(profile):
+    """
+    Create the profile of one simulation from a profiling specification. A given profile is copied, since it holds
+    the timers during the simulation, so that it can be passed to several simulations at once.
+
+    Parameters:
+    ----------
+    - profile: None or False (no profiling), True (Profile with the default arguments), dictionary of arguments of
+               Profile, or Profile
+
+    Returns:
+    -------
+    - Profile or None
+    """
+    if profile is None or profile is False:
+        return None
+    if profile is True:
+        return Profile()
+    if isinstance(profile, dict):
+        return Profile(**profile)
+    return copy.copy(profile)
+
+
+def merge(reports):
+    """
+    Combine the reports of consecutive simulations (e.g. of the prefix and a branch, see branching.run_branches):
+    times and counters are added, sizes of arrays and peak memory are the largest of all reports.
+
+    Parameters:
+    ----------
+    - reports: list of reports (see Profile.finish), None entries are skipped
+
+    Returns:
+    -------
+    - report, or None if no simulation was profiled
+    """
+    reports = [report for report in reports if report is not None]
+    if not reports:
+        return None
+    add = lambda key: {name: sum(report[key][name] for report in reports) for name in reports[0][key]}
+    largest = lambda key: {name: max(report[key].get(name, 0) for report in reports)
+                           for name in dict.fromkeys(name for report in reports for name in report[key])}
+    peaks = [report['peak_bytes'] for report in reports if report['peak_bytes'] is not None]
+    return dict(wall_time=sum(report['wall_time'] for report in reports), times=add('times'),
+                other_time=sum(report['other_time'] for report in reports), counts=add('counts'),
+                recorded_bytes=largest('recorded_bytes'), buffer_bytes=largest('buffer_bytes'),
+                peak_bytes=max(peaks) if peaks else None)
+
+
+def summary(report):
+    """
+    Table of the time spent in each section of a report (sections in which no time was spent are left out), the
+    counters and the memory.
+
+    Parameters:
+    ----------
+    - report: report of a simulation (see Profile.finish)
+
+    Returns:
+    -------
+    - string
+    """
+    wall_time = report['wall_time']
+    share = lambda seconds: 100 * seconds / wall_time if wall_time > 0 else 0
+    lines = [f"{'section':<14} {'time (s)':>10} {'share':>7}"]
+    lines += [f"{name:<14} {seconds:10.4f} {share(seconds):6.1f}%" for name, seconds in report['times'].items()
+              if seconds > 0]
+    lines.append(f"{'other':<14} {report['other_time']:10.4f} {share(report['other_time']):6.1f}%")
+    lines.append(f"{'total':<14} {wall_time:10.4f}")
+    lines.append(', '.join(f"{name}: {value}" for name, value in report['counts'].items()))
+    lines.append(f"recorded arrays: {sum(report['recorded_bytes'].values()) / 2**20:.1f} MiB, working arrays: "
+                 f"{sum(report['buffer_bytes'].values()) / 2**20:.1f} MiB"
+                 + (f", peak traced: {report['peak_bytes'] / 2**20:.1f} MiB" if report['peak_bytes'] is not None
+                    else ''))
+    return '\n'.join(lines)
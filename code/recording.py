@@ -0,0 +1,289 @@
+"""
+Recording of simulated trajectories: selection of variables, neuron subsets, time stride and population means.
+"""
+
+import os
+import copy
+import numpy as np
+
+
+# state variables: rates of all cell types, release probability and GABA spillover
+STATE_VARIABLES = ['E', 'D', 'S', 'N', 'P', 'V', 'p', 'G']
+
+# monitored quantities and the cell type whose neurons they refer to
+MONITOR_CELLS = dict(boutons_SOM='D', dend_inh_SOM='D', dend_inh_NDNF='D', soma_inh_PV='E', curr_rS='S', curr_rN='N',
+                     curr_rE='E')
+
+
+class Recorder:
+    """
+    Specification of what is stored during a simulation (see NetworkModel.run). By default, all state variables and
+    the monitored quantities are stored for every neuron and time step.
+    """
+
+    def __init__(self, variables=None, neurons=None, stride=1, mean=False):
+        """
+        Parameters:
+        ----------
+        - variables: list of variables to store (default: all), any of STATE_VARIABLES and MONITOR_CELLS; monitored
+                     quantities in the list are computed even if the corresponding monitor flag of run is not set
+        - neurons:   dictionary of neuron indices (arrays or slices) to store for each variable, monitored quantities
+                     and the GABA spillover ('G') default to the selection of their cell type ('N' for 'G')
+        - stride:    store every stride-th time step (starting with the first)
+        - mean:      if True, store population means instead of single neurons (after the selection of neurons),
+                     can also be a list of variables for which to store means
+        """
+
+        self.variables = None if variables is None else list(variables)
+        self.neurons = dict() if neurons is None else dict(neurons)
+        self.stride = int(stride)
+        self.mean = mean
+
+        if self.stride < 1:
+            raise ValueError(f"The recording stride must be a positive integer, got {stride}.")
+        unknown = set(self.variables or []) - set(STATE_VARIABLES) - set(MONITOR_CELLS)
+        if unknown:
+            raise ValueError(f"Unknown variables {sorted(unknown)}, choose from "
+                             f"{STATE_VARIABLES + list(MONITOR_CELLS)}.")
+
+    def monitors(self, name, flag):
+        """Whether a monitored quantity is computed: if its monitor flag is set (and it is stored), or if requested."""
+        return flag if self.variables is None else name in self.variables
+
+    def records(self, name):
+        """Whether the variable is stored."""
+        return self.variables is None or name in self.variables
+
+    def averages(self, name):
+        """Whether the population mean of the variable is stored."""
+        return self.mean is True or (isinstance(self.mean, (list, tuple, set)) and name in self.mean)
+
+    def stores_full(self, name):
+        """Whether the variable is stored for all neurons and time steps."""
+        selection = self.selection(name)
+        return self.records(name) and self.stride == 1 and isinstance(selection, slice) \
+            and selection == slice(None) and not self.averages(name)
+
+    def selection(self, name):
+        """Indices of the stored neurons of a variable."""
+        cell = MONITOR_CELLS.get(name, 'N' if name == 'G' else name)
+        return self.neurons.get(name, self.neurons.get(cell, slice(None)))
+
+    def start(self, n_batch, lengths, sizes, dtype=np.float64):
+        """
+        Allocate the storage for a simulation.
+
+        Parameters:
+        ----------
+        - n_batch: batch size
+        - lengths: dictionary with the number of time points of each available variable
+        - sizes:   dictionary with the number of neurons of each available variable (None for the release probability)
+        - dtype:   floating point type of the stored values
+        """
+
+        self.dtype = np.dtype(dtype)
+        self.data = dict()
+        for name, length in lengths.items():
+            if not self.records(name):
+                continue
+            n_time = len(range(0, length, self.stride))
+            if sizes[name] is None or self.averages(name):
+                shape = (n_batch, n_time)
+            else:
+                shape = (n_batch, n_time, len(np.arange(sizes[name])[self.selection(name)]))
+            self.data[name] = self.allocate(name, shape)
+
+    def allocate(self, name, shape):
+        """Allocate the array in which a variable is stored."""
+        return np.zeros(shape, dtype=self.dtype)
+
+    def record(self, name, values, t0):
+        """
+        Store a stretch of a variable.
+
+        Parameters:
+        ----------
+        - name:   name of the variable
+        - values: array of shape (n_batch, T, N) (or (n_batch, T) for the release probability) with the values at
+                  the time points t0 to t0+T-1
+        - t0:     index of the first time point
+        """
+
+        if name not in self.data:
+            return
+        i0, values = self.select(name, values, t0)
+        if values.shape[1] > 0:
+            self.data[name][:, i0:i0+values.shape[1]] = values
+
+    def select(self, name, values, t0):
+        """
+        Stored part of a stretch of a variable (see record): time points on the stride, selected neurons or their
+        population mean.
+
+        Returns:
+        -------
+        - index of the first stored time point
+        - array of shape (n_batch, T', N') or (n_batch, T')
+        """
+        first = (-t0) % self.stride
+        values = values[:, first::self.stride]
+        if values.ndim == 3:
+            values = values[:, :, self.selection(name)]
+            if self.averages(name):
+                values = np.mean(values, axis=2)
+        return (t0 + first) // self.stride, values
+
+    def finish(self, lengths=None):
+        """
+        Return the stored variables and release the storage.
+
+        Parameters:
+        ----------
+        - lengths: dictionary with the number of simulated time points of each variable, if the simulation ended
+                   before the allocated length (default: keep the allocated length)
+
+        Returns:
+        -------
+        - dictionary of stored variables
+        """
+        data = self.data
+        del self.data
+        if lengths is not None:
+            data = {name: val[:, :len(range(0, lengths[name], self.stride))] for name, val in data.items()}
+        return data
+
+
+class DiskRecorder(Recorder):
+    """
+    Recorder that streams the stored variables into .npy files in a directory (one file per variable) while the
+    network is integrated, so that the memory used by a simulation is bounded by the size of a chunk of time steps
+    (see noise_chunk of NetworkModel.run) regardless of its duration. The returned arrays are read-only memory maps
+    of the files, which can also be loaded later with np.load(file, mmap_mode='r').
+    """
+
+    def __init__(self, path, variables=None, neurons=None, stride=1, mean=False):
+        """
+        Parameters:
+        ----------
+        - path:      directory of the files (created if needed, existing files of the same variables are overwritten)
+        - variables, neurons, stride, mean: see Recorder
+        """
+        super().__init__(variables, neurons, stride, mean)
+        self.path = path
+
+    def file(self, name):
+        """Path of the file of a variable."""
+        return os.path.join(self.path, f"{name}.npy")
+
+    def allocate(self, name, shape):
+        """Create the file of a variable."""
+        os.makedirs(self.path, exist_ok=True)
+        return NpyWriter(self.file(name), shape, self.dtype)
+
+    def finish(self, lengths=None):
+        """
+        Close the files and return the stored variables as memory maps (see Recorder.finish).
+        """
+        for writer in self.data.values():
+            writer.close()
+        self.data = {name: np.load(self.file(name), mmap_mode='r') for name in self.data}
+        return super().finish(lengths)
+
+
+class NpyWriter:
+    """
+    Array in a .npy file that is written in stretches of time points (as in Recorder.record) without keeping it in
+    memory.
+    """
+
+    def __init__(self, file, shape, dtype=np.float64, block_bytes=2**24):
+        """
+        Parameters:
+        ----------
+        - file:        path of the file
+        - shape:       shape of the array (n_batch, n_time, ...)
+        - dtype:       data type
+        - block_bytes: maximal size of the values converted and written at once (in bytes)
+        """
+        array = np.lib.format.open_memmap(file, mode='w+', dtype=dtype, shape=shape)  # writes the header
+        self.offset = array.offset
+        del array
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        self.row_bytes = int(np.prod(shape[2:], dtype=int)) * self.dtype.itemsize
+        self.block = max(block_bytes // max(self.row_bytes, 1), 1)
+        self.f = open(file, 'r+b')
+
+    def __setitem__(self, index, values):
+        """Write values of shape (n_batch, T, ...) at index (slice(None), slice(t0, t0+T))."""
+        t0 = index[1].start
+        for b in range(self.shape[0]):
+            for t in range(0, values.shape[1], self.block):
+                self.f.seek(self.offset + ((b * self.shape[1]) + t0 + t) * self.row_bytes)
+                self.f.write(np.ascontiguousarray(values[b, t:t+self.block], dtype=self.dtype).tobytes())
+
+    def close(self):
+        self.f.close()
+
+
+class ChunkRecorder(Recorder):
+    """
+    Recorder that only keeps the values received since they were last taken, e.g. one chunk of time steps at a
+    time (see NetworkModel.run_iter). Monitored quantities are computed during the simulation, since the complete
+    trajectories from which they could be derived are never stored.
+    """
+
+    def stores_full(self, name):
+        return False
+
+    def allocate(self, name, shape):
+        return []
+
+    def record(self, name, values, t0):
+        if name not in self.data:
+            return
+        i0, values = self.select(name, values, t0)
+        if values.shape[1] > 0:
+            self.data[name].append(values.copy() if values.strides[1] else values)
+
+    def take(self):
+        """
+        Values received since the last call, concatenated in time (a single stretch is returned without copying).
+
+        Returns:
+        -------
+        - dictionary of arrays of shape (n_batch, T, N) or (n_batch, T)
+        """
+        chunk = dict()
+        for name, pieces in self.data.items():
+            chunk[name] = pieces[0] if len(pieces) == 1 else np.concatenate(pieces, axis=1) if pieces else None
+            self.data[name] = []
+        return chunk
+
+    def finish(self, lengths=None):
+        """Return the values received since they were last taken (see take) and release the storage."""
+        chunk = self.take()
+        del self.data
+        return chunk
+
+
+def as_recorder(record):
+    """
+    Create the recorder of one simulation from a recording specification. A given recorder is copied, since it holds
+    the storage during the simulation, so that the same recorder can be passed to several simulations at once (e.g.
+    from several threads).
+
+    Parameters:
+    ----------
+    - record: None (store everything), dictionary of arguments of Recorder (or of DiskRecorder if it contains a
+              path), or Recorder
+
+    Returns:
+    -------
+    - Recorder
+    """
+    if record is None:
+        return Recorder()
+    if isinstance(record, dict):
+        return DiskRecorder(**record) if 'path' in record else Recorder(**record)
+    return copy.copy(record)
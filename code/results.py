@@ -0,0 +1,176 @@
+"""
+Result container of NetworkModel.run and NetworkModel.run_batch, and snapshots of the network state from which
+simulations can be continued.
+"""
+
+import json
+from collections.abc import Mapping
+import numpy as np
+
+
+class Monitors(Mapping):
+    """
+    Dictionary of monitored quantities (see NetworkModel.run). Quantities that can be derived from the stored
+    trajectories are computed on first access, with one matrix product over all time steps.
+    """
+
+    def __init__(self, stored, derived=None, derive=None):
+        """
+        Parameters:
+        ----------
+        - stored:  dictionary of monitored quantities recorded during the simulation
+        - derived: names of the quantities that are computed on first access
+        - derive:  function that takes a name and returns a dictionary with the derived quantity (and possibly others
+                   that are computed alongside)
+        """
+        self._values = dict(stored)
+        self._derived = [name for name in (derived or []) if name not in self._values]
+        self._derive = derive
+
+    def __getitem__(self, key):
+        if key not in self._values and key in self._derived:
+            self._values.update(self._derive(key))
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(list(self._values) + [name for name in self._derived if name not in self._values])
+
+    def __len__(self):
+        return len(set(self._values) | set(self._derived))
+
+    def __repr__(self):
+        return f"Monitors({list(self)})"
+
+    def __getstate__(self):
+        # derive all quantities before pickling (e.g. to send results between processes)
+        return dict(_values={key: self[key] for key in self}, _derived=[], _derive=None)
+
+
+class SimulationResult:
+    """
+    Result of a simulation with named fields. For compatibility, it can be unpacked (and indexed) like a tuple:
+        t, rE, rD, rS, rN, rP, rV, p, cGABA, other = model.run(...)
+    """
+
+    fields = ('t', 'rE', 'rD', 'rS', 'rN', 'rP', 'rV', 'p', 'cGABA', 'other')
+
+    def __init__(self, t, rE, rD, rS, rN, rP, rV, p, cGABA, other, stop_reason=None, stop_time=None,
+                 integration=None, state=None, Xbg=None, profile=None):
+        """
+        Parameters:
+        ----------
+        - t:            time array
+        - rE, ...:      arrays of rates of each cell type (None if not recorded)
+        - p:            array of release probabilities
+        - cGABA:        array of GABA spillover
+        - other:        Monitors of monitored quantities
+        - stop_reason:  reason for stopping the simulation early (see stopping.STOP_REASONS), None if it ran until
+                        the end
+        - stop_time:    time of the early stop (in ms)
+        - integration:  dictionary with the integration method, number of steps and estimated local error
+        - state:        NetworkState at the last time point, from which the simulation can be continued
+        - Xbg:          dictionary of the background inputs of the simulation
+        - profile:      report of the profile of the integration loop (see profiling.Profile.finish), None if the
+                        simulation was not profiled
+        """
+        self.t = t
+        self.rE = rE
+        self.rD = rD
+        self.rS = rS
+        self.rN = rN
+        self.rP = rP
+        self.rV = rV
+        self.p = p
+        self.cGABA = cGABA
+        self.other = other
+        self.stop_reason = stop_reason
+        self.stop_time = stop_time
+        self.integration = integration
+        self.state = state
+        self.Xbg = Xbg
+        self.profile = profile
+
+    @property
+    def total_steps(self):
+        """Number of integration steps summed over the batch (None if unknown, e.g. for the chunks of run_iter)."""
+        if self.integration is None or self.state is None:
+            return None
+        return self.integration['n_steps'] * self.state.n_batch
+
+    def __iter__(self):
+        return iter(getattr(self, field) for field in self.fields)
+
+    def __getitem__(self, index):
+        return tuple(self)[index]
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __repr__(self):
+        recorded = [field for field in self.fields[1:-1] if getattr(self, field) is not None]
+        stop = f", stop_reason='{self.stop_reason}', stop_time={self.stop_time}" if self.stop_reason else ''
+        return f"SimulationResult(nt={len(self.t)}, recorded={recorded}, other={list(self.other)}{stop})"
+
+
+class NetworkState:
+    """
+    Snapshot of the state of a network at one time point: activations (rates before rectification) of all cell
+    types and the GABA spillover in the layout of the state vector (see NetworkModel.state_slices), release
+    probability, and the states of the random streams. Passing it to NetworkModel.run (or run_batch, run_iter)
+    continues the simulation from this point; with the random streams, the continuation is the same as if the
+    simulation had not been interrupted (for the fixed-step integration methods). States can be saved to and loaded
+    from .npz files, e.g. to checkpoint long simulations.
+    """
+
+    def __init__(self, v, p, slices, t=0, rng=None):
+        """
+        Parameters:
+        ----------
+        - v:      activations of shape (N_state,) or (B, N_state) for a batch
+        - p:      release probability, scalar or array of shape (B,)
+        - slices: dictionary of the range (start, stop) of each cell type and the GABA spillover ('G') in v
+        - t:      time of the snapshot (in ms since the start of the first simulation)
+        - rng:    dictionary with the states of the random streams for the initial values ('init') and the white
+                  noise ('noise'), None to keep the streams of the model as they are when continuing
+        """
+        self.v = np.asarray(v, dtype=float)
+        self.p = np.asarray(p, dtype=float)
+        self.slices = {name: tuple(int(i) for i in sl) for name, sl in slices.items()}
+        self.t = float(t)
+        self.rng = rng
+
+    @property
+    def n_batch(self):
+        """Batch size (1 for the state of a single network)."""
+        return self.v.shape[0] if self.v.ndim == 2 else 1
+
+    def rates(self, name):
+        """Rates of a cell type or GABA spillover ('G'), of shape (N,) or (B, N)."""
+        start, stop = self.slices[name]
+        return np.maximum(self.v[..., start:stop], 0)
+
+    def __getitem__(self, name):
+        return self.p if name == 'p' else self.rates(name)
+
+    def squeeze(self):
+        """State of a single network (removes the batch axis of a batch of size one)."""
+        if self.v.ndim == 1:
+            return self
+        if self.n_batch != 1:
+            raise ValueError(f"Cannot squeeze a batch of {self.n_batch} states.")
+        return NetworkState(self.v[0], self.p.reshape(-1)[0], self.slices, self.t, self.rng)
+
+    def save(self, file):
+        """Save the state to an .npz file."""
+        np.savez(file, v=self.v, p=self.p, t=self.t, slices=json.dumps(self.slices),
+                 rng=json.dumps(self.rng, default=np.ndarray.tolist))
+
+    @classmethod
+    def load(cls, file):
+        """Load a state saved with save."""
+        with np.load(file) as f:
+            return cls(f['v'], f['p'], json.loads(str(f['slices'])), float(f['t']), json.loads(str(f['rng'])))
+
+    def __repr__(self):
+        batch = f", n_batch={self.n_batch}" if self.v.ndim == 2 else ''
+        return f"NetworkState(t={self.t}{batch}, N_state={self.v.shape[-1]})"
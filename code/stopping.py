@@ -0,0 +1,109 @@
+"""
+Early termination of simulations: stop once the network has settled, or abort if it diverges.
+"""
+
+import copy
+import numpy as np
+
+
+# reasons for stopping a simulation early
+STOP_REASONS = ['converged', 'diverged', 'nan']
+
+
+class EarlyStop:
+    """
+    Criterion for ending a simulation early (see NetworkModel.run). The criterion is checked after every window of
+    time steps on the population means of all state variables (rates of each cell type, GABA spillover) and the
+    release probability, for all networks of a batch:
+    - 'derivative': the change across the window divided by its duration is below tol (for noise-free simulations)
+    - 'variance':   the standard deviation within the window is below tol (for noise-free simulations)
+    - 'mean':       the average over the window differs from that of the previous window by less than tol (robust
+                    to noise)
+    The simulation is aborted in any window in which a rate exceeds max_rate or a value is not finite.
+    Early stopping assumes that the inputs are constant after the stop, e.g. use min_dur to wait for the end of a
+    stimulus.
+    """
+
+    def __init__(self, criterion='derivative', window=100, tol=1e-6, min_dur=0, max_rate=1e4, extend=True):
+        """
+        Parameters:
+        ----------
+        - criterion: 'derivative', 'variance' or 'mean' (see above)
+        - window:    number of time steps between checks
+        - tol:       tolerance of the criterion (per ms for 'derivative')
+        - min_dur:   time (in ms) before which the simulation does not stop as converged
+        - max_rate:  rate above which the network is considered to diverge
+        - extend:    if True, the final state is held until the end of the simulation so that all arrays keep their
+                     length, otherwise the trajectories end at the stop
+        """
+
+        if criterion not in ['derivative', 'variance', 'mean']:
+            raise ValueError(f"Unknown criterion '{criterion}', use 'derivative', 'variance' or 'mean'.")
+        if window < 1:
+            raise ValueError(f"The window must be a positive number of time steps, got {window}.")
+
+        self.criterion = criterion
+        self.window = int(window)
+        self.tol = tol
+        self.min_dur = min_dur
+        self.max_rate = max_rate
+        self.extend = extend
+
+    def start(self):
+        """Reset the criterion at the beginning of a simulation."""
+        self.previous = None
+
+    def check(self, pop, p, t_end, dt):
+        """
+        Check the criterion on a window of time steps.
+
+        Parameters:
+        ----------
+        - pop:   population means of the state variables of shape (n_batch, T+1, n_pop), starting with the last state
+                 of the previous window
+        - p:     release probabilities of shape (n_batch, T+1)
+        - t_end: time at the end of the window (in ms)
+        - dt:    time step (in ms)
+
+        Returns:
+        -------
+        - reason for stopping (see STOP_REASONS) or None to continue
+        """
+
+        start, values = np.split(np.concatenate([pop, p[:, :, np.newaxis]], axis=2), [1], axis=1)
+        if not np.all(np.isfinite(values)):
+            return 'nan'
+        if np.max(pop) > self.max_rate:
+            return 'diverged'
+        if values.shape[1] < self.window:
+            return None
+
+        if self.criterion == 'derivative':
+            change = np.abs(values[:, -1] - start[:, 0]) / (self.window * dt)
+        elif self.criterion == 'variance':
+            change = np.std(values, axis=1)
+        else:
+            mean, self.previous = self.previous, np.mean(values, axis=1)
+            if mean is None:
+                return None
+            change = np.abs(self.previous - mean)
+
+        return 'converged' if t_end >= self.min_dur and np.max(change) < self.tol else None
+
+
+def as_early_stop(early_stop):
+    """
+    Create the early stopping criterion of one simulation from a specification. A given criterion is copied, since
+    it keeps the previous window during the simulation, so that it can be passed to several simulations at once.
+
+    Parameters:
+    ----------
+    - early_stop: None (no early stopping), dictionary of arguments of EarlyStop, or EarlyStop
+
+    Returns:
+    -------
+    - EarlyStop or None
+    """
+    if isinstance(early_stop, dict):
+        return EarlyStop(**early_stop)
+    return copy.copy(early_stop)
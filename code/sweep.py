@@ -0,0 +1,327 @@
+"""
+Parameter sweeps: simulate networks for all combinations of a grid of parameter overrides, distributed over a pool of
+worker processes.
+"""
+
+import os
+import inspect
+import itertools
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+import model_base as mb
+import branching
+from caching import content_seed
+from recording import Recorder
+
+try:
+    from threadpoolctl import threadpool_limits
+    THREADPOOLCTL_AVAILABLE = True
+except ImportError:
+    THREADPOOLCTL_AVAILABLE = False
+
+
+# parameter dictionaries of get_default_params
+PARAM_SETS = ['N_cells', 'w_mean', 'conn_prob', 'bg_inputs', 'taus']
+
+# environment variables that set the number of threads of BLAS and OpenMP libraries
+THREAD_VARIABLES = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS',
+                    'NUMEXPR_NUM_THREADS']
+
+# output names of the recorded variables (see simulate)
+RESULT_FIELDS = dict(E='rE', D='rD', S='rS', N='rN', P='rP', V='rV', p='p', G='cGABA')
+
+# thread limits of a worker process
+_thread_limits = None
+
+
+class SweepResult:
+    """
+    Results of a parameter sweep as labeled arrays. Each output is an array with one axis per swept parameter (in the
+    order of the grid), followed by the axes of the output of a single point.
+    """
+
+    def __init__(self, axes, data):
+        """
+        Parameters:
+        ----------
+        - axes: dictionary of the values of each swept parameter
+        - data: dictionary of output arrays
+        """
+        self.axes = axes
+        self.data = data
+
+    @property
+    def dims(self):
+        """Names of the swept parameters."""
+        return list(self.axes)
+
+    def __getitem__(self, name):
+        return self.data[name]
+
+    def __contains__(self, name):
+        return name in self.data
+
+    def keys(self):
+        return self.data.keys()
+
+    def sel(self, **coords):
+        """
+        Select points of the sweep by parameter values.
+
+        Parameters:
+        ----------
+        - coords: value of a swept parameter (the axis is removed) or list of values (the axis is kept), e.g.
+                  sel(**{'w_mean.NS': 1.2})
+
+        Returns:
+        -------
+        - SweepResult
+        """
+        index, axes = [], dict()
+        for dim, values in self.axes.items():
+            if dim not in coords:
+                index.append(slice(None))
+                axes[dim] = values
+                continue
+            selected = np.atleast_1d(coords[dim])
+            positions = [self._position(dim, value) for value in selected]
+            if np.ndim(coords[dim]) == 0:
+                index.append(positions[0])
+            else:
+                index.append(positions)
+                axes[dim] = values[positions]
+        unknown = set(coords) - set(self.axes)
+        if unknown:
+            raise ValueError(f"Unknown parameters {sorted(unknown)}, the sweep varies {self.dims}.")
+        return SweepResult(axes, {name: _select(values, index) for name, values in self.data.items()})
+
+    def _position(self, dim, value):
+        """Index of a parameter value on its axis."""
+        values = self.axes[dim]
+        if values.dtype.kind in 'fc':
+            matches = np.flatnonzero(np.isclose(values, value))
+        else:
+            matches = np.flatnonzero(values == value)
+        if len(matches) == 0:
+            raise ValueError(f"{dim}={value} is not part of the sweep.")
+        return matches[0]
+
+    def __repr__(self):
+        axes = ', '.join(f"{dim}: {len(values)}" for dim, values in self.axes.items())
+        return f"SweepResult(axes=({axes}), outputs={list(self.data)})"
+
+
+def _select(values, index):
+    """Index an array with an integer or list of integers per axis (outer indexing)."""
+    for axis in reversed(range(len(index))):
+        values = np.take(values, index[axis], axis=axis) if not isinstance(index[axis], slice) else values
+    return values
+
+
+def default_params(flag_mean_pop=False, **kwargs):
+    """
+    Base parameter set of a sweep: the default parameter dictionaries (see model_base.get_default_params) and further
+    arguments of the function that is evaluated for each point (e.g. of simulate).
+
+    Parameters:
+    ----------
+    - flag_mean_pop: if true, all neuron numbers are set to 1
+    - kwargs:        further parameters
+
+    Returns:
+    -------
+    - dictionary of parameters
+    """
+    params = dict(zip(PARAM_SETS, mb.get_default_params(flag_mean_pop=flag_mean_pop)))
+    params.update(kwargs)
+    return params
+
+
+def apply_overrides(params, overrides):
+    """
+    Create a parameter set with overrides, without changing the base parameters.
+
+    Parameters:
+    ----------
+    - params:    dictionary of parameters
+    - overrides: dictionary of new values, either of a parameter (e.g. 'flag_pre_inh') or of an entry of a
+                 dictionary parameter, separated by a dot (e.g. 'w_mean.NS' or 'xFF.N')
+
+    Returns:
+    -------
+    - dictionary of parameters
+    """
+    params = {key: dict(value) if isinstance(value, dict) else value for key, value in params.items()}
+    for key, value in overrides.items():
+        name, _, entry = key.partition('.')
+        if not entry:
+            params[name] = value
+        elif isinstance(params.get(name, dict()), dict):
+            params[name] = params.get(name, dict())
+            params[name][entry] = value
+        else:
+            raise ValueError(f"Cannot override '{key}', parameter '{name}' is not a dictionary.")
+    return params
+
+
+def simulate(N_cells, w_mean, conn_prob, bg_inputs, taus, dur=1000, dt=1, xFF=None, window=None,
+             variables=('E', 'D', 'S', 'N', 'P', 'V', 'p', 'G'), count_steps=False, **kwargs):
+    """
+    Simulate one network of a sweep and return the population means of the rates averaged over the end of the
+    simulation.
+
+    Parameters:
+    ----------
+    - N_cells, w_mean, conn_prob, bg_inputs, taus: parameter dictionaries (see model_base.get_default_params)
+    - dur:       duration of the simulation (in ms)
+    - dt:        integration time step (in ms)
+    - xFF:       dictionary of inputs to the cells
+    - window:    duration (in ms) at the end of the simulation over which rates are averaged (default: last time step)
+    - variables:   state variables to return (see recording.STATE_VARIABLES)
+    - count_steps: whether to also return the number of integration steps ('n_steps', e.g. for benchmarks)
+    - kwargs:      arguments of NetworkModel (e.g. flag_pre_inh, seed) and of NetworkModel.run (e.g. noise,
+                   early_stop)
+
+    Returns:
+    -------
+    - dictionary of the averaged population means of the variables
+    """
+
+    model, run_args = _make_model(N_cells, w_mean, conn_prob, bg_inputs, taus, kwargs)
+    res = model.run(dur, dict() if xFF is None else xFF, dt=dt, record=Recorder(variables, mean=True), **run_args)
+    outputs = _window_means(res, dt, window, variables)
+    if count_steps:
+        outputs['n_steps'] = res.total_steps
+    return outputs
+
+
+def simulate_branches(N_cells, w_mean, conn_prob, bg_inputs, taus, branches, t_branch, dur=1000, dt=1,
+                      window=None, variables=('E', 'D', 'S', 'N', 'P', 'V', 'p', 'G'), branch_noise='independent',
+                      count_steps=False, **kwargs):
+    """
+    Simulate one network of a sweep for several inputs that only differ after t_branch, with the common beginning
+    simulated once (see branching.run_branches), and return the averaged population means like simulate.
+
+    Parameters:
+    ----------
+    - branches:     list of dictionaries of inputs to the cells
+    - t_branch:     time at which the inputs start to differ (in ms)
+    - branch_noise: noise of the branches, 'independent' or 'common' (see branching.fork)
+    - count_steps:  whether to also return the number of integration steps of all branches ('n_steps', the
+                    common beginning counts once per branch)
+    - all other parameters: see simulate
+
+    Returns:
+    -------
+    - dictionary of the averaged population means of the variables, with a leading axis of the branches
+    """
+
+    model, run_args = _make_model(N_cells, w_mean, conn_prob, bg_inputs, taus, kwargs)
+    results = branching.run_branches(model, dur, t_branch, branches, branch_noise=branch_noise, dt=dt,
+                                     record=Recorder(variables, mean=True), **run_args)
+    outputs = [_window_means(res, dt, window, variables) for res in results]
+    outputs = {var: np.stack([out[var] for out in outputs]) for var in variables}
+    if count_steps:
+        outputs['n_steps'] = sum(res.total_steps for res in results)
+    return outputs
+
+
+def _make_model(N_cells, w_mean, conn_prob, bg_inputs, taus, kwargs):
+    """Create the network of a sweep point and return it with the remaining arguments of NetworkModel.run."""
+    model_args = inspect.signature(mb.NetworkModel).parameters
+    model = mb.NetworkModel(N_cells, w_mean, conn_prob, taus, bg_inputs,
+                            **{key: value for key, value in kwargs.items() if key in model_args})
+    return model, {key: value for key, value in kwargs.items() if key not in model_args}
+
+
+def _window_means(res, dt, window, variables):
+    """Recorded population means averaged over the last window (in ms) of a simulation."""
+    n_window = 1 if window is None else max(int(window / dt), 1)
+    return {var: np.mean(getattr(res, RESULT_FIELDS[var])[-n_window:], axis=0) for var in variables}
+
+
+def run_sweep(func, grid, base=None, n_workers=None, threads_per_worker=1, seed=None, mp_context='spawn'):
+    """
+    Evaluate a function for all combinations of parameter overrides, distributed over a pool of worker processes.
+    Points are handed out one at a time, so that workers that finish early take on the remaining points. Each point
+    that does not set a seed gets its own seed, derived from the root seed and its overrides (see
+    caching.content_seed), so results do not depend on the number of workers or the order in which points are
+    simulated, and points with the same parameters in different sweeps can share cached results (func then has to
+    accept a seed argument).
+
+    Parameters:
+    ----------
+    - func:               function that takes the parameters as keyword arguments and returns a dictionary of
+                          outputs (scalars or arrays of the same shape for all points) or a single output; it has
+                          to be defined at module level (e.g. simulate) so that it can be sent to the workers
+    - grid:               dictionary of lists of values for each swept parameter (see apply_overrides for names)
+    - base:               dictionary of parameters that are common to all points (see default_params)
+    - n_workers:          number of worker processes (default: number of available cores), 1 runs all points in
+                          this process
+    - threads_per_worker: number of BLAS/OpenMP threads of each worker
+    - seed:               root seed of the sweep (see model_base.make_seed_sequence)
+    - mp_context:         start method of the worker processes
+
+    Returns:
+    -------
+    - SweepResult
+    """
+
+    base = dict() if base is None else base
+    axes = {name: np.asarray(values) for name, values in grid.items()}
+    shape = tuple(len(values) for values in grid.values())
+    points = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+    if 'seed' not in grid and 'seed' not in base:
+        root = mb.make_seed_sequence(seed)
+        for point in points:
+            point['seed'] = content_seed(root, point)
+
+    if n_workers is None:
+        n_workers = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    n_workers = max(min(n_workers, len(points)), 1)
+
+    outputs = [None] * len(points)
+    if n_workers == 1:
+        for i, point in enumerate(points):
+            outputs[i] = func(**apply_overrides(base, point))
+    else:
+        context = multiprocessing.get_context(mp_context)
+        with _limit_threads(threads_per_worker), ProcessPoolExecutor(n_workers, mp_context=context,
+                                                                     initializer=_init_worker,
+                                                                     initargs=(threads_per_worker,)) as pool:
+            futures = {pool.submit(func, **apply_overrides(base, point)): i for i, point in enumerate(points)}
+            for future in as_completed(futures):
+                outputs[futures[future]] = future.result()
+
+    # stack the outputs of all points into arrays with one axis per swept parameter
+    outputs = [out if isinstance(out, dict) else dict(value=out) for out in outputs]
+    data = {name: np.reshape(np.stack([np.asarray(out[name]) for out in outputs]),
+                             shape + np.shape(outputs[0][name])) for name in outputs[0]}
+
+    return SweepResult(axes, data)
+
+
+@contextmanager
+def _limit_threads(n_threads):
+    """Set the number of BLAS/OpenMP threads in the environment that worker processes inherit."""
+    previous = {var: os.environ.get(var) for var in THREAD_VARIABLES}
+    os.environ.update({var: str(n_threads) for var in THREAD_VARIABLES})
+    try:
+        yield
+    finally:
+        for var, value in previous.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+
+def _init_worker(n_threads):
+    """Limit the BLAS/OpenMP threads of a worker process (for libraries that were loaded before the environment was
+    set, e.g. in forked workers)."""
+    global _thread_limits
+    if THREADPOOLCTL_AVAILABLE:
+        _thread_limits = threadpool_limits(limits=n_threads)
@@ -0,0 +1,38 @@
+"""
+Tests of the construction of weight matrices of the network model (run with pytest from the code directory).
+"""
+
+import numpy as np
+import pytest
+import model_base as mb
+
+
+def make_model(seed=0):
+    N_cells, w_mean, conn_prob, bg_inputs, taus = mb.get_default_params(flag_mean_pop=False)
+    return mb.NetworkModel(N_cells, w_mean, conn_prob, taus, bg_inputs, seed=seed)
+
+
+@pytest.mark.parametrize('sampling', ['vectorized', 'per_row'])
+@pytest.mark.parametrize('Npre, Npost, c_prob', [(10, 5, 0.01), (3, 4, 0.1), (1, 3, 0.4), (2, 2, 0.6), (1, 1, 0.5)])
+def test_sparse_matches_dense_for_small_populations(Npre, Npost, c_prob, sampling):
+    # in-degrees that round to zero give empty rows (in both formats)
+    n_in = 1 if Npre == Npost == 1 else int(np.round(c_prob * Npre))
+    W_dense = make_model().make_weight_mat(Npre, Npost, c_prob, 1.0, sampling=sampling)
+    W_sparse = make_model().make_weight_mat(Npre, Npost, c_prob, 1.0, sparse_format=True, sampling=sampling)
+    assert W_sparse.shape == W_dense.shape == (Npost, Npre)
+    np.testing.assert_array_equal(W_sparse.toarray(), W_dense)
+    np.testing.assert_array_equal(np.diff(W_sparse.indptr), n_in)
+
+
+def test_sparse_without_presynaptic_partners():
+    W = make_model().make_weight_mat(10, 5, 0.01, 1.0, sparse_format=True)
+    assert W.shape == (5, 10)
+    assert W.nnz == 0
+
+
+@pytest.mark.parametrize('sparse_format', [False, True])
+def test_fixed_in_degree_without_autapses(sparse_format):
+    W = make_model().make_weight_mat(40, 40, 0.3, 1.0, no_autapse=True, sparse_format=sparse_format)
+    W = W.toarray() if sparse_format else W
+    np.testing.assert_array_equal(np.count_nonzero(W, axis=1), 12)
+    assert np.all(np.diag(W) == 0)